@@ -1,85 +1,58 @@
 # importing os module
 import os
-import time
-from tqdm import tqdm
+import sys
+import glob
+import json
+import hashlib
 import pandas as pd
-import geopandas as gpd
-import seaborn as sns
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import sqlalchemy as sql
-from glob import glob
-import os
-import sys
-import pickle
-import datetime
 
 sys.path.append('..')
 pd.options.mode.chained_assignment = None
 
-from routee.models.randomForest import randomForest
-from routee.models.explicitBin import explicitBin
+from model_registry import default_registry
+from intermediate_store import read_table
+from lookup_cache import load_lookup, join_volume
+from energy_store import write_energy, read_energy_arrays
+from instrumentation import span, timed, write_report, count
 
 import warnings
 warnings.filterwarnings('ignore')
 
-font = {'family' : 'normal',
-        'weight' : 'normal',
-        'size'   : 18}
-matplotlib.rc('font', **font)
 # Command to execute
 # Using Windows OS command
 
 
 
-###############################
-#         RUN RSCRIPTS        #
-###############################
-def retreive_tomtom_do_volume_estimate(Date):
-    # cmd = "Rscript post_api.R " + Date   #runs a post requests to TomTom to prepare data
-    # os.system(cmd)
-    # for i in tqdm(range(t)):     #Takes a while for TomTom to prepare data so this is a automatic delay before we start continuously requesting the data
-    #     time.sleep(1)
-    #
-    # print("We Waited long enough...here goes nothing")
-    cmd =  "Rscript get_api.R " + Date #requests data till it's ready
-    os.system(cmd)
-    cmd = "export KMP_DUPLICATE_LIB_OK=TRUE"
-    os.system(cmd)
-    cmd = "Rscript input_data.R " + Date #cleans data and adds features
-    os.system(cmd)
-    cmd = "python estimate_volume.py " + Date #uses model weights to estimate link-wise volume estimates
-    os.system(cmd)
-    # cmd = "Rscript visualize.R " + Date + " 1 8 11 17 23"
-    # os.system(cmd)
-
 ################################
 #        MAP MATCHING          #
 ################################
 def read_in_files(Date):
-    pred_path = Date + '/daily_data_pred.csv'
-    volume = pd.read_csv(pred_path)
+    with span('read_in_files') as s:
+        pred_path = Date + '/daily_data_pred'
+        volume = read_table(pred_path, columns=['Id', 'HOUR', 'AvgSp', 'pred_volume'])
 
-    lookupTable = pd.read_csv("2020_TomTom_TPO.csv")
-    lookupTable.drop(columns=['Unnamed: 0'], inplace=True)
+        lookupTable = load_lookup("2020_TomTom_TPO.csv")
+        s.rows = len(volume)
     return lookupTable, volume
 
+@timed()
 def flattenDataFrame(volume):
     tmp = volume.pivot(index='Id', columns='HOUR', values=['AvgSp', 'pred_volume'])
     volume_flat = pd.DataFrame()
 
-    for t in tqdm(tmp['AvgSp'].columns.tolist()):
+    for t in tmp['AvgSp'].columns.tolist():
         volume_flat['speed_' + str(int(t))] = tmp['AvgSp'][t]
         volume_flat['volume_' + str(int(t))] = tmp['pred_volume'][t]
     volume_flat['TomTomId'] = tmp.index
     return volume_flat
 
-def mergeVolAndSumo(df,volume_flat):
-    df_merged = df.merge(volume_flat, left_on='tomId', right_on='Id')
-    df_merged.drop(columns=['tomId'],inplace=True)
+@timed()
+def mergeVolAndSumo(lookupTable,volume_flat):
+    df_merged = join_volume(lookupTable, volume_flat)
     return df_merged
-def map_match():
+@timed()
+def map_match(Date):
     lookupTable, volume = read_in_files(Date)
     volume_flat = flattenDataFrame(volume)
     merged_df= mergeVolAndSumo(lookupTable,volume_flat)
@@ -108,11 +81,17 @@ def update_colnames(df, direction):
 #     speed_vol_AB_df = update_colnames(speed_vol_AB_df, 'AB')
 #     speed_vol_BA_df = update_colnames(speed_vol_BA_df, 'BA')
 
+@timed()
 def import_vehicle_models():
-    explicitbin_in = explicitBin('Vehicle_Models/gasoline_conv_Volkswagen_Tiguan_36000_explicitbin')
-    explicitbin_in.read_model('Vehicle_Models/gasoline_conv_Volkswagen_Tiguan_36000_explicitbin.pkl')
-    return explicitbin_in
+    # loaded once per process by the registry, rates table memory-mapped
+    return default_registry().get('gasoline_conv_Volkswagen_Tiguan_36000_explicitbin')
+
+def import_fleet(fleet_shares):
+    # fleet_shares: {model file name in Vehicle_Models/ (no .pkl): fleet share}
+    models = default_registry()
+    return {name: (models.get(name), float(share)) for name, share in fleet_shares.items()}
 
+@timed()
 def merge_net_speed_vol(speed_vol_AB_df,speed_vol_BA_df):
     net_merged_AB = pd.merge(left=net, right=speed_vol_AB_df, how='left', left_on='ID', right_on='sumoId')
     net_merged_AB = net_merged_AB.drop('sumoId',axis=1)
@@ -126,7 +105,194 @@ def extract_extra_links(net):
     net = net[net['ROAD_FLAG'] != 900] #network additions
     return net
 
-def build_energy_estimate(net_merged_speed_vol,Date):
+DIRECTIONS = ['AB', 'BA']
+HOURS = range(24)
+ENERGY_COLUMNS = ['ID','volume','speed_mph_float','miles','energy','energy_per_mile','grade_percent_float','num_lanes_int','geometry']
+# gallons of gasoline equivalent per unit, to sum a fleet with mixed fuels or energy units
+GGE_PER_UNIT = {'gallons': 1.0, 'diesel_gallons': 1.136, 'esskwhoutach': 1/33.4}
+
+def energy_unit(name, model):
+    # diesel gallons by the fuel of the model metadata if set, else the Vehicle_Models name prefix
+    fuel = getattr(model, 'fuel', None) or os.path.basename(name).split('_')[0]
+    if model.energy == 'gallons' and fuel == 'diesel':
+        return 'diesel_gallons'
+    return model.energy
+
+def stack_speed_volume(net_merged_speed_vol, kind):
+    # wide speed_<drc>_<h> / volume_<drc>_<h> columns -> (link x direction x hour) array
+    return np.stack([net_merged_speed_vol[[kind + '_' + drc + '_' + str(h) for h in HOURS]].values.astype(float)
+                     for drc in DIRECTIONS], axis=1)
+
+def fleet_rates(fleet, features, keys=None):
+    """Gather the energy rate of every vehicle in the fleet. Vehicles whose
+    models share features and bin edges (all of Vehicle_Models/ do) are
+    binned once and gathered with the same positions from their rate tables, models
+    in interpolate mode are interpolated one by one. With keys (one per link
+    and direction, shaped like the static features, see link_keys) the bins
+    of static features come from the model's per-link cache.
+
+    Returns a dict of vehicle name -> rates broadcast over the feature arrays.
+    """
+    groups = {}
+    rates = {}
+    for name, (model, share) in fleet.items():
+        if model.interpolate:
+            rates[name] = model.interp_rates([features[f_i] for f_i in model.features])
+            continue
+        if getattr(model, 'rate_table', None) is None:
+            model.compile_rates()
+        signature = tuple((f_i, tuple(model.attrb_dict[f_i])) for f_i in model.features)
+        groups.setdefault(signature, []).append(name)
+
+    for names in groups.values():
+        model = fleet[names[0]][0]
+        bin_idx = []
+        for f_i in model.features:
+            values = features[f_i]
+            if keys is not None and f_i in model.static_features and np.shape(values) == keys.shape:
+                bin_idx.append(model.cached_bin_index(f_i, keys.ravel(), np.ravel(values)).reshape(keys.shape))
+            else:
+                bin_idx.append(model.bin_index(f_i, values))
+        flat_idx = model.flat_index(bin_idx)
+        for name in names:
+            # raveled once per model, a trailing NaN cell catches the -1 positions
+            vehicle = fleet[name][0]
+            if getattr(vehicle, 'padded_rates', None) is None:
+                vehicle.compile_padded_rates()
+            rates[name] = vehicle.padded_rates[flat_idx]
+    return rates
+
+def kernel_inputs(net_merged_speed_vol):
+    # speed, volume (link x direction x hour) and static grade, lanes, length broadcastable against them
+    speed = stack_speed_volume(net_merged_speed_vol, 'speed')
+    volume = stack_speed_volume(net_merged_speed_vol, 'volume')
+    grade = net_merged_speed_vol[[drc + '_grade_p' for drc in DIRECTIONS]].values.astype(float)[:, :, None]
+    lanes = net_merged_speed_vol[[drc + '_LANES' for drc in DIRECTIONS]].values.astype(int)[:, :, None]
+    miles = net_merged_speed_vol['Length'].values.astype(float)[:, None, None]
+    return speed, volume, grade, lanes, miles
+
+def link_keys(net_merged_speed_vol):
+    # one integer key per link and direction (link x direction x 1), grade and lanes differ by direction
+    ids = net_merged_speed_vol['ID'].values.astype(np.int64)
+    return (2*ids[:, None] + np.arange(len(DIRECTIONS)))[:, :, None]
+
+def fleet_version(fleet, columns):
+    # changes with any model's rates, bin edges, units, share or interpolate mode,
+    # or with the output columns
+    sha = hashlib.sha256(json.dumps(list(columns)).encode())
+    for name, (model, share) in sorted(fleet.items()):
+        if getattr(model, 'rate_table', None) is None:
+            model.compile_rates()
+        sha.update(json.dumps([name, share, model.energy, model.distance, model.features]).encode())
+        for edges in model.bin_edges:
+            sha.update(edges.tobytes())
+        sha.update(model.rate_table.tobytes())
+        if model.interpolate:
+            sha.update(b'interpolate')
+    return np.uint64(int.from_bytes(sha.digest()[:8], 'little'))
+
+def input_fingerprints(net_merged_speed_vol, fleet, columns):
+    """64-bit fingerprint of the kernel inputs (speed, volume, grade, lanes,
+    length) of every link, direction and hour, seeded with the fleet model
+    version. Never 0, which marks rows missing from the energy store.
+    """
+    speed, volume, grade, lanes, miles = kernel_inputs(net_merged_speed_vol)
+    fingerprints = np.full(speed.shape, fleet_version(fleet, columns), dtype=np.uint64)
+    for values in (speed, volume, grade, lanes, miles):
+        # one bit pattern for NaN and for -0.0/0.0
+        values = np.where(np.isnan(values), np.nan, values.astype(float)) + 0.0
+        fingerprints = fingerprints ^ values.view(np.uint64)
+        # splitmix64 finalizer
+        fingerprints = (fingerprints ^ (fingerprints >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        fingerprints = (fingerprints ^ (fingerprints >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        fingerprints = fingerprints ^ (fingerprints >> np.uint64(31))
+    return np.where(fingerprints == 0, np.uint64(1), fingerprints)
+
+def energy_kernel(net_merged_speed_vol, fleet):
+    """Predict energy and the derived per-mile/per-lane metrics for every
+    link, direction and hour in one pass. Static link features are binned
+    once and broadcast across the 24 hours.
+
+    fleet maps vehicle name -> (explicitBin model, fleet share). 'energy' is
+    the share-weighted fleet energy, in the models' energy unit or in gallons
+    of gasoline equivalent when the fuels or units differ (see energy_unit),
+    and 'energy_<name>' the energy of each vehicle in its own unit.
+
+    Returns a dict of (link x direction x hour) arrays keyed by column name.
+    """
+    speed, volume, grade, lanes, miles = kernel_inputs(net_merged_speed_vol)
+    shape = speed.shape
+
+    features = {'speed_mph_float': speed, 'grade_percent_float': grade, 'num_lanes_int': lanes}
+    rates = fleet_rates(fleet, features, link_keys(net_merged_speed_vol))
+    units = {name: energy_unit(name, model) for name, (model, share) in fleet.items()}
+    total_share = sum(share for model, share in fleet.values())
+
+    # rows explicitBin.predict would drop come back as NaN, same as the index-aligned assignment
+    missing = np.isnan(speed) | np.isnan(grade) | np.isnan(miles)
+    metrics = {}
+    energy = 0.0
+    for name, (model, share) in fleet.items():
+        metrics['energy_' + name] = np.where(missing, np.nan, (rates[name]/100.0)*miles)
+        to_fleet_unit = 1.0 if len(set(units.values())) == 1 else GGE_PER_UNIT[units[name]]
+        energy = energy + (share/total_share)*to_fleet_unit*metrics['energy_' + name]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        energy_per_mile = energy/miles
+        energy_per_mile_per_lane = energy_per_mile/lanes.astype(float)
+        energy_per_mile_per_lane_grade_adj = energy_per_mile_per_lane/(grade/100.0)
+
+    metrics.update({'volume': volume,
+                    'speed_mph_float': speed,
+                    'grade_percent_float': np.broadcast_to(grade, shape),
+                    'num_lanes_int': np.broadcast_to(lanes, shape),
+                    'miles': np.broadcast_to(miles, shape),
+                    'energy': energy,
+                    'energy_density': energy*volume,
+                    'energy_per_mile': energy_per_mile,
+                    'energy_density_per_mile': energy_per_mile*volume,
+                    'energy_per_mile_per_lane': energy_per_mile_per_lane,
+                    'energy_density_per_mile_per_lane': energy_per_mile_per_lane*volume,
+                    'energy_per_mile_per_lane_grade_adj': energy_per_mile_per_lane_grade_adj,
+                    'energy_density_per_mile_per_lane_grade_adj': energy_per_mile_per_lane_grade_adj*volume})
+    return metrics
+
+def energy_tables(net_merged_speed_vol, metrics, columns=ENERGY_COLUMNS):
+    # slice the kernel output into the drc_hour tables of links that carry lanes in that direction
+    results_spvol_drc = {}
+    for d, drc in enumerate(DIRECTIONS):
+        rows = metrics['num_lanes_int'][:, d, 0] > 0
+        net_selected = net_merged_speed_vol.loc[rows, ['ID', 'geometry']]
+        for hour_of_day in HOURS:
+            net_slice = net_selected.assign(**{col: metrics[col][rows, d, hour_of_day]
+                                               for col in columns if col in metrics})
+            results_spvol_drc[drc + "_" + str(hour_of_day)] = net_slice[columns]
+    return results_spvol_drc
+
+def incremental_metrics(net_merged_speed_vol, fleet, columns, previous, fingerprints):
+    """Recompute the kernel only for links with a changed input fingerprint,
+    reusing the stored metrics of all other links.
+
+    Returns the metrics of columns, the (link x direction x hour) changed
+    cells and the (direction x hour) slices that need to be rewritten.
+    """
+    # cells written to the store now or before
+    lanes = net_merged_speed_vol[[drc + '_LANES' for drc in DIRECTIONS]].values[:, :, None] > 0
+    changed = (fingerprints != previous['fingerprint']) & (lanes | (previous['fingerprint'] != 0))
+    links = changed.any(axis=(1, 2))
+    recomputed = energy_kernel(net_merged_speed_vol[links], fleet)
+
+    metrics = {}
+    for col in columns:
+        if col in recomputed:
+            metrics[col] = previous[col]
+            metrics[col][links] = recomputed[col]
+    # slices with changed rows, or stored rows of links no longer in the network
+    slices = changed.any(axis=0) | (previous['stored_rows'] != lanes.sum(axis=0))
+    return metrics, changed & lanes, slices
+
+@timed()
+def build_energy_estimate(net_merged_speed_vol,Date,fleet=None,incremental=False):
     # results_spvol_drc = {}
     #
     # net_merged_speed_vol[['AB_LANES','BA_LANES']] = net_merged_speed_vol[['AB_LANES','BA_LANES']].fillna(0)
@@ -154,51 +320,44 @@ def build_energy_estimate(net_merged_speed_vol,Date):
     #         results_spvol_drc[drc + "_" + str(hour_of_day)] = net_selected['energy_density'].sum()
     # return results_spvol_drc
     net_merged_speed_vol = extract_extra_links(net_merged_speed_vol)
-    results_spvol_drc = {}
 
     net_merged_speed_vol[['AB_LANES','BA_LANES']] = net_merged_speed_vol[['AB_LANES','BA_LANES']].fillna(0)
-    AB_net = gpd.GeoDataFrame()
-    BA_net = gpd.GeoDataFrame()
-    for drc in ['AB', 'BA']:
-
-        for hour_of_day in range(24):
-            net_selected = net_merged_speed_vol[net_merged_speed_vol[drc + '_LANES'] > 0]
-            net_selected['volume'] = net_selected['volume_' + drc + '_' + str(hour_of_day)]
-            net_selected['speed_mph_float'] = net_selected['speed_' + drc + '_' + str(hour_of_day)].astype(float)
-            net_selected['grade_percent_float'] = net_selected[drc + '_grade_p'].astype(float)
-            net_selected['num_lanes_int'] = net_selected[drc + '_LANES'].astype(int)
-            net_selected['miles'] = net_selected['Length'].astype(float)
-            net_selected['energy'] = 0.0
-            net_selected['energy_density'] = 0.0
-            cols = ['speed_mph_float', 'grade_percent_float', 'num_lanes_int','miles']
-            net_selected['energy'] = explicitbin_in.predict(net_selected[cols])
-            net_selected['energy_density'] = net_selected['energy'] * net_selected['volume']
-            net_selected['energy_per_mile'] = net_selected['energy']/(net_selected['miles'])
-            net_selected['energy_density_per_mile'] = net_selected['energy_per_mile'] * net_selected['volume']
-            net_selected['energy_per_mile_per_lane'] = (net_selected['energy']/(net_selected['miles'] ))/net_selected['num_lanes_int'].astype(float)
-            net_selected['energy_density_per_mile_per_lane'] = net_selected['energy_per_mile_per_lane'] * net_selected['volume']
-            net_selected['energy_per_mile_per_lane_grade_adj'] = net_selected['energy_per_mile_per_lane']/(net_selected['grade_percent_float']/100.0)
-            net_selected['energy_density_per_mile_per_lane_grade_adj'] = net_selected['energy_per_mile_per_lane_grade_adj'] * net_selected['volume']
-            columns = ['ID','volume','speed_mph_float','miles','energy','energy_per_mile','grade_percent_float','num_lanes_int','geometry']
-            results_spvol_drc[drc + "_" + str(hour_of_day)] = net_selected[columns].copy()
-            file_name = "%s_%s_%s.geojson" % (Date,hour_of_day,drc)
-            folder = "EnergyData"
-            net_selected[columns].to_file(os.path.join(folder,file_name),driver='GeoJSON')
-            # pickle.dump( net_selected, open( os.path.join(folder,file_name), "wb" ) )
-
-            # tmp = net_selected[['energy_density_per_meter','speed_mph_float','volume','ID','geometry']].copy()
-            # DateArray = Date.split("-")
-            # year = DateArray[0]
-            # monthInteger = int(DateArray[1])
-            # month = datetime.date(1900, monthInteger, 1).strftime('%B')
-            # day = DateArray[2]
-            # hour = str(hour_of_day)
-            # fileExtension = ".geojson"
-            # filename = "_".join([month,day,year,hour,drc,fileExtension])
-            # folder = "EnergyData"
-            # path = os.path.join(folder,filename)
-            # print(path)
-            # tmp.to_file(path,driver='GeoJSON')
+    if fleet is None:
+        fleet = {os.path.basename(explicitbin_in.veh_desc): (explicitbin_in, 1.0)}
+    columns = ENERGY_COLUMNS
+    if len(fleet) > 1:
+        columns = columns[:-1] + ['energy_' + name for name in fleet] + columns[-1:]
+    fingerprints = input_fingerprints(net_merged_speed_vol, fleet, columns)
+
+    # incremental: reuse stored rows whose inputs and models did not change
+    previous, slices = None, None
+    if incremental:
+        with span('read_previous'):
+            previous = read_energy_arrays(Date, net_merged_speed_vol['ID'].values, DIRECTIONS, len(HOURS),
+                                          [col for col in columns if col not in ('ID', 'geometry')])
+    with span('energy_kernel') as s:
+        if previous is None:
+            metrics = energy_kernel(net_merged_speed_vol, fleet)
+            changed = metrics['num_lanes_int'] > 0
+        else:
+            metrics, changed, slices = incremental_metrics(net_merged_speed_vol, fleet, columns,
+                                                           previous, fingerprints)
+        s.rows = int(changed.sum())
+    written = (metrics['num_lanes_int'] > 0).sum()
+    count('rows_recomputed', int(changed.sum()))
+    count('rows_reused', int(written - changed.sum()))
+    if incremental:
+        print("%s: %d rows recomputed, %d reused, %d of %d slices rewritten"
+              % (Date, changed.sum(), written - changed.sum(),
+                 len(DIRECTIONS)*len(HOURS) if slices is None else slices.sum(), len(DIRECTIONS)*len(HOURS)))
+    with span('energy_tables') as s:
+        results_spvol_drc = energy_tables(net_merged_speed_vol, metrics, columns)
+        s.rows = sum(len(net_selected) for net_selected in results_spvol_drc.values())
+    # one partitioned dataset instead of 48 GeoJSON files, see energy_store.export_geojson
+    with span('write_energy') as s:
+        write_energy(net_merged_speed_vol, metrics, columns, Date, DIRECTIONS,
+                     fingerprints=fingerprints, slices=slices)
+        s.rows = sum(len(net_selected) for net_selected in results_spvol_drc.values())
 
     # energy_volume_speed_columns = []
     # for col in results_spvol_drc['AB_0'].columns:
@@ -230,16 +389,30 @@ def build_energy_estimate(net_merged_speed_vol,Date):
     # print("saving energy file to: ",file_name)
     # AB_net.to_file(os.path.join(folder,file_name),driver='GeoJSON')
     # # pickle.dump( AB_net, open( os.path.join(folder,file_name), "wb" ) )
+    return results_spvol_drc
+
+def estimate_energy(merged_df,Date,fleet=None,incremental=False):
+    # uses the module level net and explicitbin_in, loaded once per process
+    speed_vol_AB_df,speed_vol_BA_df = read_speed_volume_process(merged_df)
+    speed_vol_AB_df = update_colnames(speed_vol_AB_df, 'AB')
+    speed_vol_BA_df = update_colnames(speed_vol_BA_df, 'BA')
 
+    net_merged_speed_vol = merge_net_speed_vol(speed_vol_AB_df,speed_vol_BA_df)
+    # print(net_merged_speed_vol.columns.tolist())
+    return build_energy_estimate(net_merged_speed_vol,Date,fleet,incremental)
+
+@timed()
+def estimate_date(Date,fleet=None,incremental=False):
+    merged_df = map_match(Date)
+    estimate_energy(merged_df,Date,fleet,incremental)
+    deleteFiles(Date)
+
+@timed()
 def deleteFiles(Date):
-    cmd = "rm " + Date + "/" + Date + "*"
-    os.system(cmd)
-    cmd = "rm " + Date + "/*.html"
-    os.system(cmd)
-    # cmd = "rm " + Date + "/network*"
-    # os.system(cmd)
-    cmd = "rm " + Date + "/*.txt"
-    os.system(cmd)
+    # the extracted TomTom results, see pipeline.py for keeping them
+    for pattern in [Date + "*", "*.html", "*.txt"]:
+        for path in glob.glob(os.path.join(Date, pattern)):
+            os.remove(path)
 
 if __name__=="__main__":
 
@@ -248,21 +421,21 @@ if __name__=="__main__":
     ##############################
 
 
-    t = 60 * 60  # This is the seconds to wait till we can call back print_function
     # Date = "2020-02-18"
     Date = sys.argv[1]
-    # print(Date)
-    # retreive_tomtom_do_volume_estimate(Date)
-    merged_df = map_match()
-    speed_vol_AB_df,speed_vol_BA_df = read_speed_volume_process(merged_df)
-    speed_vol_AB_df = update_colnames(speed_vol_AB_df, 'AB')
-    speed_vol_BA_df = update_colnames(speed_vol_BA_df, 'BA')
+    # fetch -> daily_data -> volume -> map matching -> energy in one process,
+    # skipping what is up to date, see pipeline.py for checkpoints and workers
+    from pipeline import run_date
 
-    explicitbin_in = import_vehicle_models()
-    net = gpd.read_file("Network/network_with_grade.shp")
-    net_merged_speed_vol = merge_net_speed_vol(speed_vol_AB_df,speed_vol_BA_df)
-    # print(net_merged_speed_vol.columns.tolist())
-    build_energy_estimate(net_merged_speed_vol,Date)
-    deleteFiles(Date)
-    cmd = 'echo "Done!!!"'
-    os.system(cmd)
+    # optional JSON file of {vehicle model name: fleet share}, and --incremental
+    # to only recompute links whose inputs changed since the last run of Date
+    args = [arg for arg in sys.argv[2:] if arg != '--incremental']
+    fleet_shares = None
+    if args:
+        with open(args[0]) as f:
+            fleet_shares = json.load(f)
+    run_date(Date, fleet_shares, '--incremental' in sys.argv)
+    # per-stage timings, only with PIPELINE_PROFILE=1
+    if os.path.isdir(Date):
+        write_report(os.path.join(Date, 'run_report.json'))
+    print("Done!!!")
@@ -0,0 +1,190 @@
+"""
+Backfill energy estimates for many dates with one load of the static inputs.
+
+The network shapefile, lookup table, volume model and vehicle models are
+loaded once in the parent process and inherited by forked workers, which run
+the pipeline of one date each (pipeline.run_date). A failing date is recorded and
+does not stop the others. A worker process that dies (e.g. out of memory)
+breaks the pool: the pool is rebuilt and the unfinished dates resubmitted,
+the dates that were running are retried one at a time so only the date that
+kills its worker is marked failed. Progress is kept in a JSON manifest so an
+interrupted backfill picks up where it stopped.
+
+Examples:
+> python batch_estimate.py --start 2020-01-01 --end 2020-03-31 --workers 8
+> python batch_estimate.py --dates 2020-03-10 2020-03-11
+> python batch_estimate.py --dates 2020-03-10 --incremental --manifest rerun.json
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import instrumentation
+import pipeline
+
+def date_range(start, end):
+    day = datetime.date.fromisoformat(start)
+    last = datetime.date.fromisoformat(end)
+    dates = []
+    while day <= last:
+        dates.append(day.isoformat())
+        day += datetime.timedelta(days=1)
+    return dates
+
+def read_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def write_manifest(manifest, path):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+fleet_shares = None
+
+# fork-inherited queue of the dates picked up by a worker, see run_pool
+started = None
+
+def load_static_inputs(fleet_path=None):
+    # loaded once in the parent, the forked workers find them cached by the
+    # pipeline and the model registry
+    global fleet_shares
+    if fleet_path:
+        with open(fleet_path) as f:
+            fleet_shares = json.load(f)
+    pipeline.network()
+    # checksummed once here, the workers share the memory-mapped array
+    pipeline.lookup()
+    pipeline.volume_model()
+    pipeline.fleet(fleet_shares)
+
+def run_date(Date, incremental=False):
+    if started is not None:
+        started.put(Date)
+    start = time.time()
+    instrumentation.reset()
+    try:
+        pipeline.run_date(Date, fleet_shares, incremental)
+    except Exception:
+        return {'status': 'failed', 'seconds': time.time() - start, 'error': traceback.format_exc()}
+    finally:
+        # per-stage timings, only with PIPELINE_PROFILE=1
+        if os.path.isdir(Date):
+            instrumentation.write_report(os.path.join(Date, 'run_report.json'))
+    return {'status': 'done', 'seconds': time.time() - start}
+
+def run_pool(dates, workers, incremental, record):
+    """Run dates in one process pool, passing every result to record(Date,
+    result), until all are done or a worker process dies.
+
+    Returns:
+        running: (list) dates that were running when a worker process died
+
+        waiting: (list) dates not started when a worker process died
+
+        error: (str) traceback of the broken pool, None if no worker died
+    """
+    global started
+    context = multiprocessing.get_context('fork')
+    started = context.SimpleQueue()
+    recorded = set()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {pool.submit(run_date, Date, incremental): Date for Date in dates}
+            try:
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception:
+                        result = {'status': 'failed', 'error': traceback.format_exc()}
+                    record(futures[future], result)
+                    recorded.add(futures[future])
+            except BrokenProcessPool:
+                error = traceback.format_exc()
+                # dates finished before the break still count
+                for future, Date in futures.items():
+                    if Date not in recorded and future.done() and future.exception() is None:
+                        record(Date, future.result())
+                        recorded.add(Date)
+            else:
+                return [], [], None
+        picked_up = set()
+        while not started.empty():
+            picked_up.add(started.get())
+    finally:
+        started = None
+    unfinished = [Date for Date in dates if Date not in recorded]
+    return [Date for Date in unfinished if Date in picked_up], \
+           [Date for Date in unfinished if Date not in picked_up], error
+
+def run_batch(dates, workers, manifest_path, fleet_path=None, incremental=False):
+    manifest = read_manifest(manifest_path)
+    todo = [Date for Date in dates if manifest.get(Date, {}).get('status') != 'done']
+    print("%d dates, %d already done" % (len(dates), len(dates) - len(todo)))
+    if not todo:
+        return manifest
+
+    def record(Date, result):
+        result['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+        manifest[Date] = result
+        write_manifest(manifest, manifest_path)
+        print(Date, result['status'])
+
+    def crashed(Date, error):
+        # the worker process itself died, e.g. out of memory
+        record(Date, {'status': 'failed', 'error': 'worker process died running %s\n%s' % (Date, error)})
+
+    load_static_inputs(fleet_path)
+    waiting = todo
+    while waiting:
+        running, waiting, error = run_pool(waiting, workers, incremental, record)
+        if error is None:
+            break
+        print("worker process died, %d dates running, %d resubmitted" % (len(running), len(waiting)))
+        if len(running) == 1:
+            crashed(running[0], error)
+        elif not running:
+            # died before picking up a date, the pool cannot run at all
+            for Date in waiting:
+                crashed(Date, error)
+            break
+        else:
+            # one at a time, so a crash points at its date
+            for Date in running:
+                rerun, _, error = run_pool([Date], 1, incremental, record)
+                if rerun:
+                    crashed(Date, error)
+    return manifest
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--dates', nargs='+', default=[], help='dates as YYYY-MM-dd')
+    parser.add_argument('--start', help='first date of a range, YYYY-MM-dd')
+    parser.add_argument('--end', help='last date of a range, YYYY-MM-dd')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--manifest', default='batch_manifest.json', help='progress manifest path')
+    parser.add_argument('--fleet', help='JSON file of {vehicle model name: fleet share}')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only recompute links whose inputs changed since the stored run')
+    args = parser.parse_args()
+
+    dates = list(args.dates)
+    if args.start:
+        dates += date_range(args.start, args.end or args.start)
+    if not dates:
+        parser.error('give --dates or --start/--end')
+
+    manifest = run_batch(sorted(set(dates)), args.workers, args.manifest, args.fleet, args.incremental)
+    failed = [Date for Date in dates if manifest[Date]['status'] != 'done']
+    print("Done!!! %d failed: %s" % (len(failed), ' '.join(failed)))
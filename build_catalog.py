@@ -0,0 +1,275 @@
+"""
+Train the vehicle models of the Vehicle_Models/ catalog in parallel.
+
+A JSON manifest lists the vehicles and the pass data (link attributes + energy
+consumption) each one is trained on. Vehicles that share a source file are
+trained by the same worker process, which reads the file once. Every model is
+written as <name>.pkl, explicitBin models also in the compact table format
+(<name>.table.json/.npy), with a <name>.json metadata file: the model type, bin
+edges, error metrics, training time, and a hash of the training config and of
+the source file. A vehicle whose config and source file are unchanged since
+its last build is skipped. A failing vehicle is reported and does not stop
+the others.
+
+Manifest, the top-level keys are defaults for every vehicle:
+{"model": "explicitbin",
+ "energy": "gallons", "distance": "miles", "trip_ids": "trip_ids", "fuel": "gasoline",
+ "attrb_dict": {"speed_mph_float": [0, 10, 20, 30, 40, 50, 60, 70, 80],
+                "grade_percent_float": [-6, -4, -2, 0, 2, 4, 6]},
+ "seed": 0,
+ "vehicles": [
+    {"name": "gasoline_conv_Volkswagen_Tiguan_36000_explicitbin",
+     "veh_desc": "2016 Volkswagen Tiguan", "source": "fc_data/tiguan.csv"},
+    {"name": "gasoline_phev_Chevrolet_Volt_36000_Charge_Depleting_explicitbin",
+     "source": "fc_data/volt.parquet", "energy": "kwh"},
+    {"name": "gasoline_phev_Chevrolet_Volt_36000_Charge_Sustaining_explicitbin",
+     "source": "fc_data/volt.parquet"}]}
+
+Examples:
+> python build_catalog.py catalog.json --workers 8
+> python build_catalog.py catalog.json --force --only gasoline_conv_Volkswagen_Tiguan_36000_explicitbin
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from model_registry import TABLE_SUFFIX
+from routee.models.explicitBin import explicitBin
+from routee.models.randomForest import randomForest
+
+VEHICLE_MODELS = "Vehicle_Models"
+
+# bump when training changes in a way that should rebuild every model
+TRAINER_VERSION = 1
+
+# vehicle settings that do not change the trained model
+BUILD_ONLY = ('name', 'source', 'cores')
+
+def vehicle_configs(manifest):
+    """Settings of every vehicle, the manifest defaults overridden per vehicle."""
+    defaults = {k: v for k, v in manifest.items() if k != 'vehicles'}
+    configs = []
+    for vehicle in manifest['vehicles']:
+        config = dict(defaults, **vehicle)
+        config.setdefault('model', 'explicitbin')
+        config.setdefault('veh_desc', config['name'])
+        configs.append(config)
+    return configs
+
+def config_hash(config):
+    trained = {k: v for k, v in config.items() if k not in BUILD_ONLY}
+    return hashlib.sha256(json.dumps([TRAINER_VERSION, trained], sort_keys=True).encode()).hexdigest()
+
+def source_signature(path):
+    st = os.stat(path)
+    return {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def artifact_paths(folder, name):
+    return os.path.join(folder, name + '.pkl'), os.path.join(folder, name + '.json')
+
+def read_metadata(folder, name):
+    pkl_path, meta_path = artifact_paths(folder, name)
+    if not os.path.exists(pkl_path):
+        return None
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def up_to_date(meta, config, signature):
+    return meta is not None and meta.get('config_hash') == config_hash(config) \
+            and meta.get('source') == signature
+
+def model_columns(config):
+    """Columns of the source a vehicle is trained on, None for all columns."""
+    if config['model'] == 'explicitbin':
+        features = list(config['attrb_dict'])
+    else:
+        features = config.get('features')
+    if features is None:
+        return None
+    return features + [config['distance'], config['energy'], config['trip_ids']]
+
+def read_source(path, columns=None):
+    """Read pass data from a CSV, Parquet or pickle file, only the given
+    columns. Missing columns are left out, failing only the vehicles that
+    need them.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.parquet':
+        try:
+            return pd.read_parquet(path, columns=columns)
+        except (KeyError, ValueError):
+            df = pd.read_parquet(path)
+    elif ext in ('.pkl', '.pickle'):
+        df = pd.read_pickle(path)
+    else:
+        return pd.read_csv(path, usecols=None if columns is None else lambda c: c in columns)
+    return df if columns is None else df[[c for c in columns if c in df]]
+
+def train_model(config, fc_data):
+    if config['model'] == 'explicitbin':
+        model = explicitBin(config['veh_desc'])
+        model.attrb_dict = config['attrb_dict']
+    elif config['model'] == 'randomforest':
+        model = randomForest(config['veh_desc'], config.get('cores', 1))
+    else:
+        raise ValueError('unknown model type %r' % config['model'])
+    model.fuel = config.get('fuel')
+    if config.get('seed') is not None:
+        np.random.seed(config['seed'])
+    columns = model_columns(config)
+    model.train(fc_data if columns is None else fc_data[columns],
+                energy=config['energy'], distance=config['distance'], trip_ids=config['trip_ids'])
+    return model
+
+def write_artifact(folder, model, meta):
+    # temporary files first so a reader never loads a partial model
+    pkl_path, meta_path = artifact_paths(folder, meta['name'])
+    model.dump_model(pkl_path + '.tmp')
+    os.replace(pkl_path + '.tmp', pkl_path)
+    if isinstance(model, explicitBin):
+        model.dump_table(os.path.join(folder, meta['name'] + TABLE_SUFFIX))
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+    os.replace(meta_path + '.tmp', meta_path)
+
+def build_source(path, signature, jobs, folder):
+    """Read one source file and train every vehicle on it.
+
+    Args:
+        path: (str) source file of pass data
+
+        signature: (dict) size and modification time of the file, stored
+        with every model trained on it
+
+        jobs: (list) (config, version) of every vehicle to train
+
+        folder: (str) catalog folder the models are written to
+
+    Returns:
+        results: (list) status, version and seconds of every vehicle
+    """
+    results = []
+    try:
+        columns = [model_columns(config) for config, version in jobs]
+        if any(c is None for c in columns):
+            fc_data = read_source(path)
+        else:
+            fc_data = read_source(path, list(dict.fromkeys(c for cols in columns for c in cols)))
+    except Exception:
+        error = traceback.format_exc()
+        return [{'name': config['name'], 'status': 'failed', 'error': error} for config, version in jobs]
+
+    for config, version in jobs:
+        start = time.time()
+        try:
+            model = train_model(config, fc_data)
+            seconds = time.time() - start
+            meta = {'name': config['name'], 'veh_desc': config['veh_desc'], 'model': config['model'],
+                    'version': version, 'trainer_version': TRAINER_VERSION,
+                    'config_hash': config_hash(config), 'source': signature,
+                    'features': list(model.features), 'energy': model.energy,
+                    'distance': model.distance, 'fuel': model.fuel, 'bin_edges': model.attrb_dict,
+                    'errors': {'link_average_error_unweight': float(model.link_average_error_unweight),
+                               'trip_average_error_weight': float(model.trip_average_error_weight),
+                               'net_error': float(model.net_error)},
+                    'train_passes': int(len(model.train)), 'test_passes': int(len(model.test)),
+                    'train_seconds': round(seconds, 3),
+                    'trained': datetime.datetime.now().isoformat(timespec='seconds')}
+            write_artifact(folder, model, meta)
+            results.append({'name': config['name'], 'status': 'done', 'version': version,
+                            'seconds': seconds})
+        except Exception:
+            results.append({'name': config['name'], 'status': 'failed', 'error': traceback.format_exc(),
+                            'seconds': time.time() - start})
+    return results
+
+def build_catalog(manifest, folder=VEHICLE_MODELS, workers=None, force=False, only=None):
+    """Train every out-of-date vehicle of a manifest, one task per source file.
+
+    Args:
+        manifest: (dict) defaults and the list of vehicles, see the module doc
+
+        folder: (str) catalog folder
+
+        workers: (int) worker processes, one per CPU when None
+
+        force: (bool) retrain vehicles that are up to date
+
+        only: (list) names of the vehicles to consider, all when None
+
+    Returns:
+        results: (dict) vehicle name -> status ('done', 'skipped', 'failed')
+        with version, seconds or error
+    """
+    os.makedirs(folder, exist_ok=True)
+    results = {}
+    by_source = {}
+    for config in vehicle_configs(manifest):
+        if only is not None and config['name'] not in only:
+            continue
+        try:
+            signature = source_signature(config['source'])
+        except OSError:
+            results[config['name']] = {'status': 'failed', 'error': traceback.format_exc()}
+            continue
+        meta = read_metadata(folder, config['name'])
+        if not force and up_to_date(meta, config, signature):
+            results[config['name']] = {'status': 'skipped', 'version': meta['version']}
+            continue
+        version = meta.get('version', 0) + 1 if meta else 1
+        by_source.setdefault(config['source'], (signature, []))[1].append((config, version))
+
+    n_models = sum(len(jobs) for signature, jobs in by_source.values())
+    print("%d vehicles, %d to train from %d source files" % (len(results) + n_models, n_models, len(by_source)))
+    if not by_source:
+        return results
+
+    # one job per source file, the largest first
+    order = sorted(by_source, key=lambda path: -by_source[path][0]['size'])
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context('fork')) as pool:
+        futures = {pool.submit(build_source, path, by_source[path][0], by_source[path][1], folder): path \
+                    for path in order}
+        for future in as_completed(futures):
+            try:
+                source_results = future.result()
+            except Exception:
+                # the worker process itself died, e.g. out of memory
+                error = traceback.format_exc()
+                source_results = [{'name': config['name'], 'status': 'failed', 'error': error} \
+                                  for config, version in by_source[futures[future]][1]]
+            for result in source_results:
+                name = result.pop('name')
+                results[name] = result
+                print(name, result['status'])
+    return results
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('manifest', help='JSON manifest of vehicles and their source files')
+    parser.add_argument('--folder', default=VEHICLE_MODELS, help='catalog folder the models are written to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--force', action='store_true', help='retrain vehicles that are up to date')
+    parser.add_argument('--only', nargs='+', help='names of the vehicles to build')
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    results = build_catalog(manifest, args.folder, args.workers, args.force, args.only)
+    failed = sorted(name for name, result in results.items() if result['status'] == 'failed')
+    for name in failed:
+        print(name, results[name]['error'])
+    print("Done!!! %d failed: %s" % (len(failed), ' '.join(failed)))
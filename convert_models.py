@@ -0,0 +1,53 @@
+"""
+Convert pickled explicitBin models to the compact table format.
+
+Each <name>.pkl is written as <name>.table.json (features, bin edges, units,
+error metrics) and <name>.table.npy (dense float32 rates table), which
+model_registry.py then reads in place of the pickle. The pickles are kept.
+
+Examples:
+> python convert_models.py
+> python convert_models.py Vehicle_Models/diesel_conv_BMW_X3_xDrive28d_36000_explicitbin.pkl
+"""
+
+import argparse
+import glob
+import os
+import numpy as np
+
+from model_registry import VEHICLE_MODELS, TABLE_SUFFIX, load_table
+from routee.models.explicitBin import explicitBin
+
+def convert(pkl_path):
+    """Write the compact table of a pickled explicitBin model.
+
+    Returns:
+        table_path: (str) the JSON file written
+
+        rel_err: (float) largest relative difference of a float32 rate
+        from the pickled rate
+    """
+    base = pkl_path[:-len('.pkl')]
+    model = explicitBin(base)
+    model.read_model(pkl_path)
+    model.dump_table(base + TABLE_SUFFIX)
+
+    rates = model.rate_table
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel_err = np.abs(load_table(base + TABLE_SUFFIX).rate_table - rates)/np.abs(rates)
+    return base + TABLE_SUFFIX, float(np.nanmax(rel_err)) if np.isfinite(rel_err).any() else 0.0
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('models', nargs='*', help='.pkl files, every one in Vehicle_Models/ by default')
+    args = parser.parse_args()
+
+    paths = args.models or sorted(glob.glob(os.path.join(VEHICLE_MODELS, '*.pkl')))
+    for path in paths:
+        try:
+            table_path, rel_err = convert(path)
+        except Exception as e:
+            print("%s: not converted, %s: %s" % (path, type(e).__name__, e))
+            continue
+        print("%s -> %s (%d bytes, max rate rel. error %.1e)" % (
+            path, table_path, os.path.getsize(table_path) + os.path.getsize(table_path[:-5] + '.npy'), rel_err))
@@ -0,0 +1,80 @@
+"""
+Benchmark of the energy kernel against the per-hour loop it replaced.
+
+Builds a synthetic network of wide speed_<drc>_<h>/volume_<drc>_<h> columns,
+then times the old build_energy_estimate loop (48 filtered copies of the
+network, one predict each) and the energy kernel with the 48 energy tables
+sliced from it. Reports the median over repeated runs, the share of the
+kernel spent slicing the tables, and the largest difference between the two
+sets of tables.
+
+Examples:
+> python energy_benchmark.py
+> python energy_benchmark.py --links 200000 --reps 3 --model diesel_conv_BMW_X3_xDrive28d_36000_explicitbin
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+
+from instrumentation import median_s
+from model_registry import default_registry
+from VolEstScript import DIRECTIONS, HOURS, ENERGY_COLUMNS, energy_kernel, energy_tables, extract_extra_links
+
+def synthetic_network(n_links, seed=0):
+    rng = np.random.default_rng(seed)
+    net = {'ID': np.arange(n_links), 'ROAD_FLAG': np.zeros(n_links, dtype=int),
+           'Length': rng.uniform(0.01, 2, n_links), 'geometry': np.full(n_links, None)}
+    for drc in DIRECTIONS:
+        net[drc + '_grade_p'] = rng.uniform(-8, 8, n_links)
+        net[drc + '_LANES'] = rng.integers(0, 4, n_links).astype(float)
+        for h in HOURS:
+            net['speed_%s_%d' % (drc, h)] = rng.uniform(0, 80, n_links)
+            net['volume_%s_%d' % (drc, h)] = rng.uniform(0, 500, n_links)
+    return pd.DataFrame(net)
+
+def per_hour_loop(net_merged_speed_vol, model):
+    # build_energy_estimate before the energy kernel, without writing the GeoJSON files
+    results_spvol_drc = {}
+    for drc in DIRECTIONS:
+        for hour_of_day in HOURS:
+            net_selected = net_merged_speed_vol[net_merged_speed_vol[drc + '_LANES'] > 0]
+            net_selected['volume'] = net_selected['volume_' + drc + '_' + str(hour_of_day)]
+            net_selected['speed_mph_float'] = net_selected['speed_' + drc + '_' + str(hour_of_day)].astype(float)
+            net_selected['grade_percent_float'] = net_selected[drc + '_grade_p'].astype(float)
+            net_selected['num_lanes_int'] = net_selected[drc + '_LANES'].astype(int)
+            net_selected['miles'] = net_selected['Length'].astype(float)
+            cols = ['speed_mph_float', 'grade_percent_float', 'num_lanes_int', 'miles']
+            net_selected['energy'] = model.predict(net_selected[cols])
+            net_selected['energy_per_mile'] = net_selected['energy']/(net_selected['miles'])
+            results_spvol_drc[drc + "_" + str(hour_of_day)] = net_selected[ENERGY_COLUMNS].copy()
+    return results_spvol_drc
+
+def kernel(net_merged_speed_vol, model):
+    metrics = energy_kernel(net_merged_speed_vol, {'vehicle': (model, 1.0)})
+    return energy_tables(net_merged_speed_vol, metrics)
+
+def benchmark(model, n_links=50000, reps=5):
+    pd.options.mode.chained_assignment = None
+    net = extract_extra_links(synthetic_network(n_links))
+    loop_s, expected = median_s(lambda: per_hour_loop(net, model), reps)
+    kernel_s, results = median_s(lambda: kernel(net, model), reps)
+    metrics_s, _ = median_s(lambda: energy_kernel(net, {'vehicle': (model, 1.0)}), reps)
+    max_diff = max(np.max(np.nan_to_num(np.abs(results[name][col].values.astype(float)
+                                               - expected[name][col].values.astype(float))), initial=0.0)
+                   for name in expected for col in ('energy', 'energy_per_mile'))
+    rows = sum(len(table) for table in results.values())
+    print("%d links, %d table rows" % (n_links, rows))
+    print("per-hour loop %8.3f s" % loop_s)
+    print("energy kernel %8.3f s  (%.1fx), of which %.3f s metrics and %.3f s slicing the 48 tables"
+          % (kernel_s, loop_s / kernel_s, metrics_s, kernel_s - metrics_s))
+    print("max energy difference %.1e" % max_diff)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--model', default='gasoline_conv_Volkswagen_Tiguan_36000_explicitbin',
+                        help='model name in Vehicle_Models/')
+    parser.add_argument('--links', type=int, default=50000, help='links of the synthetic network')
+    parser.add_argument('--reps', type=int, default=5, help='timed runs per case')
+    args = parser.parse_args()
+    benchmark(default_registry().get(args.model), args.links, args.reps)
@@ -0,0 +1,211 @@
+"""
+Columnar store for the link energy estimates.
+
+Link geometry is written once per network as WKB keyed by link ID
+(EnergyData/network.parquet). Energy, speed and volume attributes go to a
+single Parquet dataset with one directory per date/direction/hour:
+
+    EnergyData/energy/date=2020-03-10/direction=AB/hour=8/part-0.parquet
+
+so readers only open the slices that match their filters. GeoJSON is still
+available for a single slice on demand.
+
+Every row also carries a 64-bit fingerprint of its inputs, so an incremental
+run can rewrite only the slices whose rows changed (see read_energy_arrays and
+the slices argument of write_energy).
+
+Examples:
+> from energy_store import read_energy, read_slice, export_geojson
+>
+> am_peak = read_energy(filters=[('date', '=', '2020-03-10'), ('hour', '=', 8)])
+> gdf = read_slice('2020-03-10', 'AB', 8) # GeoDataFrame, same columns as the old GeoJSON
+> export_geojson('2020-03-10', 'AB', 8)   # EnergyData/2020-03-10_8_AB.geojson
+
+Or from the command line:
+> python energy_store.py 2020-03-10 AB 8
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+ENERGY_FOLDER = "EnergyData"
+
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.string()),
+                                          ('direction', pa.string()),
+                                          ('hour', pa.int8())]), flavor='hive')
+
+FILTER_OPS = {'=': lambda field, value: field == value,
+              '==': lambda field, value: field == value,
+              '!=': lambda field, value: field != value,
+              '<': lambda field, value: field < value,
+              '<=': lambda field, value: field <= value,
+              '>': lambda field, value: field > value,
+              '>=': lambda field, value: field >= value,
+              'in': lambda field, value: field.isin(list(value))}
+
+def crs_text(crs):
+    if crs is None:
+        return ''
+    return crs.to_wkt() if hasattr(crs, 'to_wkt') else json.dumps(crs)
+
+def folder_bytes(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+def write_network(net, root=ENERGY_FOLDER):
+    """Write link ID + WKB geometry, unless the stored network is identical.
+    """
+    path = os.path.join(root, 'network.parquet')
+    ids = net['ID'].values.astype('int64')
+    wkb = [geom.wkb if geom is not None else None for geom in net.geometry]
+    sha = hashlib.sha256(ids.tobytes())
+    for geom in wkb:
+        sha.update(geom or b'')
+    checksum = sha.hexdigest()
+
+    if os.path.exists(path):
+        metadata = pq.read_schema(path).metadata or {}
+        if metadata.get(b'sha256', b'').decode() == checksum:
+            return 0
+    table = pa.table({'ID': ids, 'geometry': pa.array(wkb, type=pa.binary())})
+    table = table.replace_schema_metadata({'sha256': checksum, 'crs': crs_text(net.crs)})
+    os.makedirs(root, exist_ok=True)
+    # replaced in one step so readers and concurrent dates never see a partial file
+    tmp_path = os.path.join(root, '.network.parquet.%d.tmp' % os.getpid())
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
+def write_energy(net_merged_speed_vol, metrics, columns, Date, directions, root=ENERGY_FOLDER,
+                 fingerprints=None, slices=None):
+    """Write every direction/hour slice of the (link x direction x hour)
+    energy kernel output for one date. An existing partition for the date is
+    replaced as a whole, unless slices (direction x hour booleans) selects
+    the slices to replace in it.
+
+    fingerprints, a (link x direction x hour) uint64 array, is stored with
+    each row for later incremental runs.
+
+    Returns the number of bytes written.
+    """
+    columns = [col for col in columns if col in metrics]
+    date_dir = os.path.join(root, 'energy', 'date=' + Date)
+    partial = slices is not None and os.path.isdir(date_dir)
+    # hidden while being written, pyarrow skips dot-prefixed paths
+    tmp_dir = os.path.join(root, 'energy', '.date=' + Date + '.tmp')
+    out_dir = date_dir if partial else tmp_dir
+    if not partial:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    ids = net_merged_speed_vol['ID'].values.astype('int64')
+    written = 0
+    for d, drc in enumerate(directions):
+        rows = metrics['num_lanes_int'][:, d, 0] > 0
+        for hour_of_day in range(metrics['energy'].shape[2]):
+            if partial and not slices[d, hour_of_day]:
+                continue
+            slice_dir = os.path.join(out_dir, 'direction=' + drc, 'hour=' + str(hour_of_day))
+            os.makedirs(slice_dir, exist_ok=True)
+            data = [('ID', ids[rows])] + [(col, metrics[col][rows, d, hour_of_day]) for col in columns]
+            if fingerprints is not None:
+                data.append(('fingerprint', fingerprints[rows, d, hour_of_day]))
+            path = os.path.join(slice_dir, 'part-0.parquet')
+            pq.write_table(pa.table(dict(data)), os.path.join(slice_dir, '.part-0.parquet.tmp'))
+            os.replace(os.path.join(slice_dir, '.part-0.parquet.tmp'), path)
+            written += os.path.getsize(path)
+
+    if not partial:
+        shutil.rmtree(date_dir, ignore_errors=True)
+        os.rename(tmp_dir, date_dir)
+    return written + write_network(net_merged_speed_vol, root)
+
+def read_energy_arrays(Date, ids, directions, hours, columns, root=ENERGY_FOLDER):
+    """Scatter the stored slices of one date back into (link x direction x
+    hour) arrays aligned with ids, the inverse of write_energy.
+
+    Returns:
+        arrays: (dict) one array per column, NaN (0 for integer columns)
+        where no row is stored, 'fingerprint' (0 where no row is stored)
+        and 'stored_rows', the (direction x hour) row count of each stored
+        slice. None if the date is not stored with fingerprints and all
+        columns.
+    """
+    date_dir = os.path.join(root, 'energy', 'date=' + Date)
+    if not os.path.isdir(date_dir):
+        return None
+    dataset = ds.dataset(date_dir, format='parquet',
+                         partitioning=ds.partitioning(pa.schema([('direction', pa.string()),
+                                                                 ('hour', pa.int8())]), flavor='hive'))
+    if any(col not in dataset.schema.names for col in ['fingerprint'] + list(columns)):
+        return None
+    stored = dataset.to_table(columns=['ID', 'direction', 'hour', 'fingerprint'] + list(columns)).to_pandas()
+
+    d = pd.Index(directions).get_indexer(stored['direction'].astype(str))
+    h = stored['hour'].values.astype(int)
+    row = pd.Index(ids).get_indexer(stored['ID'].values)
+    valid = (d >= 0) & (h < hours)
+    stored_rows = np.zeros((len(directions), hours), dtype=int)
+    np.add.at(stored_rows, (d[valid], h[valid]), 1)
+
+    at = (row[valid & (row >= 0)], d[valid & (row >= 0)], h[valid & (row >= 0)])
+    shape = (len(ids), len(directions), hours)
+    arrays = {'stored_rows': stored_rows}
+    for col in ['fingerprint'] + list(columns):
+        values = stored[col].values
+        fill = np.nan if values.dtype.kind == 'f' else 0
+        arrays[col] = np.full(shape, fill, dtype=values.dtype)
+        arrays[col][at] = values[valid & (row >= 0)]
+    return arrays
+
+def read_energy(filters=None, columns=None, root=ENERGY_FOLDER):
+    """Read energy attributes as a DataFrame. filters is a list of
+    (column, op, value) tuples combined with 'and'; filters on date,
+    direction and hour only open the matching partitions.
+    """
+    dataset = ds.dataset(os.path.join(root, 'energy'), format='parquet', partitioning=PARTITIONING)
+    expression = None
+    for col, op, value in filters or []:
+        term = FILTER_OPS[op](ds.field(col), value)
+        expression = term if expression is None else expression & term
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+def read_network(ids=None, root=ENERGY_FOLDER):
+    """Link geometry as a GeoDataFrame, for all links or the given IDs in
+    that order.
+    """
+    import geopandas as gpd
+    from shapely import wkb
+
+    table = pq.read_table(os.path.join(root, 'network.parquet'))
+    crs = (table.schema.metadata or {}).get(b'crs', b'').decode()
+    network = table.to_pandas()
+    if ids is not None:
+        network = network.set_index('ID').reindex(ids).reset_index()
+    geometry = [wkb.loads(bytes(geom)) if isinstance(geom, bytes) else None for geom in network['geometry']]
+    return gpd.GeoDataFrame(network[['ID']], geometry=geometry,
+                            crs=(json.loads(crs) if crs.startswith('{') else crs) or None)
+
+def read_slice(Date, direction, hour, root=ENERGY_FOLDER):
+    """One date/direction/hour slice with link geometry, as written to
+    GeoJSON by earlier versions of build_energy_estimate.
+    """
+    energy = read_energy([('date', '=', Date), ('direction', '=', direction), ('hour', '=', int(hour))],
+                         root=root).drop(columns=['date', 'direction', 'hour', 'fingerprint'], errors='ignore')
+    network = read_network(energy['ID'].values, root)
+    return network.drop(columns='ID').join(energy)[list(energy.columns) + ['geometry']]
+
+def export_geojson(Date, direction, hour, root=ENERGY_FOLDER):
+    file_name = "%s_%s_%s.geojson" % (Date, hour, direction)
+    path = os.path.join(root, file_name)
+    read_slice(Date, direction, hour, root).to_file(path, driver='GeoJSON')
+    return path
+
+if __name__=="__main__":
+    print(export_geojson(sys.argv[1], sys.argv[2], sys.argv[3]))
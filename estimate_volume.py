@@ -2,26 +2,48 @@ import pandas as pd
 import numpy as np
 import pickle
 import sys
-from xgboost import XGBRegressor
-
-query_date = sys.argv[1]
+from intermediate_store import read_table, write_table, iter_table, table_writer
+from instrumentation import span, timed, write_report
 
 def load_model(path):
-    f = open(path, 'rb')
-    clf = pickle.load(f)
-    f.close()
+    # unpickling the XGBRegressor imports xgboost
+    with open(path, 'rb') as f:
+        clf = pickle.load(f)
     return(clf)
 
-# load trained model
-xgb = load_model('xgb.dat')
+@timed()
+def predict_volume(daily_data_df, xgb):
+    """Estimate the volume of every row of daily_data.
+
+    Returns:
+        daily_data_pred: (DataFrame) a new frame of the daily_data columns and
+        pred_volume, daily_data_df itself is left unchanged
+    """
+    daily_data = daily_data_df.drop(['Id'], axis=1).values
+    daily_data_pred = xgb.predict(daily_data)
+    daily_data_pred[daily_data_pred<0]=0
+    # append as its own column so the input columns keep their dtypes
+    return daily_data_df.assign(pred_volume=daily_data_pred)
+
+if __name__=="__main__":
+    query_date = sys.argv[1]
+    # optional rows per chunk: streams daily_data instead of reading the whole day
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else None
 
-# run the model to estimate volume
-daily_data_df = pd.read_csv("./" + query_date + "/daily_data.csv")
-daily_data = daily_data_df.drop(['Id'], axis=1).values
-daily_data_pred = xgb.predict(daily_data)
-daily_data_pred[daily_data_pred<0]=0
+    # load trained model
+    with span('load_model'):
+        xgb = load_model('xgb.dat')
 
-# output volume estimates
-network_pred = pd.DataFrame(np.concatenate((daily_data_df.values, daily_data_pred.reshape(-1, 1)), axis=1),
-                              columns = daily_data_df.columns.append(pd.Index(['pred_volume'])))
-network_pred.to_csv("./" + query_date + '/daily_data_pred.csv', index = False)
\ No newline at end of file
+    # run the model to estimate volume and output volume estimates
+    in_path = "./" + query_date + "/daily_data"
+    out_path = "./" + query_date + '/daily_data_pred'
+    if chunk_size is None:
+        network_pred = predict_volume(read_table(in_path), xgb)
+        with span('write_table'):
+            write_table(network_pred, out_path)
+    else:
+        with table_writer(out_path) as writer:
+            for chunk in iter_table(in_path, chunk_size):
+                writer.write(predict_volume(chunk, xgb))
+    # per-stage timings, only with PIPELINE_PROFILE=1
+    write_report("./" + query_date + '/run_report_estimate_volume.json')
@@ -0,0 +1,168 @@
+"""
+Benchmark of the daily feature assembly, input_data.py against the R stage.
+
+Writes a synthetic TomTom network shapefile and 24 hourly result DBFs to a
+temporary date folder, then times input_data.build_daily_data and a step by
+step Python emulation of input_data.R (rbind loop over the hourly files,
+meshgrid, sqldf left joins through sqlite, na.locf), and checks that both
+build the same table. With --rscript, the R script itself is also timed
+with Rscript when R is installed; input_data.R fetches the weather over
+HTTP, so that time includes the request. input_data.R was removed from the
+repository and can be restored with:
+
+> git show f77a67e^:input_data.R > input_data.R
+
+Examples:
+> python features_benchmark.py
+> python features_benchmark.py --links 60000 --rscript input_data.R
+"""
+
+import argparse
+import datetime
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+import input_data
+
+DATE = '2020-03-10'
+
+def write_dbf(path, df, widths, decimals=3):
+    # dBase III file of numeric fields, as written by the TomTom results
+    n_fields = len(df.columns)
+    record = 1 + sum(widths)
+    header = bytearray(32)
+    header[0] = 3
+    header[4:8] = len(df).to_bytes(4, 'little')
+    header[8:10] = (32 + 32 * n_fields + 1).to_bytes(2, 'little')
+    header[10:12] = record.to_bytes(2, 'little')
+    fields = b''
+    for name, width in zip(df.columns, widths):
+        field = bytearray(32)
+        field[:len(name)] = name.encode()
+        field[11] = ord('N')
+        field[16] = width
+        field[17] = decimals
+        fields += bytes(field)
+    rows = np.full(len(df), b' ', dtype='S1')
+    for name, width in zip(df.columns, widths):
+        values = df[name].values
+        text = np.where(np.isnan(values), '', np.char.mod('%.' + str(decimals) + 'f', values))
+        rows = np.char.add(rows, np.char.rjust(text.astype('S%d' % width), width))
+    with open(path, 'wb') as f:
+        f.write(bytes(header) + fields + b'\r' + rows.astype('S%d' % record).tobytes() + b'\x1a')
+
+def synthetic_day(folder, n_links, seed=0):
+    """Network shapefile and hourly DBFs of one date in folder/DATE.
+
+    Returns:
+        weather: (DataFrame) hourly temp, wind, precip and snow, three hours
+        missing
+    """
+    import geopandas as gpd
+    from shapely.geometry import LineString
+
+    rng = np.random.default_rng(seed)
+    date_dir = os.path.join(folder, DATE)
+    os.makedirs(date_dir)
+    ids = rng.permutation(np.arange(10**8, 10**8 + 3 * n_links))[:n_links]
+    lon, lat = rng.uniform(-85.5, -84.9, n_links), rng.uniform(34.7, 35.5, n_links)
+    network = gpd.GeoDataFrame({'Id': ids, 'FRC': rng.integers(0, 9, n_links),
+                                'SpeedLimit': rng.choice([25, 35, 45, 55, 65], n_links).astype(float)},
+                               geometry=[LineString([(x, y), (x + .001, y + .001), (x + .002, y)])
+                                         for x, y in zip(lon, lat)], crs='EPSG:4326')
+    network.to_file(os.path.join(date_dir, 'network.shp'))
+
+    for h in range(24):
+        # most links have probes, plus ids missing from the network
+        hour_ids = np.concatenate([ids[rng.random(n_links) < 0.7], rng.integers(10**9, 2 * 10**9, 50)])
+        m = len(hour_ids)
+        hourly = pd.DataFrame({'Id': hour_ids.astype(float), 'F2': rng.random(m), 'F3': rng.random(m),
+                               'F4': rng.random(m), 'AvgSp': np.round(rng.uniform(5, 70, m), 3),
+                               'F6': rng.random(m), 'F7': rng.random(m), 'F8': rng.random(m),
+                               'Count': np.where(rng.random(m) < .1, 0, rng.integers(1, 40, m)).astype(float)})
+        hourly.loc[rng.random(m) < .01, 'AvgSp'] = np.nan
+        write_dbf(os.path.join(date_dir, '%s_%d-%d.dbf' % (DATE, h, h + 1)), hourly,
+                  [14, 8, 8, 8, 10, 8, 8, 8, 6])
+
+    weather = pd.DataFrame({'temp': rng.uniform(30, 60, 24), 'wind': rng.uniform(0, 20, 24),
+                            'precip': rng.random(24), 'snow': 0.0}, index=range(24))
+    return weather.drop([5, 6, 23])
+
+def r_stage(Date, weather):
+    # input_data.R step by step, in Python
+    network_df = input_data.read_network(Date)
+    daily_data = pd.DataFrame({'Id': [], 'AvgSp': [], 'count': [], 'HOUR': []})
+    for file in sorted(os.listdir(Date)):
+        if Date in file and file.lower().endswith('.dbf'):
+            data = input_data.read_dbf(os.path.join(Date, file)).iloc[:, [0, 4, 8]]
+            data.columns = ['Id', 'AvgSp', 'count']
+            data['HOUR'] = int(re.split(r'-|_', file)[3])
+            daily_data = pd.concat([daily_data, data], ignore_index=True)
+
+    grid_x, grid_y = np.meshgrid(network_df['Id'].values, np.arange(24))
+    id_hour = pd.DataFrame({'Id': grid_x.ravel(order='F'), 'HOUR': grid_y.ravel(order='F')})
+    weather = weather.reset_index().rename(columns={'index': 'HOUR'})
+    con = sqlite3.connect(':memory:')
+    for name, table in [('id_hour', id_hour), ('daily_data', daily_data),
+                        ('network_df', network_df), ('weather', weather)]:
+        table.to_sql(name, con)
+    con.execute('create table d1 as select id_hour.Id, id_hour.HOUR, daily_data."AvgSp", daily_data.count '
+                'from id_hour left join daily_data '
+                'on daily_data."Id" = id_hour."Id" and daily_data."HOUR" = id_hour."HOUR"')
+    con.execute('create table d2 as select d1.*, network_df."SpeedLimit" as speed_limit, network_df."FRC" as frc, '
+                'network_df."LONGITUDE", network_df."LATITUDE" from d1 left join network_df '
+                'on d1."Id" = network_df."Id"')
+    out = pd.read_sql('select weather.temp, weather.wind, weather.precip, weather.snow, d2.* '
+                      'from d2 left join weather on d2."HOUR" = weather."HOUR"', con)
+    con.close()
+    for col in ['temp', 'precip', 'wind', 'snow']:
+        out[col] = out[col].ffill().bfill()
+    week_day = datetime.date.fromisoformat(Date).strftime('%A')
+    for day in ['Friday', 'Monday', 'Thursday', 'Tuesday', 'Wednesday']:
+        out['DAYOFWEEK_' + day] = 1.0 if week_day == day else 0.0
+    out['count'] = out['count'].fillna(0)
+    out.loc[out['count'] == 0, 'AvgSp'] = out.loc[out['count'] == 0, 'speed_limit']
+    return out[input_data.DAILY_COLUMNS]
+
+def timed_s(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+def benchmark(n_links=20000, rscript=None):
+    folder = tempfile.mkdtemp(prefix='features_benchmark_')
+    cwd = os.getcwd()
+    rscript = os.path.abspath(rscript) if rscript else None
+    try:
+        weather = synthetic_day(folder, n_links)
+        os.chdir(folder)
+        r_s, expected = timed_s(lambda: r_stage(DATE, weather))
+        python_s, daily_data = timed_s(lambda: input_data.build_daily_data(DATE, weather))
+        pd.testing.assert_frame_equal(daily_data.astype(float), expected.astype(float))
+        print("%d links x 24 hours = %d rows, same table" % (n_links, len(daily_data)))
+        print("R stage, emulated  %8.2f s" % r_s)
+        print("input_data.py      %8.2f s  (%.1fx)" % (python_s, r_s / python_s))
+        if rscript is None:
+            return
+        if shutil.which('Rscript') is None:
+            print("Rscript not found, %s not timed" % rscript)
+            return
+        r_s, _ = timed_s(lambda: subprocess.run(['Rscript', rscript, DATE], check=True))
+        print("Rscript %-10s %8.2f s, weather request included" % (os.path.basename(rscript), r_s))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--links', type=int, default=20000, help='links of the synthetic network')
+    parser.add_argument('--rscript', help='input_data.R to also time with Rscript')
+    args = parser.parse_args()
+    benchmark(args.links, args.rscript)
@@ -0,0 +1,45 @@
+"""
+Scaling benchmark of the fleet energy kernel.
+
+Times one energy_kernel pass over a synthetic network for fleets of 1 to all
+vehicles of Vehicle_Models/, against one single-vehicle kernel run per
+vehicle, and checks that every per-vehicle energy matches its single run.
+Reports the median over repeated runs; the fleet pass should grow well below
+linearly with the number of vehicles.
+
+Examples:
+> python fleet_benchmark.py
+> python fleet_benchmark.py --links 200000 --reps 3
+"""
+
+import argparse
+import numpy as np
+
+from energy_benchmark import synthetic_network
+from instrumentation import median_s
+from model_registry import default_registry
+from VolEstScript import energy_kernel, extract_extra_links
+
+def separate_runs(net, fleet):
+    return {name: energy_kernel(net, {name: vehicle}) for name, vehicle in fleet.items()}
+
+def benchmark(n_links=50000, reps=3):
+    registry = default_registry()
+    names = sorted(registry.names())
+    net = extract_extra_links(synthetic_network(n_links))
+    print("%d links x 2 directions x 24 hours" % n_links)
+    print("%9s %12s %14s %8s" % ('vehicles', 'fleet kernel', 'separate runs', 'ratio'))
+    for k in range(1, len(names) + 1):
+        fleet = {name: (registry.get(name), 1.0) for name in names[:k]}
+        fleet_s, metrics = median_s(lambda: energy_kernel(net, fleet), reps)
+        separate_s, single = median_s(lambda: separate_runs(net, fleet), reps)
+        for name in fleet:
+            np.testing.assert_array_equal(metrics['energy_' + name], single[name]['energy_' + name])
+        print("%9d %11.3fs %13.3fs %7.2fx" % (k, fleet_s, separate_s, separate_s / fleet_s))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--links', type=int, default=50000, help='links of the synthetic network')
+    parser.add_argument('--reps', type=int, default=3, help='timed runs per case')
+    args = parser.parse_args()
+    benchmark(args.links, args.reps)
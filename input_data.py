@@ -0,0 +1,226 @@
+"""
+Assemble the daily feature table for the volume model, the Python version of
+input_data.R.
+
+For one date, the TomTom network and hourly results extracted in ./<date>
+are turned into one row per link and hour with the link attributes, hourly
+weather and day of week, in the column order xgb.dat was trained on. The
+hourly DBF files are read in parallel and concatenated once, the Id x HOUR
+grid is filled by position instead of joins, and the network and weather
+attributes are gathered by index.
+
+Examples:
+> from input_data import build_daily_data
+>
+> daily_data = build_daily_data("2020-03-10")   # DataFrame, ready for estimate_volume.predict_volume
+
+Or from the command line, writing ./<date>/daily_data like input_data.R:
+> python input_data.py 2020-03-10
+"""
+
+import datetime
+import json
+import os
+import re
+import sys
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    from shapely import get_coordinates  # shapely >= 2
+except ImportError:
+    get_coordinates = None
+
+from intermediate_store import write_table
+
+HOURS = range(24)
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+DAILY_COLUMNS = ['Id', 'temp', 'wind', 'precip', 'snow', 'LONGITUDE', 'LATITUDE',
+                 'speed_limit', 'frc', 'HOUR', 'AvgSp', 'count',
+                 'DAYOFWEEK_Friday', 'DAYOFWEEK_Monday', 'DAYOFWEEK_Thursday',
+                 'DAYOFWEEK_Tuesday', 'DAYOFWEEK_Wednesday']
+WEATHER_URL = "http://cleanedobservations.wsi.com/CleanedObs.svc/GetObs?"
+WEATHER_KEY = os.environ.get('WSI_USER_KEY', 'df91579241f6569da3efe52187f6991e')
+WEATHER_FIELDS = {'surfaceTemperatureFahrenheit': 'temp',
+                  'windSpeedMph': 'wind',
+                  'precipitationPreviousHourInches': 'precip',
+                  'snowfallInches': 'snow'}
+
+def read_dbf(path, columns=None):
+    """Read a dBase III table (the attribute file of a shapefile) with one
+    fixed-width numpy read per file.
+
+    Args:
+        path: (str) .dbf file
+
+        columns: (list) positions of the fields to parse, all when None
+
+    Returns:
+        table: (DataFrame) one column per field in file order, numeric
+        fields as float, deleted records dropped
+    """
+    with open(path, 'rb') as f:
+        header = f.read(32)
+        n_records = int.from_bytes(header[4:8], 'little')
+        header_len = int.from_bytes(header[8:10], 'little')
+        record_len = int.from_bytes(header[10:12], 'little')
+        descriptors = f.read(header_len - 32)
+        f.seek(header_len)
+        data = f.read(n_records * record_len)
+
+    fields = []
+    for i in range(0, len(descriptors) - 31, 32):
+        if descriptors[i:i+1] == b'\r':
+            break
+        name = descriptors[i:i+11].split(b'\x00')[0].decode('ascii', 'replace')
+        fields.append((name, chr(descriptors[i+11]), descriptors[i+16]))
+
+    # a deletion flag byte, then the fixed-width fields of every record
+    lengths = [length for name, kind, length in fields]
+    dtype = np.dtype({'names': ['deleted'] + ['f%d' % i for i in range(len(fields))],
+                      'formats': ['S1'] + ['S%d' % length for length in lengths],
+                      'offsets': [0] + list(np.cumsum([1] + lengths)[:-1]),
+                      'itemsize': record_len})
+    records = np.frombuffer(data, dtype=dtype, count=n_records)
+    records = records[records['deleted'] != b'*']
+
+    table = {}
+    for i in range(len(fields)) if columns is None else columns:
+        name, kind, length = fields[i]
+        values = records['f%d' % i]
+        if kind in 'NFI':
+            # float() takes the padding, only all-blank fields need a value
+            chars = np.ascontiguousarray(values).view(np.uint8).reshape(len(values), length)
+            values = values.copy()
+            values[((chars == 32) | (chars == 0)).all(axis=1)] = b'nan'
+            table[name] = values.astype(float)
+        else:
+            table[name] = np.char.decode(np.char.strip(values, b' \x00'), 'latin-1')
+    return pd.DataFrame(table)
+
+def read_network(Date):
+    """TomTom network attributes with the first coordinate of every link.
+    """
+    import geopandas as gpd
+
+    network = gpd.read_file(os.path.join(Date, 'network.shp'))
+    network = network[network['FRC'] <= 6]
+    if get_coordinates is not None:
+        coords, index = get_coordinates(network.geometry.values, return_index=True)
+        first = coords[np.unique(index, return_index=True)[1]]
+    else:
+        first = np.array([(geom.geoms[0] if hasattr(geom, 'geoms') else geom).coords[0]
+                          for geom in network.geometry])
+    network_df = pd.DataFrame(network.drop(columns='geometry'))
+    network_df['LONGITUDE'] = first[:, 0]
+    network_df['LATITUDE'] = first[:, 1]
+    return network_df.reset_index(drop=True)
+
+def read_hourly(Date, workers=8):
+    """Read every hourly result DBF of the date in parallel.
+
+    Returns:
+        daily_data: (DataFrame) Id, AvgSp, count and HOUR of all files
+    """
+    files = sorted(f for f in os.listdir(Date) if Date in f and f.lower().endswith('.dbf'))
+
+    def read_hour(file_name):
+        # fields 1, 5 and 9 as in input_data.R, the hour is in the file name
+        data = read_dbf(os.path.join(Date, file_name), [0, 4, 8])
+        data.columns = ['Id', 'AvgSp', 'count']
+        data['HOUR'] = int(re.split(r'-|_', file_name)[3])
+        return data
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tables = list(pool.map(read_hour, files))
+    if not tables:
+        return pd.DataFrame({'Id': [], 'AvgSp': [], 'count': [], 'HOUR': []})
+    return pd.concat(tables, ignore_index=True)
+
+def get_weather(Date, lat=35.043831, long=-85.308608):
+    """Hourly weather of the date from the WSI cleaned observations API.
+
+    Returns:
+        weather: (DataFrame) temp, wind, precip and snow indexed by HOUR
+    """
+    day = datetime.date.fromisoformat(Date)
+    query = {'version': 2, 'lat': lat, 'long': long,
+             'startDate': day.strftime('%m/%d/%Y'),
+             'endDate': (day + datetime.timedelta(days=1)).strftime('%m/%d/%Y'),
+             'interval': 'hourly', 'time': 'lwt', 'units': 'imperial', 'format': 'json',
+             'fields': ','.join(WEATHER_FIELDS), 'delivery': 'stream', 'userKey': WEATHER_KEY}
+    with urllib.request.urlopen(WEATHER_URL + urllib.parse.urlencode(query)) as r:
+        hours = pd.DataFrame(json.loads(r.read().decode('utf-8'))['weatherData']['hourly']['hours'])
+    stamp = pd.to_datetime(hours['dateHrLwt'], format='%m/%d/%Y %H:%M:%S')
+    hours = hours[(stamp.dt.date == day).values]
+    hours.index = stamp[(stamp.dt.date == day).values].dt.hour.values
+    return hours[list(WEATHER_FIELDS)].rename(columns=WEATHER_FIELDS).astype(float)
+
+def hourly_weather(weather):
+    # one row per hour; missing hours take the last earlier observation, wrapping
+    # around midnight like na.locf over the Id-major rows of input_data.R
+    weather = weather[~weather.index.duplicated()].reindex(HOURS)
+    return pd.concat([weather, weather]).ffill().iloc[len(HOURS):].bfill()
+
+def build_daily_data(Date, weather=None, workers=8):
+    """One row per network link and hour, in DAILY_COLUMNS order.
+
+    Args:
+        Date: (str) date as YYYY-MM-dd, the folder of the extracted TomTom data
+
+        weather: (DataFrame) temp, wind, precip and snow indexed by hour,
+        from get_weather when None
+
+        workers: (int) threads reading the hourly DBF files
+
+    Returns:
+        daily_data: (DataFrame) features for estimate_volume.predict_volume
+    """
+    network_df = read_network(Date)
+    hourly = read_hourly(Date, workers)
+    if weather is None:
+        weather = get_weather(Date)
+
+    # dense Id x HOUR grid, Id-major like meshgrid in input_data.R
+    ids = network_df['Id'].values
+    n_hours = len(HOURS)
+    daily_data = pd.DataFrame({'Id': np.repeat(ids, n_hours),
+                               'HOUR': np.tile(np.arange(n_hours), len(ids))})
+
+    # place the hourly results by grid position, first row wins for duplicates
+    link = pd.Index(ids).get_indexer(hourly['Id'].values)
+    hour = hourly['HOUR'].values.astype(int)
+    valid = (link >= 0) & (hour >= 0) & (hour < n_hours)
+    position = link[valid] * n_hours + hour[valid]
+    position, first = np.unique(position, return_index=True)
+    for col in ['AvgSp', 'count']:
+        values = np.full(len(daily_data), np.nan)
+        values[position] = hourly[col].values[valid][first]
+        daily_data[col] = values
+
+    # network attributes by link, weather by hour
+    daily_data['speed_limit'] = np.repeat(network_df['SpeedLimit'].values, n_hours)
+    daily_data['frc'] = np.repeat(network_df['FRC'].values, n_hours)
+    daily_data['LONGITUDE'] = np.repeat(network_df['LONGITUDE'].values, n_hours)
+    daily_data['LATITUDE'] = np.repeat(network_df['LATITUDE'].values, n_hours)
+    weather = hourly_weather(weather)
+    for col in ['temp', 'wind', 'precip', 'snow']:
+        daily_data[col] = weather[col].values[daily_data['HOUR'].values]
+
+    week_day = WEEKDAYS[datetime.date.fromisoformat(Date).weekday()]
+    for day in ['Friday', 'Monday', 'Thursday', 'Tuesday', 'Wednesday']:
+        daily_data['DAYOFWEEK_' + day] = 1.0 if week_day == day else 0.0
+
+    # links without probes drive at the speed limit
+    daily_data['count'] = daily_data['count'].fillna(0)
+    no_probes = daily_data['count'].values == 0
+    daily_data.loc[no_probes, 'AvgSp'] = daily_data['speed_limit'].values[no_probes]
+    return daily_data[DAILY_COLUMNS]
+
+if __name__=="__main__":
+    query_date = sys.argv[1] # Date format: "yyyy-mm-dd"
+    write_table(build_daily_data(query_date), os.path.join(query_date, 'daily_data'))
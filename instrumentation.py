@@ -0,0 +1,211 @@
+"""
+Per-stage timing and memory instrumentation for the pipeline.
+
+Stages are wrapped in spans, either as a context manager or a decorator:
+
+> from instrumentation import span, timed, write_report
+>
+> with span('map_match') as s:
+>     merged_df = map_match(Date)
+>     s.rows = len(merged_df)
+>
+> @timed('energy_kernel')
+> def energy_kernel(...): ...
+>
+> write_report(Date + '/run_report.json')
+
+Each span records wall time, the CPU time of its own thread, the CPU time of
+child processes such as the R scripts that exited during the span, the peak
+RSS of the process and of its children so far, and an optional row count.
+Child CPU time is process-wide: a child reaped by another thread during the
+span is counted too. Spans nest within a thread, so stages running
+concurrently in a thread pool each keep their own parents; the report lists
+every span with its parent and self time, totals per name and the hottest
+span by self time.
+
+Spans are only recorded when PIPELINE_PROFILE=1 is set in the environment
+(inherited by subprocesses). Otherwise span() and @timed cost a flag check.
+Stages can also add to named counters with count(), reported with the spans.
+Setting PIPELINE_PROFILE_SPAN=<name> additionally runs that span under
+cProfile and dumps pstats to <name>.prof (open with snakeviz or pstats).
+Only the span of that name is profiled, and only in the thread running it;
+its last call overwrites the dump of earlier ones. With
+PIPELINE_PROFILE_SPAN=auto every span is profiled over its self time and the
+slowest call by self time is dumped by write_report, at a cost to the run's
+timings; the report names the dump under 'profile'.
+"""
+
+import cProfile
+import datetime
+import functools
+import json
+import os
+import resource
+import statistics
+import threading
+import time
+
+ENABLED = os.environ.get('PIPELINE_PROFILE', '') not in ('', '0')
+PROFILE_SPAN = os.environ.get('PIPELINE_PROFILE_SPAN')
+
+records = []
+counters = {}
+# (self wall time, name, profiler) of the slowest span with PIPELINE_PROFILE_SPAN=auto
+slowest = []
+local = threading.local()
+lock = threading.Lock()
+
+def current_stack():
+    if not hasattr(local, 'stack'):
+        local.stack = []
+    return local.stack
+
+def max_rss_mb(who):
+    # ru_maxrss is KB on Linux, bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024.0 ** 2 if os.uname().sysname == 'Darwin' else 1024.0)
+
+class _null_span:
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = _null_span()
+
+class _span:
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.child_wall = 0.0
+        self.profiler = None
+
+    def __enter__(self):
+        stack = current_stack()
+        self.parent = stack[-1].name if stack else None
+        if PROFILE_SPAN == 'auto' and stack and stack[-1].profiler is not None:
+            # a span's profile covers its self time only
+            stack[-1].profiler.disable()
+        stack.append(self)
+        if PROFILE_SPAN in (self.name, 'auto'):
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # a profiler is already active, from Python 3.12 on in any thread
+                self.profiler = None
+        times = os.times()
+        self.children_cpu = times.children_user + times.children_system
+        self.cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.cpu
+        times = os.times()
+        children_cpu = times.children_user + times.children_system - self.children_cpu
+        if self.profiler is not None:
+            self.profiler.disable()
+            if PROFILE_SPAN != 'auto':
+                self.profiler.dump_stats(self.name + '.prof')
+            else:
+                with lock:
+                    if not slowest or wall - self.child_wall > slowest[0][0]:
+                        slowest[:] = [(wall - self.child_wall, self.name, self.profiler)]
+        stack = current_stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_wall += wall
+            if PROFILE_SPAN == 'auto' and stack[-1].profiler is not None:
+                stack[-1].profiler.enable()
+        records.append({'name': self.name,
+                        'parent': self.parent,
+                        'wall_s': round(wall, 6),
+                        'self_wall_s': round(wall - self.child_wall, 6),
+                        'cpu_s': round(cpu, 6),
+                        'children_cpu_s': round(children_cpu, 6),
+                        'max_rss_mb': round(max_rss_mb(resource.RUSAGE_SELF), 1),
+                        'children_max_rss_mb': round(max_rss_mb(resource.RUSAGE_CHILDREN), 1),
+                        'rows': self.rows,
+                        'failed': exc_type is not None})
+        return False
+
+def span(name):
+    """Context manager recording one pipeline stage, a no-op when disabled.
+    """
+    return _span(name) if ENABLED else NULL_SPAN
+
+def timed(name=None):
+    """Decorator recording every call of a function as a span. The row count
+    is taken from the return value when it is a DataFrame or array.
+    """
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with _span(span_name) as s:
+                result = func(*args, **kwargs)
+                if hasattr(result, 'shape'):
+                    s.rows = len(result)
+            return result
+        return wrapper
+    return decorate
+
+def count(name, value):
+    """Add value to a named counter of the run report, a no-op when disabled.
+    """
+    if ENABLED:
+        with lock:
+            counters[name] = counters.get(name, 0) + value
+
+def reset():
+    del records[:]
+    del current_stack()[:]
+    del slowest[:]
+    counters.clear()
+
+def report():
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record['name'], {'calls': 0, 'wall_s': 0.0, 'self_wall_s': 0.0,
+                                                   'cpu_s': 0.0, 'children_cpu_s': 0.0})
+        total['calls'] += 1
+        for key in ('wall_s', 'self_wall_s', 'cpu_s', 'children_cpu_s'):
+            total[key] = round(total[key] + record[key], 6)
+    hottest = max(totals, key=lambda name: totals[name]['self_wall_s']) if totals else None
+    return {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'pid': os.getpid(),
+            'spans': records,
+            'totals': totals,
+            'counters': counters,
+            'hottest': hottest,
+            'profile': slowest[0][1] + '.prof' if slowest else None}
+
+def write_report(path):
+    """Write the JSON run report, if instrumentation is enabled.
+    """
+    if not ENABLED:
+        return None
+    if slowest:
+        slowest[0][2].dump_stats(slowest[0][1] + '.prof')
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+    return path
+
+def median_s(func, reps):
+    """Median wall time in seconds of reps calls of func, and the result of
+    the last call, for the *_benchmark.py scripts.
+    """
+    times = []
+    for i in range(reps):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
@@ -0,0 +1,138 @@
+"""
+Intermediate store for the tables handed between pipeline stages
+(daily_data -> daily_data_pred -> map matching).
+
+Tables are addressed by a path without extension, e.g. "2020-03-10/daily_data",
+and written as typed columnar Parquet or Feather files so the next stage skips
+text parsing and can load only the columns it needs. CSV is kept as a fallback
+when pyarrow is not installed or INTERMEDIATE_FORMAT=csv is set.
+
+Examples:
+> from intermediate_store import read_table, write_table
+>
+> write_table(network_pred, query_date + '/daily_data_pred')
+> volume = read_table(query_date + '/daily_data_pred',
+>                     columns=['Id', 'HOUR', 'AvgSp', 'pred_volume'])
+"""
+
+import os
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather', 'csv': '.csv'}
+
+# column types shared by every stage, cast on write and on read
+DTYPES = {'Id': 'int64',
+          'HOUR': 'int64',
+          'AvgSp': 'float32',
+          'speed_limit': 'float32',
+          'pred_volume': 'float32'}
+
+def default_format():
+    fmt = os.environ.get('INTERMEDIATE_FORMAT', 'parquet' if pa is not None else 'csv')
+    if fmt not in EXTENSIONS:
+        raise ValueError('unknown intermediate format: %s' % fmt)
+    if fmt != 'csv' and pa is None:
+        return 'csv'
+    return fmt
+
+def find_table(path):
+    """Return (file, format) of the most recently written table at path,
+    whichever stage (R or Python) and format produced it.
+    """
+    found = [(os.path.getmtime(path + ext), path + ext, fmt) for fmt, ext in EXTENSIONS.items()
+             if os.path.exists(path + ext)]
+    if not found:
+        raise FileNotFoundError('no intermediate table at %s' % path)
+    _, file_name, fmt = max(found)
+    return file_name, fmt
+
+def cast_types(df):
+    dtypes = {col: DTYPES[col] for col in df.columns if col in DTYPES and df[col].dtype != DTYPES[col]}
+    return df.astype(dtypes) if dtypes else df
+
+def write_table(df, path, fmt=None):
+    fmt = fmt or default_format()
+    file_name = path + EXTENSIONS[fmt]
+    df = cast_types(df)
+    if fmt == 'parquet':
+        df.to_parquet(file_name, index=False)
+    elif fmt == 'feather':
+        feather.write_feather(df.reset_index(drop=True), file_name)
+    else:
+        df.to_csv(file_name, index=False)
+    return file_name
+
+def read_table(path, columns=None):
+    file_name, fmt = find_table(path)
+    if fmt == 'parquet':
+        df = pd.read_parquet(file_name, columns=columns)
+    elif fmt == 'feather':
+        df = feather.read_feather(file_name, columns=columns)
+    else:
+        df = pd.read_csv(file_name, usecols=columns, dtype={col: DTYPES[col] for col in DTYPES
+                                                            if columns is None or col in columns})
+    return cast_types(df)
+
+def iter_table(path, chunk_size, columns=None):
+    """Yield the table at path as DataFrames of at most chunk_size rows.
+    """
+    file_name, fmt = find_table(path)
+    if fmt == 'parquet':
+        for batch in pq.ParquetFile(file_name).iter_batches(batch_size=chunk_size, columns=columns):
+            yield cast_types(batch.to_pandas())
+    elif fmt == 'feather':
+        table = feather.read_table(file_name, columns=columns, memory_map=True)
+        for batch in table.to_batches(max_chunksize=chunk_size):
+            yield cast_types(batch.to_pandas())
+    else:
+        for chunk in pd.read_csv(file_name, usecols=columns, chunksize=chunk_size):
+            yield cast_types(chunk)
+
+class table_writer:
+    """Write a table chunk by chunk, e.g. from iter_table.
+
+    > with table_writer(query_date + '/daily_data_pred') as writer:
+    >     for chunk in iter_table(query_date + '/daily_data', 100000):
+    >         writer.write(predict_volume(chunk))
+    """
+
+    def __init__(self, path, fmt=None):
+        self.fmt = fmt or default_format()
+        self.file_name = path + EXTENSIONS[self.fmt]
+        self.schema = None
+        self.writer = None
+
+    def write(self, df):
+        df = cast_types(df)
+        first = self.schema is None
+        if self.fmt == 'csv':
+            df.to_csv(self.file_name, index=False, mode='w' if first else 'a', header=first)
+            self.schema = list(df.columns)
+            return
+        # later chunks are cast to the schema of the first one
+        table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        if first:
+            self.schema = table.schema
+            if self.fmt == 'parquet':
+                self.writer = pq.ParquetWriter(self.file_name, self.schema)
+            else:
+                self.writer = pa.ipc.new_file(self.file_name, self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,65 @@
+"""
+Load-time benchmark of the vehicle model formats.
+
+Times loading every model of the catalog from its pickle (unpickle and
+compile the rates table), from its pickle with the rates table cached by
+model_registry.py, and from the compact table (convert_models.py), and the
+first prediction after each load. Reports the median over repeated loads,
+with the file in the page cache, and the private bytes of the loaded model.
+
+Examples:
+> python convert_models.py
+> python load_benchmark.py
+> python load_benchmark.py --reps 200
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+
+from instrumentation import median_s
+from model_registry import VEHICLE_MODELS, TABLE_SUFFIX, load_explicitbin, load_table, model_bytes
+from routee.models.explicitBin import explicitBin
+
+def load_pickle(path):
+    model = explicitBin(path[:-len('.pkl')])
+    model.read_model(path)
+    return model
+
+def first_predict_ms(loader, path, columns, reps):
+    times = np.empty(reps)
+    for i in range(reps):
+        model = loader(path)
+        start = time.perf_counter()
+        model.predict_arrays(columns)
+        times[i] = time.perf_counter() - start
+    return np.median(times) * 1e3
+
+def benchmark(folder=VEHICLE_MODELS, reps=50):
+    columns = {'speed_mph_float': np.array([5.0, 35.0, 65.0]),
+               'grade_percent_float': np.array([-2.0, 0.5, 3.0]),
+               'miles': np.array([0.2, 0.5, 1.0])}
+    names = sorted(f[:-len('.pkl')] for f in os.listdir(folder) if f.endswith('.pkl'))
+    for name in names:
+        base = os.path.join(folder, name)
+        cases = [('pickle', load_pickle, base + '.pkl'),
+                 ('pickle + cached rates', load_explicitbin, base + '.pkl'),
+                 ('table', load_table, base + TABLE_SUFFIX)]
+        print(name)
+        for case, loader, path in cases:
+            if not os.path.exists(path):
+                print("  %-22s missing, run convert_models.py" % case)
+                continue
+            load = median_s(lambda: loader(path), reps)[0] * 1e3
+            predict = first_predict_ms(loader, path, columns, reps)
+            private, shared = model_bytes(loader(path))
+            print("  %-22s load %7.3f ms  first predict %6.3f ms  private %7d bytes  mapped %5d bytes"
+                  % (case, load, predict, private, shared))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--folder', default=VEHICLE_MODELS, help='catalog folder')
+    parser.add_argument('--reps', type=int, default=50, help='timed loads per case')
+    args = parser.parse_args()
+    benchmark(args.folder, args.reps)
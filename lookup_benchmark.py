@@ -0,0 +1,80 @@
+"""
+Load and join benchmark of the compiled TomTom lookup.
+
+Times reading the lookup CSV with pandas as map matching used to, compiling
+it with lookup_cache.build_lookup, and memory-mapping the compiled array
+(checksum included), then joins a synthetic day of hourly volumes to it with
+the old DataFrame merge and with lookup_cache.join_volume. Reports medians
+over repeated runs and checks that both joins return the same table. The
+CSV is copied to a temporary folder, so the cache next to it is untouched.
+
+Examples:
+> python lookup_benchmark.py
+> python lookup_benchmark.py --lookup 2020_TomTom_TPO.csv --coverage 0.5 --reps 50
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+from instrumentation import median_s
+from lookup_cache import build_lookup, load_lookup, join_volume
+
+def read_csv(csv_path):
+    # read_in_files before lookup_cache.py
+    lookupTable = pd.read_csv(csv_path)
+    lookupTable.drop(columns=['Unnamed: 0'], inplace=True)
+    return lookupTable
+
+def synthetic_volume_flat(tom_ids, coverage=0.8, seed=0):
+    # wide speed_<h>/volume_<h> table of flattenDataFrame, for part of the
+    # lookup ids plus ids missing from the lookup
+    rng = np.random.default_rng(seed)
+    tom_ids = np.unique(tom_ids)
+    ids = np.concatenate([rng.choice(tom_ids, int(coverage * len(tom_ids)), replace=False),
+                          tom_ids.max() + 1 + np.arange(len(tom_ids) // 10)])
+    columns = {}
+    for h in range(24):
+        columns['speed_' + str(h)] = rng.uniform(5, 70, len(ids))
+        columns['volume_' + str(h)] = rng.uniform(0, 500, len(ids))
+    volume_flat = pd.DataFrame(columns, index=pd.Index(np.sort(ids), name='Id'))
+    volume_flat['TomTomId'] = volume_flat.index
+    return volume_flat
+
+def merge_volume(lookupTable, volume_flat):
+    # mergeVolAndSumo before lookup_cache.py
+    df_merged = lookupTable.merge(volume_flat, left_on='tomId', right_on='Id')
+    df_merged.drop(columns=['tomId'], inplace=True)
+    return df_merged
+
+def benchmark(csv_path, coverage=0.8, reps=20):
+    folder = tempfile.mkdtemp(prefix='lookup_benchmark_')
+    try:
+        path = os.path.join(folder, os.path.basename(csv_path))
+        shutil.copy(csv_path, path)
+        csv_s, lookupTable = median_s(lambda: read_csv(path), reps)
+        build_s, _ = median_s(lambda: build_lookup(path), reps)
+        load_s, lookup = median_s(lambda: load_lookup(path), reps)
+        print("%d lookup rows" % len(lookup))
+        print("load: CSV %7.2f ms  build cache %7.2f ms  cached mmap %7.2f ms"
+              % (csv_s * 1e3, build_s * 1e3, load_s * 1e3))
+
+        volume_flat = synthetic_volume_flat(lookupTable['tomId'].dropna().values.astype('int64'), coverage)
+        merge_s, expected = median_s(lambda: merge_volume(lookupTable, volume_flat), reps)
+        join_s, result = median_s(lambda: join_volume(lookup, volume_flat), reps)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False, rtol=1e-6)
+        print("join %d volume rows -> %d rows: merge %7.2f ms  join_volume %7.2f ms, same table"
+              % (len(volume_flat), len(result), merge_s * 1e3, join_s * 1e3))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--lookup', default='2020_TomTom_TPO.csv', help='lookup CSV')
+    parser.add_argument('--coverage', type=float, default=0.8, help='share of lookup ids with volumes')
+    parser.add_argument('--reps', type=int, default=20, help='timed runs per case')
+    args = parser.parse_args()
+    benchmark(args.lookup, args.coverage, args.reps)
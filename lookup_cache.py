@@ -0,0 +1,94 @@
+"""
+Compiled TomTom -> network lookup table.
+
+The lookup CSV (2020_TomTom_TPO.csv) is static across days, so it is parsed once
+into a structured numpy array sorted by tomId and saved next to the CSV as
+<name>.lookup.npy, with the SHA-256 of the source CSV in <name>.lookup.json.
+Later runs memory-map the array and rebuild it only when the CSV checksum no
+longer matches.
+
+Examples:
+> from lookup_cache import load_lookup, join_volume
+>
+> lookup = load_lookup("2020_TomTom_TPO.csv")
+> merged_df = join_volume(lookup, volume_flat)
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+LOOKUP_DTYPE = np.dtype([('tomId', '<i8'),
+                         ('sumoId', '<i4'),
+                         ('distance', '<f4'),
+                         ('row', '<i4')])  # position in the CSV, keeps merge order
+
+def file_checksum(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def cache_paths(csv_path):
+    base = os.path.splitext(csv_path)[0]
+    return base + '.lookup.npy', base + '.lookup.json'
+
+def build_lookup(csv_path):
+    """Parse the lookup CSV and write the sorted array and its metadata.
+    """
+    npy_path, meta_path = cache_paths(csv_path)
+    checksum = file_checksum(csv_path)
+    table = pd.read_csv(csv_path, usecols=['sumoId', 'tomId', 'distance']).dropna(subset=['tomId'])
+
+    lookup = np.empty(len(table), dtype=LOOKUP_DTYPE)
+    lookup['tomId'] = table['tomId'].values
+    lookup['sumoId'] = table['sumoId'].values
+    lookup['distance'] = table['distance'].values
+    lookup['row'] = np.arange(len(table))
+    lookup = lookup[np.argsort(lookup['tomId'], kind='stable')]
+
+    # write to temporary files first so concurrent runs never see a partial cache
+    np.save(npy_path + '.tmp.npy', lookup)
+    os.replace(npy_path + '.tmp.npy', npy_path)
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump({'source': os.path.basename(csv_path), 'sha256': checksum, 'rows': len(lookup)}, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return lookup
+
+def load_lookup(csv_path):
+    """Memory-map the compiled lookup, rebuilding it if the CSV changed.
+    """
+    npy_path, meta_path = cache_paths(csv_path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['sha256'] == file_checksum(csv_path):
+            return np.load(npy_path, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        pass
+    build_lookup(csv_path)
+    return np.load(npy_path, mmap_mode='r')
+
+def join_volume(lookup, volume_flat):
+    """Inner join of lookup rows to volume_flat (indexed by TomTom Id) by
+    binary search over the sorted ids, in the row order of the CSV.
+
+    Returns the same columns as merging the CSV table on tomId and dropping
+    tomId: sumoId, distance and the volume_flat columns.
+    """
+    ids = volume_flat.index.values
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+
+    pos = np.searchsorted(sorted_ids, lookup['tomId'])
+    pos[pos == len(sorted_ids)] = 0
+    matched = np.flatnonzero(sorted_ids[pos] == lookup['tomId']) if len(sorted_ids) else np.array([], dtype=int)
+    matched = matched[np.argsort(lookup['row'][matched], kind='stable')]
+
+    df_merged = pd.DataFrame({'sumoId': lookup['sumoId'][matched],
+                              'distance': lookup['distance'][matched]})
+    volume_rows = volume_flat.iloc[order[pos[matched]]].reset_index(drop=True)
+    return pd.concat([df_merged, volume_rows], axis=1)
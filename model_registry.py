@@ -0,0 +1,265 @@
+"""
+Registry of loaded energy and volume models, shared by every request of a
+process.
+
+The catalog in Vehicle_Models/ is indexed by file name without reading any
+model. A model is loaded on its first get() and kept in a least recently used
+cache bounded by a number of models and of bytes. A model whose file changed
+on disk is loaded again on its next get().
+
+The compiled rates table of an explicitBin model is saved next to its pickle
+as <name>.rates.npy, with the SHA-256 of the pickle in <name>.rates.json (as
+lookup_cache.py does for the lookup table), and every load memory-maps it
+read-only. Forked workers and other processes on the same machine then read
+the same page-cache pages instead of each compiling and holding a copy.
+
+A model converted to the compact format (<name>.table.json and
+<name>.table.npy, see convert_models.py) is read from it instead of the
+pickle, unless the pickle was written later.
+
+Models are shared: treat what get() returns as read-only.
+
+Examples:
+> from model_registry import default_registry
+>
+> models = default_registry()
+> models.names()            # every model in Vehicle_Models/
+> model = models.get('gasoline_conv_Volkswagen_Tiguan_36000_explicitbin')
+> models.add('xgb', 'xgb.dat', estimate_volume.load_model)
+> xgb = models.get('xgb')
+> models.stats()
+{'indexed': 7, 'loaded': ['gasoline_conv_...', 'xgb'], 'bytes': ..., 'hits': 0, 'misses': 2, ...}
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+import numpy as np
+
+from lookup_cache import file_checksum
+from routee.models.explicitBin import explicitBin
+
+VEHICLE_MODELS = "Vehicle_Models"
+TABLE_SUFFIX = '.table.json'
+
+def rates_paths(pkl_path):
+    base = os.path.splitext(pkl_path)[0]
+    return base + '.rates.npy', base + '.rates.json'
+
+def read_rates(pkl_path, checksum):
+    """Memory-map the saved rates table of a pickled model, None when it is
+    missing or was compiled from another version of the pickle.
+    """
+    npy_path, meta_path = rates_paths(pkl_path)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['sha256'] == checksum:
+            return np.load(npy_path, mmap_mode='r')
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+def write_rates(pkl_path, checksum, rate_table):
+    # temporary files first so concurrent processes never map a partial table
+    npy_path, meta_path = rates_paths(pkl_path)
+    np.save(npy_path + '.tmp.npy', np.ascontiguousarray(rate_table))
+    os.replace(npy_path + '.tmp.npy', npy_path)
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump({'source': os.path.basename(pkl_path), 'sha256': checksum,
+                   'shape': list(rate_table.shape)}, f)
+    os.replace(meta_path + '.tmp', meta_path)
+    return np.load(npy_path, mmap_mode='r')
+
+def load_explicitbin(path):
+    """Read an explicitBin pickle with its rates table memory-mapped, compiling
+    and saving the table first when needed. Falls back to an in-memory table
+    when the catalog folder is read-only.
+    """
+    checksum = file_checksum(path)
+    rates = read_rates(path, checksum)
+    model = explicitBin(os.path.splitext(path)[0])
+    model.read_model(path, rates)
+    if rates is None:
+        try:
+            model.rate_table = write_rates(path, checksum, model.rate_table)
+        except OSError:
+            pass
+    return model
+
+def load_table(path):
+    """Read an explicitBin model in the compact format, its rates table
+    memory-mapped.
+    """
+    model = explicitBin(path[:-len(TABLE_SUFFIX)])
+    model.read_table(path)
+    return model
+
+def catalog_loader(path):
+    return load_table if path.endswith(TABLE_SUFFIX) else load_explicitbin
+
+def model_bytes(model):
+    """Private and memory-mapped bytes of a loaded model.
+    """
+    if not isinstance(model, explicitBin):
+        return 0, 0
+    # the model DataFrame of a compact table is only counted once built
+    frame = model._model
+    private = 0 if frame is None else \
+                int(frame.memory_usage(deep=True).sum()) + int(frame.index.memory_usage(deep=True))
+    # the raveled copy lookup_rates gathers from, once built
+    padded = getattr(model, 'padded_rates', None)
+    private += 0 if padded is None else int(padded.nbytes)
+    if isinstance(model.rate_table, np.memmap):
+        return private, int(model.rate_table.nbytes)
+    return private + int(model.rate_table.nbytes), 0
+
+class registry:
+    """Index of model files and cache of the loaded models.
+
+    Args:
+        folder: (str) catalog of explicitBin .pkl files
+
+        max_models: (int) loaded models kept at most
+
+        max_bytes: (int) private bytes of the loaded models kept at most,
+        memory-mapped tables not counted; None for no limit
+    """
+
+    def __init__(self, folder=VEHICLE_MODELS, max_models=32, max_bytes=None):
+        self.folder = folder
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.files = {}
+        self.loaded = collections.OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+        self.index()
+
+    def index(self):
+        """Scan the catalog folder, keeping models registered with add().
+
+        Returns:
+            names: (list) names of all indexed models
+        """
+        with self.lock:
+            files = {name: entry for name, entry in self.files.items() if entry['loader'] is not None}
+            if os.path.isdir(self.folder):
+                for file_name in sorted(os.listdir(self.folder)):
+                    path = os.path.join(self.folder, file_name)
+                    if file_name.endswith('.pkl'):
+                        name = file_name[:-4]
+                    elif file_name.endswith(TABLE_SUFFIX):
+                        name = file_name[:-len(TABLE_SUFFIX)]
+                    else:
+                        continue
+                    # the compact table unless the pickle was written after it
+                    other = files.get(name)
+                    if other is not None and other['loader'] is None:
+                        pkl, table = sorted([path, other['path']], key=lambda p: p.endswith(TABLE_SUFFIX))
+                        path = pkl if os.stat(pkl).st_mtime_ns > os.stat(table).st_mtime_ns else table
+                    files[name] = {'path': path, 'loader': None}
+            self.files = files
+            return self.names()
+
+    def add(self, name, path, loader):
+        """Index a model file outside the catalog, e.g. the volume model,
+        read with loader(path) on its first get().
+        """
+        with self.lock:
+            entry = self.files.get(name)
+            if entry is None or entry['path'] != path or entry['loader'] is not loader:
+                self.files[name] = {'path': path, 'loader': loader}
+                self.loaded.pop(name, None)
+
+    def names(self):
+        return sorted(self.files)
+
+    def path(self, name):
+        """File a model is read from, the .pkl or the compact table."""
+        with self.lock:
+            return self.files[name]['path']
+
+    def get(self, name):
+        """The loaded model, read from disk on the first call and whenever
+        its file changed since.
+        """
+        with self.lock:
+            if name not in self.files:
+                raise KeyError('no model %s in %s' % (name, self.folder))
+            entry = self.files[name]
+            st = os.stat(entry['path'])
+            signature = (st.st_size, st.st_mtime_ns)
+            cached = self.loaded.get(name)
+            if cached is not None and cached['signature'] == signature:
+                self.loaded.move_to_end(name)
+                self.hits += 1
+                return cached['model']
+
+            if cached is not None:
+                self.reloads += 1
+            self.misses += 1
+            start = time.perf_counter()
+            loader = entry['loader'] or catalog_loader(entry['path'])
+            model = loader(entry['path'])
+            self.load_seconds += time.perf_counter() - start
+            private, shared = model_bytes(model)
+            if entry['loader'] is not None:
+                private = st.st_size
+            self.loaded[name] = {'model': model, 'signature': signature,
+                                 'bytes': private, 'shared_bytes': shared}
+            self.loaded.move_to_end(name)
+            self.evict()
+            return model
+
+    def evict(self):
+        # least recently used first, never the model just loaded
+        while len(self.loaded) > 1 and (len(self.loaded) > self.max_models or
+                                        (self.max_bytes is not None and self.bytes() > self.max_bytes)):
+            self.loaded.popitem(last=False)
+            self.evictions += 1
+
+    def bytes(self):
+        return sum(cached['bytes'] for cached in self.loaded.values())
+
+    def clear(self):
+        with self.lock:
+            self.loaded.clear()
+
+    def stats(self):
+        """Loaded models, their bytes and the cache counters.
+
+        Returns:
+            stats: (dict) indexed and loaded models, private and memory-mapped
+            bytes, hits, misses, reloads of changed files, evictions and the
+            total load time
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'indexed': len(self.files),
+                    'loaded': list(self.loaded),
+                    'bytes': self.bytes(),
+                    'shared_bytes': sum(cached['shared_bytes'] for cached in self.loaded.values()),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits/lookups if lookups else None,
+                    'reloads': self.reloads,
+                    'evictions': self.evictions,
+                    'load_seconds': round(self.load_seconds, 6)}
+
+registries = {}
+
+def default_registry(folder=VEHICLE_MODELS):
+    """The registry of the catalog folder shared by the whole process, and by
+    workers forked from it.
+    """
+    key = os.path.abspath(folder)
+    if key not in registries:
+        registries[key] = registry(folder)
+    return registries[key]
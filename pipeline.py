@@ -0,0 +1,422 @@
+"""
+Run the whole pipeline of one date in one process, as a DAG of stages:
+
+    fetch -> daily_data -> daily_data_pred -> map_match -> energy -> export
+                 volume_model --^          lookup --^   network --^
+                                                          fleet --^
+
+Stages hand their DataFrames and arrays to each other in memory and run in a
+thread pool as soon as their inputs are ready, so e.g. the network shapefile,
+the vehicle models, the volume model and the lookup table load while the
+features are assembled. These static inputs are kept for the next date run in
+the same process, or in processes forked from it (see batch_estimate.py), and
+loaded again only when their files change.
+
+Every stage has a key, a hash of its version, parameters, the size and
+modification time of its source files and the keys of its inputs. The keys
+of the stages whose output is stored are kept in EnergyData/pipeline/<date>.json.
+A stage is skipped when its key is unchanged and its output is still there.
+When a stage that has to run needs the value of a skipped one, that value is
+read from its checkpoint, or the stage runs again when it has none. Only the
+energy store is persisted; --checkpoint also keeps the daily_data,
+daily_data_pred and map_match tables in ./<date> (see intermediate_store.py).
+
+Examples:
+> python pipeline.py 2020-03-10
+> python pipeline.py 2020-03-10 --fleet fleet.json --incremental --checkpoint
+> python pipeline.py 2020-03-10 --force energy --dry-run
+
+Or from python:
+> from pipeline import run_date
+>
+> run_date('2020-03-10', checkpoint=True)
+{'fetch': 'run', 'network': 'run', ..., 'energy': 'run', 'export': 'run'}
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from instrumentation import span, write_report
+
+STATE_FOLDER = os.path.join("EnergyData", "pipeline")
+NETWORK_PATH = "Network/network_with_grade.shp"
+LOOKUP_PATH = "2020_TomTom_TPO.csv"
+VOLUME_MODEL_PATH = "xgb.dat"
+DEFAULT_VEHICLE = "gasoline_conv_Volkswagen_Tiguan_36000_explicitbin"
+VOLUME_COLUMNS = ['Id', 'HOUR', 'AvgSp', 'pred_volume']
+NETWORK_SOURCES = [NETWORK_PATH, NETWORK_PATH[:-4] + '.dbf']
+
+class PipelineError(Exception):
+    pass
+
+class stage:
+    """One node of the pipeline.
+
+    Args:
+        name: (str) unique stage name
+
+        func: (callable) called with the values of inputs, in order
+
+        inputs: (list) names of the stages whose values func takes
+
+        after: (list) names of stages that only have to finish first
+
+        sources: (list) files whose size and modification time enter the key
+
+        params: (dict) JSON settings that enter the key
+
+        stored: (callable) True when the output of the stage is on disk,
+        None for stages that only live in memory
+
+        save, load: (callable) write the value as a checkpoint after func,
+        read it back instead of running func
+
+        final: (bool) the stored output is a result of the pipeline, so the
+        stage is brought up to date even when no other stage needs it
+
+        version: (int) bump when the stage computes something else
+    """
+
+    def __init__(self, name, func, inputs=(), after=(), sources=(), params=None,
+                 stored=None, save=None, load=None, final=False, version=1):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.after = list(after)
+        self.sources = list(sources)
+        self.params = params or {}
+        self.stored = stored
+        self.save = save
+        self.load = load
+        self.final = final
+        self.version = version
+
+    @property
+    def depends(self):
+        return self.inputs + self.after
+
+def topological_order(stages):
+    by_name = {s.name: s for s in stages}
+    order, visiting = [], set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise PipelineError('cycle through stage %s' % name)
+        if name not in by_name:
+            raise PipelineError('unknown stage %s' % name)
+        visiting.add(name)
+        for dep in by_name[name].depends:
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for s in stages:
+        visit(s.name)
+    return order
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [path, None, None]
+    return [path, st.st_size, st.st_mtime_ns]
+
+def stage_keys(order, by_name):
+    keys = {}
+    for name in order:
+        s = by_name[name]
+        sha = hashlib.sha256(json.dumps([name, s.version, s.params,
+                                         [file_signature(path) for path in s.sources],
+                                         [keys[dep] for dep in s.depends]],
+                                        sort_keys=True).encode())
+        keys[name] = sha.hexdigest()
+    return keys
+
+def plan(order, by_name, keys, state, force=()):
+    """Decide what each stage does: 'run', 'load' from its checkpoint, 'skip'
+    because its stored output is up to date, or None when nothing needs it.
+    Final stages and stages without consumers are the targets.
+    """
+    consumers = {name: [] for name in order}
+    for name in order:
+        for dep in by_name[name].depends:
+            consumers[dep].append(name)
+
+    # needed: the value is read by a stage that runs, wanted: only has to be up to date
+    actions, needed, wanted = {}, set(), set()
+    for name in reversed(order):
+        s = by_name[name]
+        if not (s.final or not consumers[name] or name in needed or name in wanted):
+            actions[name] = None
+            continue
+        fresh = (name not in force and s.stored is not None and state.get(name) == keys[name]
+                 and s.stored())
+        if fresh and name not in needed:
+            actions[name] = 'skip'
+        elif fresh and s.load is not None:
+            actions[name] = 'load'
+        else:
+            actions[name] = 'run'
+            needed.update(s.inputs)
+            wanted.update(s.after)
+    return {name: actions[name] for name in order}
+
+def read_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def write_state(state, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def execute(s, action, values):
+    with span(s.name) as sp:
+        if action == 'load':
+            value = s.load()
+        else:
+            value = s.func(*[values[dep] for dep in s.inputs])
+            if s.save is not None:
+                s.save(value)
+        if hasattr(value, 'shape'):
+            sp.rows = len(value)
+    return value
+
+def run(stages, state_path, workers=4, force=(), dry_run=False):
+    """Run the stages that are out of date, concurrently where the DAG allows.
+
+    Args:
+        stages: (list) of stage
+
+        state_path: (str) JSON file of the keys of the stored stage outputs
+
+        workers: (int) stages running at the same time
+
+        force: (list) names of stages to run even when up to date
+
+        dry_run: (bool) only plan
+
+    Returns:
+        actions: (dict) stage name -> 'run', 'load', 'skip' or None
+    """
+    by_name = {s.name: s for s in stages}
+    order = topological_order(stages)
+    keys = stage_keys(order, by_name)
+    state = read_state(state_path)
+    actions = plan(order, by_name, keys, state, force)
+    if dry_run:
+        return actions
+
+    values = {}
+    done = set(name for name in order if actions[name] in (None, 'skip'))
+    todo = [name for name in order if actions[name] in ('run', 'load')]
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while todo or running:
+            for name in [name for name in todo if all(dep in done for dep in by_name[name].depends)]:
+                todo.remove(name)
+                running[pool.submit(execute, by_name[name], actions[name], values)] = name
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                # a failing stage stops the run, the stages already done keep their state
+                values[name] = future.result()
+                done.add(name)
+                if actions[name] == 'run':
+                    if by_name[name].stored is not None:
+                        state[name] = keys[name]
+                    else:
+                        state.pop(name, None)
+                    write_state(state, state_path)
+                # drop values nothing else reads any more
+                for dep in by_name[name].inputs:
+                    if all(consumer in done for consumer in order
+                           if dep in by_name[consumer].inputs and actions[consumer] in ('run', 'load')):
+                        values.pop(dep, None)
+    return actions
+
+###############################
+#     STAGES OF ONE DATE      #
+###############################
+# static inputs loaded once per process, e.g. in the parent of forked workers,
+# see batch_estimate.py
+loaded = {}
+
+def load_once(name, sources, load):
+    # loaded again when a source file changes
+    signature = [file_signature(path) for path in sources]
+    if name not in loaded or loaded[name][0] != signature:
+        loaded[name] = (signature, load())
+    return loaded[name][1]
+
+def fetch(Date):
+    from tomtom_fetch import fetch_dates
+    result = fetch_dates([Date])[Date]
+    if result['status'] != 'done':
+        raise PipelineError("TomTom data download is failed: " + result['error'])
+    return Date
+
+def features(Date):
+    from input_data import build_daily_data
+    if not any(f.startswith(Date) and f.lower().endswith('.dbf') for f in os.listdir(Date)):
+        raise PipelineError("the TomTom files of %s were removed after an earlier run, run with "
+                            "--checkpoint or remove ./%s to fetch them again" % (Date, Date))
+    return build_daily_data(Date)
+
+def volume_model():
+    # xgboost and R's libraries can both ship OpenMP on macOS
+    os.environ.setdefault('KMP_DUPLICATE_LIB_OK', 'TRUE')
+    from estimate_volume import load_model
+    from model_registry import default_registry
+    # unpickled once per process, again only when the file changes
+    models = default_registry()
+    models.add('xgb', VOLUME_MODEL_PATH, load_model)
+    return models.get('xgb')
+
+def volume(daily_data, xgb):
+    from estimate_volume import predict_volume
+    return predict_volume(daily_data, xgb)
+
+def map_match(daily_data_pred, lookupTable):
+    import VolEstScript
+    from intermediate_store import cast_types
+    # the same columns and types map matching reads from daily_data_pred on disk
+    volume_flat = VolEstScript.flattenDataFrame(cast_types(daily_data_pred[VOLUME_COLUMNS]))
+    return VolEstScript.mergeVolAndSumo(lookupTable, volume_flat)
+
+def lookup():
+    from lookup_cache import load_lookup
+    return load_once('lookup', [LOOKUP_PATH], lambda: load_lookup(LOOKUP_PATH))
+
+def network():
+    import geopandas as gpd
+    return load_once('network', NETWORK_SOURCES, lambda: gpd.read_file(NETWORK_PATH))
+
+def fleet(fleet_shares):
+    import VolEstScript
+    if fleet_shares is None:
+        return {DEFAULT_VEHICLE: (VolEstScript.import_vehicle_models(), 1.0)}
+    return VolEstScript.import_fleet(fleet_shares)
+
+def energy(Date, merged_df, net, fleet, incremental):
+    import VolEstScript
+    VolEstScript.net = net
+    VolEstScript.estimate_energy(merged_df, Date, fleet, incremental)
+
+def export(Date, geojson, keep_raw):
+    from energy_store import export_geojson
+    import VolEstScript
+    for direction, hour in geojson:
+        export_geojson(Date, direction, hour)
+    if not keep_raw:
+        VolEstScript.deleteFiles(Date)
+
+def checkpoint_stage(name, func, inputs, Date, checkpoint, **kwargs):
+    from intermediate_store import find_table, read_table, write_table
+    path = os.path.join(Date, name)
+    if not checkpoint:
+        return stage(name, func, inputs, **kwargs)
+
+    def stored():
+        try:
+            find_table(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    return stage(name, func, inputs, stored=stored, save=lambda df: write_table(df, path),
+                 load=lambda: read_table(path), **kwargs)
+
+def vehicle_path(name):
+    # the .pkl or the compact table the registry reads the model from
+    from model_registry import default_registry
+    try:
+        return default_registry().path(name)
+    except KeyError:
+        return os.path.join('Vehicle_Models', name + '.pkl')
+
+def date_stages(Date, fleet_shares=None, incremental=False, checkpoint=False, geojson=(), keep_raw=False):
+    """The stages of one date, see the module docstring.
+
+    Args:
+        fleet_shares: (dict) {vehicle model name in Vehicle_Models/: fleet
+        share}, the default vehicle when None
+
+        incremental: (bool) only recompute links whose inputs changed, see
+        VolEstScript.build_energy_estimate
+
+        checkpoint: (bool) keep daily_data, daily_data_pred and map_match in ./<Date>
+
+        geojson: (list) of (direction, hour) slices to export as GeoJSON
+
+        keep_raw: (bool) keep the extracted TomTom files
+    """
+    vehicles = list(fleet_shares) if fleet_shares else [DEFAULT_VEHICLE]
+    energy_path = os.path.join("EnergyData", "energy", "date=" + Date)
+    return [
+        stage('fetch', lambda: fetch(Date), params={'date': Date},
+              stored=lambda: os.path.isdir(Date), load=lambda: Date),
+        checkpoint_stage('daily_data', features, ['fetch'], Date, checkpoint),
+        stage('volume_model', volume_model, sources=[VOLUME_MODEL_PATH]),
+        checkpoint_stage('daily_data_pred', volume, ['daily_data', 'volume_model'], Date, checkpoint),
+        stage('lookup', lookup, sources=[LOOKUP_PATH]),
+        checkpoint_stage('map_match', map_match, ['daily_data_pred', 'lookup'], Date, checkpoint),
+        stage('network', network, sources=NETWORK_SOURCES),
+        stage('fleet', lambda: fleet(fleet_shares), params={'fleet': fleet_shares},
+              sources=[vehicle_path(name) for name in vehicles]),
+        stage('energy', lambda merged_df, net, models: energy(Date, merged_df, net, models, incremental),
+              ['map_match', 'network', 'fleet'], stored=lambda: os.path.isdir(energy_path), final=True),
+        stage('export', lambda: export(Date, geojson, keep_raw), after=['energy'],
+              params={'geojson': list(geojson), 'keep_raw': keep_raw}),
+    ]
+
+def run_date(Date, fleet_shares=None, incremental=False, checkpoint=False, geojson=(), keep_raw=False,
+             workers=4, force=(), dry_run=False):
+    """Bring the energy estimate of Date up to date.
+
+    Returns:
+        actions: (dict) stage name -> 'run', 'load', 'skip' or None
+    """
+    stages = date_stages(Date, fleet_shares, incremental, checkpoint, geojson, keep_raw)
+    return run(stages, os.path.join(STATE_FOLDER, Date + '.json'), workers, force, dry_run)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('date', help='date as YYYY-MM-dd')
+    parser.add_argument('--fleet', help='JSON file of {vehicle model name: fleet share}')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only recompute links whose inputs changed since the stored run')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='keep daily_data, daily_data_pred and map_match in ./<date>')
+    parser.add_argument('--geojson', nargs=2, action='append', default=[], metavar=('DIRECTION', 'HOUR'),
+                        help='also export this slice as GeoJSON, can be repeated')
+    parser.add_argument('--keep-raw', action='store_true', help='keep the extracted TomTom files')
+    parser.add_argument('--workers', type=int, default=4, help='stages running at the same time')
+    parser.add_argument('--force', nargs='+', default=[], help='stages to run even when up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only print what would run')
+    args = parser.parse_args()
+
+    fleet_shares = None
+    if args.fleet:
+        with open(args.fleet) as f:
+            fleet_shares = json.load(f)
+    start = time.time()
+    actions = run_date(args.date, fleet_shares, args.incremental, args.checkpoint,
+                       [(direction, int(hour)) for direction, hour in args.geojson], args.keep_raw,
+                       args.workers, args.force, args.dry_run)
+    for name, action in actions.items():
+        print("%-16s %s" % (name, action or '-'))
+    if not args.dry_run:
+        # per-stage timings, only with PIPELINE_PROFILE=1
+        if os.path.isdir(args.date):
+            write_report(os.path.join(args.date, 'run_report.json'))
+        print("Done!!! %.1f s" % (time.time() - start))
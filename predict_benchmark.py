@@ -0,0 +1,59 @@
+"""
+Micro-benchmark of explicitBin rate lookup on a large link table.
+
+Times predict on synthetic links, NaNs and out-of-range values included,
+through the dense bin-indexed rates table, against the pd.cut + merge on the
+Interval index of the rates DataFrame that predict used before. Reports the
+median over repeated runs and checks that both return the same Series.
+
+Examples:
+> python predict_benchmark.py
+> python predict_benchmark.py --rows 5000000 --model diesel_conv_BMW_X3_xDrive28d_36000_explicitbin
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+
+from instrumentation import median_s
+from model_registry import default_registry
+
+def synthetic_links(model, n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    links = {model.distance: rng.uniform(0.01, 2, n_rows)}
+    for f_i in model.features:
+        edges = model.attrb_dict[f_i]
+        # a tenth of the rows beyond the outer edges, one in a hundred NaN
+        span = edges[-1] - edges[0]
+        values = rng.uniform(edges[0] - 0.05*span, edges[-1] + 0.05*span, n_rows)
+        values[rng.random(n_rows) < 0.01] = np.nan
+        links[f_i] = values
+    return pd.DataFrame(links)
+
+def merge_predict(model, link_df):
+    # explicitBin.predict_helper before the dense rates table
+    link_df = link_df.copy()
+    for f_i in model.features:
+        link_df.loc[:, f_i + '_bins'] = pd.cut(link_df[f_i], model.attrb_dict[f_i])
+    bin_cols = [f_i + '_bins' for f_i in model.features]
+    link_df = pd.merge(link_df, model.model[['rate']], how='left', left_on=bin_cols, right_index=True)
+    link_df.dropna(how='any', inplace=True)
+    return (link_df['rate']/100.0)*link_df[model.distance]
+
+def benchmark(model, n_rows=1000000, reps=5):
+    links = synthetic_links(model, n_rows)
+    merge_s, expected = median_s(lambda: merge_predict(model, links), reps)
+    table_s, result = median_s(lambda: model.predict(links), reps)
+    pd.testing.assert_series_equal(result, expected, check_names=False)
+    print("%d rows, %d predicted" % (n_rows, len(result)))
+    print("pd.cut + merge %8.3f s" % merge_s)
+    print("rates table    %8.3f s  (%.1fx), identical output" % (table_s, merge_s / table_s))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--model', default='gasoline_conv_Volkswagen_Tiguan_36000_explicitbin',
+                        help='model name in Vehicle_Models/')
+    parser.add_argument('--rows', type=int, default=1000000, help='links to predict')
+    parser.add_argument('--reps', type=int, default=5, help='timed runs per case')
+    args = parser.parse_args()
+    benchmark(default_registry().get(args.model), args.rows, args.reps)
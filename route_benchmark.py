@@ -0,0 +1,86 @@
+"""
+Latency benchmark of route energy prediction.
+
+Times building a route from a dict of link attributes, or from link objects,
+and predicting its energy, through the DataFrame (route.df) and the array
+path, and reports p50/p99 latency. Then predicts a batch of routes of random
+length as one ragged route_batch, and counts single-link lookups per second.
+
+Examples:
+> python route_benchmark.py
+> python route_benchmark.py --model diesel_conv_BMW_X3_xDrive28d_36000_explicitbin --links 60 --routes 100000
+"""
+
+import argparse
+import time
+import numpy as np
+
+from model_registry import default_registry
+from routee.roads.link import link
+from routee.roads.route import route, route_from_links, route_batch
+
+def random_route(rng, n_links):
+    return {'speed_mph_float': rng.uniform(0, 80, n_links).tolist(),
+            'grade_percent_float': rng.uniform(-8, 8, n_links).tolist(),
+            'miles': rng.uniform(0.01, 1, n_links).tolist()}
+
+def latency(func, reps):
+    """p50 and p99 wall time of func() in microseconds."""
+    times = np.empty(reps)
+    for i in range(reps):
+        start = time.perf_counter()
+        func()
+        times[i] = time.perf_counter() - start
+    return np.percentile(times, 50) * 1e6, np.percentile(times, 99) * 1e6
+
+def benchmark(model, n_links=30, n_routes=10000, reps=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    trip = random_route(rng, n_links)
+    links = [dict(zip(trip, values)) for values in zip(*trip.values())]
+    cases = [('route -> predict(route.df)', lambda: model.predict(route(trip).df)),
+             ('route -> predict(route)', lambda: model.predict(route(trip))),
+             ('links -> predict(route.df)', lambda: model.predict(route_from_links(*[link(d) for d in links]).df)),
+             ('links -> predict(route)', lambda: model.predict(route_from_links(*[link(d) for d in links])))]
+    for name, func in cases:
+        p50, p99 = latency(func, reps)
+        print("%-28s %d links: p50 %8.1f us  p99 %8.1f us" % (name, n_links, p50, p99))
+
+    routes = [route(random_route(rng, n)) for n in rng.integers(5, 2 * n_links, n_routes)]
+    start = time.perf_counter()
+    batch = route_batch.from_routes(routes)
+    built = time.perf_counter() - start
+    model.predict_routes(batch)
+    predicted = time.perf_counter() - start - built
+    print("route_batch of %d routes, %d links: build %.3f s, predict_routes %.3f s (%.2f us per route)"
+          % (len(batch), batch.offsets[-1], built, predicted, predicted / len(batch) * 1e6))
+
+def lookup_benchmark(model, n_links=100000, seed=0):
+    rng = np.random.default_rng(seed)
+    trip = random_route(rng, n_links)
+    links = [link(dict(zip(trip, values))) for values in zip(*trip.values())]
+    tuples = list(zip(trip['speed_mph_float'], trip['grade_percent_float']))
+    model.compile_link_index()
+    start = time.perf_counter()
+    for l in links:
+        l.lookup(model)
+    per_link = time.perf_counter() - start
+    start = time.perf_counter()
+    for values in tuples:
+        model.link_rate(values)
+    per_tuple = time.perf_counter() - start
+    print("link.lookup %.0f links/s, link_rate of feature tuples %.0f links/s"
+          % (n_links / per_link, n_links / per_tuple))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--model', default='gasoline_conv_Volkswagen_Tiguan_36000_explicitbin',
+                        help='model name in Vehicle_Models/')
+    parser.add_argument('--links', type=int, default=30, help='links of the single route')
+    parser.add_argument('--routes', type=int, default=10000, help='routes in the batch')
+    parser.add_argument('--reps', type=int, default=2000, help='timed calls per case')
+    parser.add_argument('--lookups', type=int, default=100000, help='single-link lookups')
+    args = parser.parse_args()
+
+    model = default_registry().get(args.model)
+    benchmark(model, args.links, args.routes, args.reps)
+    lookup_benchmark(model, args.lookups)
@@ -24,53 +24,163 @@ Example application:
 >               distance='miles', 
 >               trip_ids='trip_ids') 
 >
+> # or out-of-core, from pass data larger than memory
+> model_eb.train_chunks(pd.read_csv('fc_data.csv', chunksize=10**6),
+>                       energy='gallons', distance='miles', trip_ids='trip_ids')
+>
 > model_eb.predict(route1) # returns route1 with energy appended to each link
 """
 
 import pandas as pd 
 import numpy as np
+import bisect
 import copy
+import itertools
+import json
+import os
 from ..validation import errors
 from routee.models import predict_model
 
+# version of the files written by dump_table
+TABLE_FORMAT = 'explicitbin-table'
+TABLE_FORMAT_VERSION = 1
+
+def table_paths(path):
+    """JSON metadata and .npy rates paths of a model in the compact format,
+    from the path of either file or their common base name.
+    """
+    base = os.path.splitext(path)[0] if path.endswith(('.json', '.npy')) else path
+    return base + '.json', base + '.npy'
+
+def same_values(a, b):
+    # elementwise equality with NaN equal to NaN
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
 class explicitBin(predict_model.parent):
     """Energy consumption rates matrix with same dimensions as link features.
     
     Class must be initialized with a vehicle description, i.e.:
     
     > explicitBin('2016 Ford Explorer')
+
+    Bin numbers of static link features (grade, lanes) can be memoized per
+    link across predict calls by naming a column with one integer key per
+    link and direction. Grade and lanes differ by direction, so the network
+    ID alone is not enough, i.e.:
+
+    > links_df['link_key'] = 2*links_df['ID'] + (links_df['direction'] == 'BA')
+    > model_eb.link_id = 'link_key'
+
+    Rates can be interpolated multilinearly between bin centers instead of
+    being constant within each bin, i.e.:
+
+    > model_eb.interpolate = True
+
+    The fuel of a model in gallons (e.g. 'diesel') is kept in the table
+    metadata, so fleets can convert it to gallons of gasoline equivalent:
+
+    > model_eb.fuel = 'diesel'
     """
 
+    # features that do not change for a link ID, and the bound on cached links
+    static_features = ['grade_percent_float', 'num_lanes_int']
+    link_id = None
+    bin_cache_size = 2**20
+
+    # multilinear interpolation between bin centers, and the rows interpolated
+    # at a time
+    interpolate = False
+    interp_block = 2**20
+    _model = None
+
+    fuel = None
+
+    @property
+    def model(self):
+        """Trained rates by bin, built from the dense rates table on first use
+        when the model was read with read_table.
+        """
+        if self._model is None and getattr(self, 'rate_table', None) is not None:
+            self._model = self.rates_frame()
+        return self._model
+
+    @model.setter
+    def model(self, value):
+        self._model = value
+
     def train_helper(self):
         """Override parent train_helper method.
         """
 
         # identify attribute and target (energy consumption) columns
         self.features = list(self.attrb_dict.keys())
+        self.compile_bins()
 
-        # Cut and label each attribute - manual        
-        for f_i in self.features:
-            bin_lims = self.attrb_dict[f_i]
-            self.train.loc[:,f_i+'_bins'] = pd.cut(self.train[f_i], bin_lims)
-            self.test.loc[:,f_i+'_bins'] = pd.cut(self.test[f_i], bin_lims)
+        # number the bin of each attribute, labelled as pd.cut would
+        bin_idx = [self.bin_index(f_i, self.train[f_i]) for f_i in self.features]
+        for i, f_i in enumerate(self.features):
+            self.train.loc[:,f_i+'_bins'] = self.bin_labels(i, bin_idx[i])
 
+        # train rates table - energy and distance summed per bin
+        self.set_rates(self.bin_sums(self.train, bin_idx))
 
-        # train rates table - groupby bin columns
-        bin_cols = [i+'_bins' for i in self.features]
-        agg_funs = {self.distance:sum, self.energy:sum}
+        return self.test_helper()
 
-        self.model = self.train.dropna(subset=bin_cols).\
-                        groupby(bin_cols).agg(agg_funs)
-        
-        # rate is dependent on the energy and distance units provided (*100)
-        self.model.loc[:,'rate'] = 100.0*self.model[self.energy]/\
-                                self.model[self.distance]
+    def train_chunks(self, chunks, energy, distance, trip_ids, test_perc=0.2):
+        """Train the rates table out-of-core, from pass data given in chunks.
+        Only the summed energy and distance of every bin and the held-out
+        test passes are kept in memory, the rates table is the same as
+        train on all chunks at once.
+
+        Args:
+            chunks: (iterable) DataFrames of link attributes + fuel
+            consumption, e.g. pd.read_csv(path, chunksize=10**6)
+
+            energy: (str) name/units of the target energy consumption column
 
-        # test rates table performance on self.test holdout
-        ## merge energy rates from grouped table to self.test
-        self.test = pd.merge(self.test, self.model[['rate']], \
-                            how='left', left_on = bin_cols, right_index=True,\
-                            suffixes=('','_pred'))
+            distance: (str) name/units of the distance column
+
+            trip_ids: (str) name of the trip ID column
+
+            test_perc: (float) share of the passes held out for testing and
+            validation
+
+        Returns:
+            self: Energy model object
+        """
+        self.energy = energy
+        self.distance = distance
+        self.trip_ids = trip_ids
+        self.features = list(self.attrb_dict.keys())
+        self.compile_bins()
+        columns = self.features + [distance, energy, trip_ids]
+
+        sums = np.zeros((2, int(np.prod(self.bin_shape()))))
+        held_out = []
+        for chunk in chunks:
+            chunk = chunk[columns].copy()
+            chunk['rate'] = 100.0*chunk[energy]/chunk[distance]
+            train, test = predict_model.test_train_split(chunk.dropna(), test_perc)
+            sums += self.bin_sums(train)
+            held_out.append(test)
+
+        self.set_rates(sums)
+        self.test, self.validate = predict_model.test_train_split(pd.concat(held_out), 0.5)
+
+        return self.test_helper()
+
+    def test_helper(self):
+        """Test rates table performance on the self.test holdout.
+        """
+        # gather energy rates by bin to self.test
+        bin_idx = [self.bin_index(f_i, self.test[f_i]) for f_i in self.features]
+        self.test = self.test.copy()
+        for i, f_i in enumerate(self.features):
+            self.test[f_i+'_bins'] = self.bin_labels(i, bin_idx[i])
+        if self.interpolate:
+            self.test['rate_pred'] = self.interp_rates([self.test[f_i].values for f_i in self.features])
+        else:
+            self.test['rate_pred'] = self.lookup_rates(bin_idx)
 
         self.test.dropna(how='any',inplace=True)
 
@@ -78,6 +188,45 @@ class explicitBin(predict_model.parent):
 
         return self
 
+    def bin_sums(self, pass_df, bin_idx=None):
+        """Sum distance and energy of the passes in every bin.
+
+        Args:
+            pass_df: (DataFrame) self.features, self.distance and self.energy
+            columns
+
+            bin_idx: (list) bin numbers of pass_df from bin_index, computed
+            when None
+
+        Returns:
+            sums: (ndarray) 2 x bins array of summed distance and energy,
+            bins in the flattened rates table order
+        """
+        if bin_idx is None:
+            bin_idx = [self.bin_index(f_i, pass_df[f_i]) for f_i in self.features]
+        # passes outside the bins are summed in a trailing bin, then dropped
+        n_bins = int(np.prod(self.bin_shape()))
+        flat_idx = self.flat_index(bin_idx)
+        flat_idx[flat_idx < 0] = n_bins
+        return np.stack([np.bincount(flat_idx, weights=pass_df[c].values,
+                                     minlength=n_bins+1)[:n_bins] \
+                         for c in (self.distance, self.energy)])
+
+    def set_rates(self, sums):
+        """Build the trained model, one row per bin combination like a
+        groupby on the bin columns, from the summed distance and energy.
+
+        Args:
+            sums: (ndarray) summed distance and energy, see bin_sums
+        """
+        self.model = pd.DataFrame({self.distance: sums[0], self.energy: sums[1]},
+                                  index=self.bins_multiindex())
+
+        # rate is dependent on the energy and distance units provided (*100)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.model.loc[:,'rate'] = 100.0*sums[1]/sums[0]
+
+        self.compile_rates()
 
     def predict_helper(self, link_df):
         """Apply the trained energy model to to predict consumption
@@ -90,24 +239,516 @@ class explicitBin(predict_model.parent):
             road_obj: the link or route object is returned with energy 
             prediction as an added variable
         """
-        # Cut and label each attribute - manual        
-        for f_i in self.features:
-            bin_lims = self.attrb_dict[f_i]
-            link_df.loc[:,f_i+'_bins'] = pd.cut(link_df[f_i], bin_lims)
+        # compile the rates table on first use
+        if getattr(self, 'rate_table', None) is None:
+            self.compile_rates()
 
-        # merge energy rates from grouped table to link/route df
-        bin_cols = [i+'_bins' for i in self.features] 
-        link_df = pd.merge(link_df, self.model[['rate']], \
-                            how='left', left_on = bin_cols, right_index=True)
+        # gather energy rates by the bin number of each attribute, static
+        # attributes from the per-link cache when link IDs are available
+        use_cache = self.link_id is not None and self.link_id in link_df
+        if self.interpolate:
+            rate = self.interp_rates([link_df[f_i].values for f_i in self.features])
+        else:
+            bin_idx = [self.cached_bin_index(f_i, link_df[self.link_id].values, link_df[f_i]) \
+                        if use_cache and f_i in self.static_features \
+                        else self.bin_index(f_i, link_df[f_i]) \
+                        for f_i in self.features]
+            rate = self.lookup_rates(bin_idx)
 
-        link_df.dropna(how='any',inplace=True)
+        # drop rows with any missing attribute or rate, as a left merge
+        # followed by dropna would
+        keep = ~(link_df.isnull().values.any(axis=1) | np.isnan(rate))
 
-        # calculate predicted energy use from merged energy rates
-        energy_pred = (link_df['rate']/\
-                                 100.0)*link_df[self.distance]
+        # calculate predicted energy use from gathered energy rates
+        energy_pred = pd.Series((rate[keep]/100.0)*\
+                                 link_df[self.distance].values[keep],
+                                index=link_df.index[keep])
 
         return energy_pred
-    
+
+    def predict_arrays(self, columns):
+        """Override parent predict_arrays method with a pure numpy lookup,
+        no DataFrame is built.
+        """
+        if getattr(self, 'rate_table', None) is None:
+            self.compile_rates()
+
+        if self.interpolate:
+            rate = self.interp_rates([columns[f_i] for f_i in self.features])
+        else:
+            rate = self.lookup_rates([self.bin_index(f_i, columns[f_i]) \
+                                      for f_i in self.features])
+        return (rate/100.0)*np.asarray(columns[self.distance], dtype=float)
+
+    def bins_multiindex(self):
+        """Every bin combination in rates table order, labelled like a
+        groupby on the pd.cut bin columns.
+        """
+        return pd.MultiIndex.from_product(
+            [pd.CategoricalIndex(c, categories=c, ordered=True) for c in self.bin_categories],
+            names=[i+'_bins' for i in self.features])
+
+    def rates_frame(self):
+        """The rates table as a trained model DataFrame, one rate per bin."""
+        return pd.DataFrame({'rate': np.asarray(self.rate_table, dtype=float).ravel()},
+                            index=self.bins_multiindex())
+
+    def read_model(self, filein, rate_table=None):
+        """Override parent read_model method to compile the rates table
+        as soon as the trained model is loaded, or to take the table
+        compiled earlier from the same file.
+        """
+        super().read_model(filein)
+        self.compile_rates(rate_table)
+
+    def compile_rates(self, rate_table=None):
+        """Compile the trained rates table into a dense array with one axis
+        per feature, indexed by bin number.
+
+        Args:
+            rate_table: (ndarray) the table compiled earlier from the same
+            model, e.g. memory-mapped by model_registry, used as is
+
+        Returns:
+            self.rate_table: (ndarray) energy rates, NaN for bins that have
+            no rate in self.model
+        """
+        self.compile_bins()
+        shape = self.bin_shape()
+        if rate_table is None:
+            self.rate_table = np.full(shape, np.nan)
+        elif rate_table.shape == shape:
+            self.rate_table = rate_table
+        else:
+            raise ValueError('rates table of shape %s, the bins need %s' % (rate_table.shape, shape))
+
+        # locate each trained bin by its interval midpoint, a model read with
+        # read_table has every bin in table order
+        if self._model is None:
+            self.rate_index = np.arange(int(np.prod(shape)))
+        else:
+            bin_idx = [self.bin_index(f_i, self.bin_mids(i)) \
+                        for i, f_i in enumerate(self.features)]
+            self.rate_index = self.flat_index(bin_idx)
+        if rate_table is None:
+            self.rate_table.flat[self.rate_index] = self.model['rate'].values
+
+        # cached bin numbers, the single-link index, the padded rates and the
+        # interpolation grid refer to the previous table
+        self.clear_bin_cache()
+        self.link_index = None
+        self.padded_rates = None
+        self.interp_table = None
+
+        return self.rate_table
+
+    def compile_bins(self):
+        """Bin edges of every feature as arrays.
+        """
+        self.bin_edges = [np.asarray(self.attrb_dict[f_i], dtype=float) \
+                            for f_i in self.features]
+        self._bin_categories = None
+
+    @property
+    def bin_categories(self):
+        """Intervals pd.cut labels the bins of every feature with, built on
+        first use.
+        """
+        if getattr(self, '_bin_categories', None) is None:
+            self._bin_categories = [pd.IntervalIndex.from_breaks(self.attrb_dict[f_i], closed='right') \
+                                    for f_i in self.features]
+        return self._bin_categories
+
+    def bin_shape(self):
+        """Number of bins of every feature, the shape of the rates table."""
+        return tuple(len(e)-1 for e in self.bin_edges)
+
+    def bin_labels(self, level, bin_idx):
+        """Interval labels of bin numbers, as pd.cut returns them.
+
+        Args:
+            level: (int) position of the feature in self.features
+
+            bin_idx: (ndarray) bin numbers from bin_index
+
+        Returns:
+            labels: (Categorical) interval of each bin, NaN for -1
+        """
+        return pd.Categorical.from_codes(bin_idx, categories=self.bin_categories[level],
+                                         ordered=True)
+
+    def bin_mids(self, level):
+        """Interval midpoints of one bin level of the trained model index.
+
+        Args:
+            level: (int or str) position or name of the level in self.model.index
+
+        Returns:
+            mids: (ndarray) midpoint of the bin of every row in self.model
+        """
+        return np.array([iv.mid for iv in self.model.index.get_level_values(level)])
+
+    def bin_index(self, feature, values):
+        """Number the bin of each value using the same right-closed intervals
+        as pd.cut on the edges in attrb_dict.
+
+        Args:
+            feature: (str) name of the feature in self.features
+
+            values: (array-like) feature values of any shape
+
+        Returns:
+            bin_idx: (ndarray) bin number of each value, -1 where pd.cut
+            would return NaN (missing or out of range)
+        """
+        edges = self.bin_edges[self.features.index(feature)]
+        bin_idx = np.searchsorted(edges, np.asarray(values, dtype=float)) - 1
+        return np.where(bin_idx < len(edges)-1, bin_idx, -1)
+
+    def clear_bin_cache(self):
+        """Drop all memoized static-feature bin numbers and reset the hit/miss
+        counters. Needed when the network behind the link IDs changes; changes
+        to attrb_dict are detected and clear the cache automatically.
+        """
+        self.bin_cache = {}
+        self.bin_cache_key = tuple((f_i, tuple(self.attrb_dict[f_i])) \
+                                   for f_i in self.features)
+        self.bin_cache_hits = 0
+        self.bin_cache_misses = 0
+        self.bin_cache_evictions = 0
+
+    def cached_bin_index(self, feature, link_ids, values):
+        """bin_index of a static feature, memoized per link key with least
+        recently used eviction beyond self.bin_cache_size links. The value of
+        every link is stored with its bin, a link whose value differs from
+        the stored one is binned again.
+
+        Args:
+            feature: (str) name of the feature in self.features
+
+            link_ids: (ndarray) integer key of every value, one per link and
+            direction, e.g. a direction-signed link ID
+
+            values: (array-like) feature values, only binned for keys missing
+            from the cache or whose value changed
+
+        Returns:
+            bin_idx: (ndarray) bin number of each value, as from bin_index
+        """
+        key = tuple((f_i, tuple(self.attrb_dict[f_i])) for f_i in self.features)
+        if getattr(self, 'bin_cache_key', None) != key:
+            self.compile_rates()
+        link_ids = np.asarray(link_ids)
+        values = np.asarray(values, dtype=float)
+        cache = self.bin_cache.get(feature)
+        self.bin_cache_tick = getattr(self, 'bin_cache_tick', 0) + 1
+
+        # repeated slices of the same network skip the ID search
+        if cache is not None and np.array_equal(cache['last_ids'], link_ids) and \
+                same_values(cache['last_values'], values).all():
+            cache['used'][cache['last_pos']] = self.bin_cache_tick
+            self.bin_cache_hits += len(link_ids)
+            return cache['last_bins']
+
+        if cache is None:
+            cache = {'ids': link_ids[:0], 'values': np.empty(0), 'bins': np.empty(0, dtype=int),
+                     'used': np.empty(0, dtype=np.int64)}
+        pos = np.searchsorted(cache['ids'], link_ids)
+        pos = np.minimum(pos, max(len(cache['ids'])-1, 0))
+        hit = cache['ids'][pos] == link_ids if len(cache['ids']) else \
+                np.zeros(len(link_ids), dtype=bool)
+        # a stored key with another value is a miss
+        hit[hit] = same_values(cache['values'][pos[hit]], values[hit])
+
+        bin_idx = np.empty(len(link_ids), dtype=int)
+        bin_idx[hit] = cache['bins'][pos[hit]]
+        cache['used'][pos[hit]] = self.bin_cache_tick
+        miss = ~hit
+        if miss.any():
+            bin_idx[miss] = self.bin_index(feature, values[miss])
+            # new keys are added, changed keys replaced
+            new_ids, first = np.unique(link_ids[miss], return_index=True)
+            keep = ~np.isin(cache['ids'], new_ids)
+            ids = np.concatenate([cache['ids'][keep], new_ids])
+            order = np.argsort(ids, kind='stable')
+            stored = np.concatenate([cache['values'][keep], values[miss][first]])[order]
+            bins = np.concatenate([cache['bins'][keep], bin_idx[miss][first]])[order]
+            used = np.concatenate([cache['used'][keep],
+                                   np.full(len(new_ids), self.bin_cache_tick)])[order]
+            ids = ids[order]
+            if len(ids) > self.bin_cache_size:
+                # keep the most recently used links, still sorted by ID
+                keep = np.sort(np.argsort(-used, kind='stable')[:self.bin_cache_size])
+                self.bin_cache_evictions += len(ids) - len(keep)
+                ids, stored, bins, used = ids[keep], stored[keep], bins[keep], used[keep]
+            cache.update(ids=ids, values=stored, bins=bins, used=used)
+            pos = np.minimum(np.searchsorted(ids, link_ids), len(ids)-1)
+            # only exact hits can be replayed on the next identical query
+            if not np.array_equal(ids[pos], link_ids):
+                pos = None
+
+        cache.update(last_ids=link_ids.copy() if pos is not None else None,
+                     last_values=values.copy(), last_pos=pos, last_bins=bin_idx)
+        self.bin_cache[feature] = cache
+        self.bin_cache_hits += int(hit.sum())
+        self.bin_cache_misses += int(miss.sum())
+        return bin_idx
+
+    def bin_cache_stats(self):
+        """Hit/miss counters of the static-feature bin cache.
+
+        Returns:
+            stats: (dict) hits, misses and evictions in links, the hit rate and
+            the number of cached links per feature
+        """
+        if getattr(self, 'bin_cache_key', None) is None:
+            self.clear_bin_cache()
+        lookups = self.bin_cache_hits + self.bin_cache_misses
+        return {'hits': self.bin_cache_hits,
+                'misses': self.bin_cache_misses,
+                'evictions': self.bin_cache_evictions,
+                'hit_rate': self.bin_cache_hits/lookups if lookups else None,
+                'cached_links': {f_i: len(c['ids']) for f_i, c in self.bin_cache.items()}}
+
+    def flat_index(self, bin_idx):
+        """Combine per-feature bin numbers into positions in the flattened
+        rates table.
+
+        Args:
+            bin_idx: (list) bin numbers from bin_index, one array per feature
+            in self.features order, broadcastable against each other
+
+        Returns:
+            flat_idx: (ndarray) position in self.rate_table.ravel(), -1 where
+            any bin is -1
+        """
+        bin_idx = np.broadcast_arrays(*bin_idx)
+        flat_idx = np.ravel_multi_index(bin_idx, self.bin_shape(), mode='clip')
+        valid = np.logical_and.reduce([b >= 0 for b in bin_idx])
+        return np.where(valid, flat_idx, -1)
+
+    def lookup_rates(self, bin_idx):
+        """Gather energy rates from the compiled rates table.
+
+        Args:
+            bin_idx: (list) bin numbers from bin_index, one array per feature
+            in self.features order, broadcastable against each other
+
+        Returns:
+            rates: (ndarray) energy rates, NaN where any bin is -1 or the
+            bin has no trained rate
+        """
+        if getattr(self, 'padded_rates', None) is None:
+            self.compile_padded_rates()
+        return self.padded_rates[self.flat_index(bin_idx)]
+
+    def compile_padded_rates(self):
+        """Flatten the rates table once for lookup_rates, with a trailing NaN
+        cell that catches the -1 positions of flat_index.
+
+        Returns:
+            self.padded_rates: (ndarray) the raveled rates table and a NaN
+        """
+        if getattr(self, 'rate_table', None) is None:
+            self.compile_rates()
+        self.padded_rates = np.append(self.rate_table.ravel(), np.nan)
+        return self.padded_rates
+
+    def compile_interp(self):
+        """Compile the grid of rates at the bin centers for interpolate mode,
+        bins without a rate filled with the rate of the nearest bin that has
+        one (by bin number).
+
+        Returns:
+            self.interp_table: (ndarray) rates table without NaN
+        """
+        if getattr(self, 'rate_table', None) is None:
+            self.compile_rates()
+        table = np.array(self.rate_table, dtype=float)
+        empty = ~np.isfinite(table)
+        if empty.all():
+            raise ValueError('the rates table has no rate to interpolate')
+        if empty.any():
+            # scipy comes with scikit-learn, only needed for tables with empty bins
+            from scipy import ndimage
+            nearest = ndimage.distance_transform_edt(empty, return_distances=False, return_indices=True)
+            table = table[tuple(nearest)]
+        self.bin_centers = [(e[:-1] + e[1:])/2.0 for e in self.bin_edges]
+        self.interp_table = table
+        return self.interp_table
+
+    def interp_rates(self, values):
+        """Interpolate energy rates multilinearly between bin centers. Values
+        between the outer bin edge and center take the rate of the outer bin.
+
+        Args:
+            values: (list) feature values, one array per feature in
+            self.features order, broadcastable against each other
+
+        Returns:
+            rates: (ndarray) energy rates, NaN where a value is missing or
+            outside the bins, as in lookup_rates
+        """
+        if getattr(self, 'interp_table', None) is None:
+            self.compile_interp()
+        values = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in values])
+        shape = values[0].shape
+        values = [v.ravel() for v in values]
+        table = self.interp_table.ravel()
+        strides = [int(np.prod(self.interp_table.shape[i+1:], dtype=np.int64)) \
+                    for i in range(self.interp_table.ndim)]
+
+        rates = np.empty(values[0].size)
+        for start in range(0, len(rates), self.interp_block):
+            block = [v[start:start+self.interp_block] for v in values]
+            valid = np.ones(len(block[0]), dtype=bool)
+            base = np.zeros(len(block[0]), dtype=np.int64)
+            axes = []
+            for v, edges, centers, stride in zip(block, self.bin_edges, self.bin_centers, strides):
+                b = np.searchsorted(edges, v) - 1
+                valid &= (b >= 0) & (b < len(edges)-1)
+                if len(centers) == 1:
+                    continue
+                # lower of the two centers around each value, and the weight of the upper
+                b = np.clip(b, 0, len(centers)-1)
+                k = np.clip(b - (v < centers[b]), 0, len(centers)-2)
+                t = np.clip((v - centers[k])/(centers[k+1] - centers[k]), 0.0, 1.0)
+                base += k*stride
+                axes.append(((1.0 - t, t), stride))
+
+            # sum over the 2**d corners of the cell around each value
+            rate = np.zeros(len(base))
+            for corner in itertools.product((0, 1), repeat=len(axes)):
+                weight = 1.0
+                offset = 0
+                for upper, (t, stride) in zip(corner, axes):
+                    weight = weight*t[upper]
+                    offset += upper*stride
+                rate += weight*table[base + offset]
+            rates[start:start+len(rate)] = np.where(valid, rate, np.nan)
+        return rates.reshape(shape)
+
+    def compile_link_index(self):
+        """Build the index for single-link lookups: the bin edges as lists,
+        the stride of each feature in the flattened rates table and the
+        rates as a list, so a lookup needs no numpy call.
+        """
+        if getattr(self, 'rate_table', None) is None:
+            self.compile_rates()
+        shape = self.rate_table.shape
+        strides = [int(np.prod(shape[i+1:], dtype=np.int64)) for i in range(len(shape))]
+        self.link_index = (list(zip(self.features, [e.tolist() for e in self.bin_edges], strides)),
+                           self.rate_table.ravel().tolist())
+        return self.link_index
+
+    def link_rate(self, link_values):
+        """Energy rate of a single link, one bisection per feature on the
+        same right-closed bins as bin_index.
+
+        Args:
+            link_values: (link, dict or tuple) a link object, a dict of
+            feature values, or a tuple of values in self.features order
+
+        Returns:
+            rate: (float) energy per 100 distance units, NaN when a value is
+            missing or out of range or the bin has no trained rate;
+            interpolated through interp_rates in interpolate mode
+        """
+        if getattr(self, 'link_index', None) is None:
+            self.compile_link_index()
+        index, rates = self.link_index
+        if hasattr(link_values, 'attribute_dict'):
+            link_values = link_values.attribute_dict
+        if isinstance(link_values, dict):
+            link_values = [link_values.get(f_i) for f_i, edges, stride in index]
+        if self.interpolate:
+            return float(self.interp_rates([np.nan if v is None else v for v in link_values]))
+
+        pos = 0
+        for (f_i, edges, stride), value in zip(index, link_values):
+            if value is None:
+                return float('nan')
+            b = bisect.bisect_left(edges, value) - 1
+            # NaN compares False and lands in bin -1
+            if b < 0 or b >= len(edges)-1:
+                return float('nan')
+            pos += b*stride
+        return rates[pos]
+
+    def link_energy(self, link_values, distance=None):
+        """Predicted energy of a single link, see link_rate.
+
+        Args:
+            distance: (float) link distance, read from link_values by
+            self.distance when None
+        """
+        if distance is None:
+            values = getattr(link_values, 'attribute_dict', link_values)
+            distance = values.get(self.distance, float('nan'))
+        return (self.link_rate(link_values)/100.0)*distance
+
+    def dump_table(self, fileout):
+        """Dump the model in the compact format: the dense rates table as a
+        float32 .npy file, and the features, bin edges, units and error
+        metrics as JSON next to it. Unlike the pickle, it loads without
+        pandas objects and is memory-mapped by read_table.
+
+        Args:
+            fileout: (str) path of the JSON file, the rates are written to
+            the same path with a .npy extension
+        """
+        if getattr(self, 'rate_table', None) is None:
+            self.compile_rates()
+        json_path, npy_path = table_paths(fileout)
+        rates = np.ascontiguousarray(self.rate_table, dtype=np.float32)
+
+        # temporary files first so a reader never maps a partial table
+        np.save(npy_path + '.tmp.npy', rates)
+        os.replace(npy_path + '.tmp.npy', npy_path)
+        meta = {'format': TABLE_FORMAT, 'format_version': TABLE_FORMAT_VERSION,
+                'veh_desc': self.veh_desc,
+                'features': list(self.features),
+                'bin_edges': [list(self.attrb_dict[f_i]) for f_i in self.features],
+                'energy': self.energy, 'distance': self.distance, 'fuel': self.fuel,
+                'rate_units': '%s per 100 %s' % (self.energy, self.distance),
+                'errors': {'link_err': getattr(self, 'link_err', getattr(self, 'link_average_error_unweight', None)),
+                           'trip_err': getattr(self, 'trip_err', getattr(self, 'trip_average_error_weight', None)),
+                           'net_err': getattr(self, 'net_err', getattr(self, 'net_error', None))},
+                'rates': os.path.basename(npy_path),
+                'shape': list(rates.shape), 'dtype': str(rates.dtype)}
+        meta['errors'] = {k: None if v is None else float(v) for k, v in meta['errors'].items()}
+        with open(json_path + '.tmp', 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(json_path + '.tmp', json_path)
+
+    def read_table(self, filein):
+        """Read a model written by dump_table, the rates table memory-mapped
+        read-only.
+
+        Args:
+            filein: (str) path of the JSON file
+        """
+        json_path, npy_path = table_paths(filein)
+        with open(json_path) as f:
+            meta = json.load(f)
+        if meta.get('format') != TABLE_FORMAT or meta.get('format_version', 0) > TABLE_FORMAT_VERSION:
+            raise ValueError('%s is not an explicitBin table this version can read' % json_path)
+        rate_table = np.load(os.path.join(os.path.dirname(json_path), meta['rates']),
+                             mmap_mode='r', allow_pickle=False)
+        if list(rate_table.shape) != meta['shape']:
+            raise ValueError('rates of shape %s, the metadata gives %s' % (rate_table.shape, meta['shape']))
+
+        self.energy = meta['energy']
+        self.distance = meta['distance']
+        self.fuel = meta.get('fuel')
+        self.features = meta['features']
+        self.attrb_dict = dict(zip(meta['features'], meta['bin_edges']))
+        self.link_err = meta['errors']['link_err']
+        self.trip_err = meta['errors']['trip_err']
+        self.net_err = meta['errors']['net_err']
+        self.model = None
+        self.compile_rates(rate_table)
+
     def dump_csv(self, fileout):
         """Dump CSV file of table ONLY. No associated metadata.
 
@@ -121,15 +762,16 @@ class explicitBin(predict_model.parent):
         self.model = self.model.reset_index()
         self.model.to_csv(fileout, index=False)
         
-    def cavs_mapper(self, auxLoad=0, speedCol='speed_mph_float_bins', caccEquip=True):
+    def cavs_mapper(self, auxLoad=0, speedCol='speed_mph_float_bins', caccEquip=True, stacked=False):
         """Map the trained routeE model from that of human driven
         vehicles to vehicles with connected automated vehicle (CAV) 
         technologies.
         
         Args:
-            auxLoad: (float) this is the additional auxilary due to electrical
-            demand from the required hardware/sensing devices for CAV technology
-            in units of kilowatts
+            auxLoad: (float or list of floats) this is the additional auxilary
+            due to electrical demand from the required hardware/sensing devices
+            for CAV technology in units of kilowatts. A list maps one scenario
+            per value in a single pass.
             
             speedCol: (str) the name of the vehicle speed bin in the model
             
@@ -137,46 +779,52 @@ class explicitBin(predict_model.parent):
             is equipped with connected addaptive cruise control (CACC) technology. If 
             yes, an energy benefit at low speeds due to drive cycle smoothing is also 
             taken into account.
+
+            stacked: (boolean) for a list of auxLoad values, return one rates
+            table with auxLoad as the outer index level instead of models
             
         Returns:
             self.cavs_model: the mapped model describing energy consuption for
-            the same vehicle with automated technolgies is returned.
+            the same vehicle with automated technolgies is returned. For a list
+            of auxLoad values, a dict of {auxLoad: cavs_model} sharing the bin
+            index of this model, or the stacked rates table.
         
         """
-        
-        # clone the routeE object
-        cavs_model = copy.deepcopy(self)
-        
-        cavs_model.model = pd.DataFrame()
+        scenarios = np.atleast_1d(np.asarray(auxLoad, dtype=float))
         
         # set energy variables
         
         caccBenefit = 0 # set to 0 for now because microsim is only hwy
         
         kwh_to_gge = 1/33.4
-    
-        for index, row in self.model.reset_index().iterrows():
-            
-            avgSpd = row[speedCol].mid #index[0].mid
-            
-            kwh100mi_add = 100.0*(auxLoad/avgSpd)
-            
-            rate_add = kwh100mi_add
-            
-            if self.energy == 'gallons':
-                
-                gal100mi_add = kwh100mi_add*kwh_to_gge
-                
-                rate_add = gal100mi_add
-                
-            row.rate = row.rate + rate_add
-            
-            cavs_model.model = cavs_model.model.append(row, ignore_index=True)
-            
-        feat_lst = [feat+'_bins' for feat in cavs_model.features]
-        
-        # idx_names = [col for col in list(cavs_model.model.columns) if col not in feat_lst]
-            
-        cavs_model.model = cavs_model.model.groupby(by=feat_lst).agg({'rate':'first'})
-                                                                             
-        return cavs_model
\ No newline at end of file
+
+        # rate adder of every (auxLoad, bin) from the speed bin midpoints
+        rate_add = 100.0*np.outer(scenarios, 1.0/self.bin_mids(speedCol))
+        if self.energy == 'gallons':
+            rate_add = rate_add*kwh_to_gge
+        rates = self.model['rate'].values + rate_add
+
+        if stacked:
+            table = pd.concat([self.model[['rate']]]*len(scenarios), 
+                              keys=list(scenarios), names=['auxLoad'])
+            table['rate'] = rates.ravel()
+            return table
+
+        if getattr(self, 'rate_table', None) is None:
+            self.compile_rates()
+
+        cavs_models = {}
+        for a, rate in zip(scenarios, rates):
+            # shallow clone, training data and bin edges are shared
+            cavs_model = copy.copy(self)
+            cavs_model.model = pd.DataFrame({'rate': rate}, index=self.model.index)
+            cavs_model.rate_table = np.full(self.rate_table.shape, np.nan)
+            cavs_model.rate_table.flat[self.rate_index] = rate
+            cavs_model.link_index = None
+            cavs_model.padded_rates = None
+            cavs_model.interp_table = None
+            cavs_models[a] = cavs_model
+
+        if np.ndim(auxLoad) == 0:
+            return cavs_models[scenarios[0]]
+        return cavs_models
@@ -4,9 +4,6 @@ import pickle
 
 from ..validation import errors
 
-from sklearn.model_selection import train_test_split
-from sklearn import linear_model
-
 
 def test_train_split(df, test_perc):
     msk = np.random.rand(len(df)) < (1-test_perc)
@@ -79,6 +76,9 @@ class parent:
         in child classes.
         """
 
+        # sklearn is only needed for training, not for predicting with a saved model
+        from sklearn import linear_model
+
         # train model
         regmod = linear_model.LinearRegression()
         self.model = regmod.fit(self.train[self.features], 
@@ -98,15 +98,54 @@ class parent:
 
         Args:
             links_df: (DataFrame) columns that match self.features and self.distance
-            that describe vehicle passes over links in the road network
+            that describe vehicle passes over links in the road network, or a
+            link, route or route_from_links object
 
         Returns:
-            output: predicted energy consumption for every row in links_df
+            output: predicted energy consumption for every row in links_df,
+            for road objects an array with NaN for links without a prediction
         """
         
+        # road objects carry their links as arrays, no DataFrame is built
+        if isinstance(getattr(links_df, 'columns', None), dict):
+            return self.predict_arrays(links_df.columns)
+
         output = self.predict_helper(links_df)
         
         return output
+
+    def predict_arrays(self, columns):
+        """Predict consumption of links given as one array per column.
+
+        Args:
+            columns: (dict) self.features and self.distance names -> arrays
+            of equal length
+
+        Returns:
+            energy_pred: (ndarray) predicted energy consumption of every link,
+            NaN where predict would drop the link
+        """
+        links_df = pd.DataFrame({c: columns[c] for c in self.features + [self.distance]})
+        energy_pred = self.predict_helper(links_df)
+        return energy_pred.reindex(links_df.index).values.astype(float)
+
+    def predict_routes(self, batch):
+        """Predict consumption of many routes in one pass.
+
+        Args:
+            batch: (route_batch) links of all routes as one ragged array
+
+        Returns:
+            link_energy: (ndarray) predicted energy of every link, NaN where
+            there is no prediction
+
+            route_energy: (ndarray) summed energy of the predicted links of
+            every route
+        """
+        link_energy = self.predict_arrays(batch.columns)
+        route_energy = np.bincount(batch.route_index(), weights=np.nan_to_num(link_energy),
+                                   minlength=len(batch))
+        return link_energy, route_energy
         
     def predict_helper(self, links_df):
         """Helper method for the predict method, steps will be overridden
@@ -149,7 +188,8 @@ class parent:
         out_obj.net_err = self.net_error
         out_obj.attrb_dict = self.attrb_dict
         
-        pickle.dump(out_obj, open(fileout,'wb'))
+        with open(fileout,'wb') as f:
+            pickle.dump(out_obj, f)
         
         
     def read_model(self, filein):
@@ -163,7 +203,8 @@ class parent:
             filein: (str) full path and name of the (pickle) file from which the model
             object will be loaded.
         """
-        in_obj = pickle.load(open(filein,'rb'))
+        # closes the file, and reads models pickled by older pandas versions
+        in_obj = pd.read_pickle(filein)
         self.model = in_obj.model
         self.energy = in_obj.energy
         self.distance = in_obj.distance
@@ -20,6 +20,11 @@ Examples:
 > emodel.train(fc_data) # fc_data = link attributes + fuel consumption
 > emodel.predict(route1)
 [returns route1 with energy appended to each link]
+>
+> # the forest evaluated once on a grid of bins, predicting like explicitBin
+> model_eb = emodel.distill(n_bins=20)
+> model_eb.distill_error
+> model_eb.predict(route1)
 """
 
 import pandas as pd 
@@ -27,12 +32,12 @@ import numpy as np
 
 from ..validation import errors
 from routee.models import predict_model
-
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import RandomizedSearchCV
+from routee.models.explicitBin import explicitBin
 
 # from sklearn2pmml import PMMLPipeline
 
+ERROR_METRICS = ['link_average_error_unweight', 'trip_average_error_weight', 'net_error']
+
 
 class randomForest(predict_model.parent):
     """Random Forest Regressor for energy consumption prediction.
@@ -61,7 +66,9 @@ class randomForest(predict_model.parent):
     def train_helper(self):
         """Override parent train_helper method.
         """
-        
+        # sklearn is only needed for training, not for predicting with a saved model
+        from sklearn.ensemble import RandomForestRegressor
+
         # Number of trees in random forest
         n_estimators = [int(x) for x in np.linspace(start = 50, stop = 1000, num = 10)]
         # Maximum number of levels in tree
@@ -109,4 +116,88 @@ class randomForest(predict_model.parent):
 
         self = errors.all_error(self)
 
-        return self
\ No newline at end of file
+        return self
+
+    def distill(self, attrb_dict=None, n_bins=20, max_cells=2**22):
+        """Distill the trained forest into an explicitBin rates table: the
+        forest predicts the rate at the midpoint of every bin combination
+        once, after which predictions are table lookups.
+
+        Args:
+            attrb_dict: (dict) bin edges of every feature in self.features,
+            chosen from the training data when None or for missing features
+
+            n_bins: (int) bins of each automatically chosen feature, at
+            quantiles of the training data; integer features with at most
+            n_bins values get one bin per value, a constant feature one bin
+            around it. A feature without finite values raises ValueError
+
+            max_cells: (int) largest rates table allowed
+
+        Returns:
+            model_eb: (explicitBin) the distilled model, tested on self.test;
+            model_eb.distill_error compares its rates with the forest's on
+            the test passes (relative difference, share of passes inside
+            the bins) and gives the error metrics of both
+        """
+        attrb_dict = dict(attrb_dict or {})
+        for f_i in self.features:
+            if f_i not in attrb_dict:
+                attrb_dict[f_i] = self.auto_bins(self.train[f_i].values, n_bins, f_i)
+
+        model_eb = explicitBin(self.veh_desc)
+        model_eb.attrb_dict = {f_i: list(attrb_dict[f_i]) for f_i in self.features}
+        model_eb.features = list(self.features)
+        model_eb.energy = self.energy
+        model_eb.distance = self.distance
+        model_eb.trip_ids = self.trip_ids
+        model_eb.compile_bins()
+        shape = model_eb.bin_shape()
+        if np.prod(shape, dtype=np.int64) > max_cells:
+            raise ValueError('a rates table of shape %s has more than %d cells' % (shape, max_cells))
+
+        # forest rate at the midpoint of every cell, in rates table order
+        mids = [(e[:-1] + e[1:])/2.0 for e in model_eb.bin_edges]
+        grid = np.meshgrid(*mids, indexing='ij')
+        grid_df = pd.DataFrame({f_i: g.ravel() for f_i, g in zip(self.features, grid)})
+        model_eb.model = pd.DataFrame({'rate': self.model.predict(grid_df[self.features])},
+                                      index=model_eb.bins_multiindex())
+        model_eb.compile_rates()
+
+        # test on the holdout the forest was tested on
+        bin_idx = [model_eb.bin_index(f_i, self.test[f_i]) for f_i in self.features]
+        model_eb.test = self.test.drop(columns='rate_pred')
+        model_eb.test['rate_pred'] = model_eb.lookup_rates(bin_idx)
+        model_eb.test = model_eb.test.dropna(how='any')
+        model_eb = errors.all_error(model_eb)
+
+        forest_rate = self.test['rate_pred'].values
+        table_rate = model_eb.lookup_rates(bin_idx)
+        rel_diff = np.abs(table_rate - forest_rate)/np.abs(forest_rate)
+        covered = np.isfinite(rel_diff)
+        model_eb.distill_error = {
+            'cells': int(np.prod(shape)),
+            'test_passes': int(len(forest_rate)),
+            'covered': float(covered.mean()) if len(covered) else None,
+            'rate_rel_diff_mean': float(rel_diff[covered].mean()) if covered.any() else None,
+            'rate_rel_diff_p99': float(np.percentile(rel_diff[covered], 99)) if covered.any() else None,
+            'forest': {e: getattr(self, e) for e in ERROR_METRICS},
+            'table': {e: getattr(model_eb, e) for e in ERROR_METRICS}}
+        return model_eb
+
+    @staticmethod
+    def auto_bins(values, n_bins, name='feature'):
+        """Bin edges at quantiles of the values, covering their range with
+        right-closed bins; one bin per value for integers with at most n_bins
+        values, and a single bin around a constant value.
+        """
+        values = values[np.isfinite(values)]
+        if not len(values):
+            raise ValueError('%s has no finite values to place bin edges at' % name)
+        unique = np.unique(values)
+        if len(unique) == 1 or (len(unique) <= n_bins and np.all(unique == np.round(unique))):
+            return np.append(unique - 0.5, unique[-1] + 0.5).tolist()
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, n_bins + 1)))
+        # the smallest value falls in the first bin
+        edges[0] = np.nextafter(edges[0], -np.inf)
+        return edges.tolist()
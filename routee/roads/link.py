@@ -16,11 +16,17 @@ Examples:
 > link3 = link(args)
 """
 
+import numpy as np
 import pandas as pd 
 
 class link:
     """Object describing a link as a combination of features/attributes.
+
+    The DataFrame view (link.df) is only built when it is first used; models
+    predict from link.columns, one single-value array per attribute.
     """
+
+    __slots__ = ('attribute_dict', 'keys', 'values', 'size', '_df', 'energy_pred')
         
     def __init__(self, attribute_dict):
         
@@ -40,35 +46,34 @@ class link:
         self.attribute_dict = attribute_dict
         self.keys = list(attribute_dict)
         self.values = list(attribute_dict.values())
-        self.df = pd.DataFrame.from_dict(self.attribute_dict, orient ='index')
         self.size = len(attribute_dict)
+        self._df = None
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = pd.DataFrame.from_dict(self.attribute_dict, orient ='index')
+        return self._df
+
+    @property
+    def columns(self):
+        return {k: np.array([v]) for k, v in self.attribute_dict.items()}
         
     def __repr__(self):
         return '{}'.format(self.attribute_dict)
 
-
-
-
-
-    ## TODO: move link.lookup() to model.predict() method
     def lookup(self, rates):
         """Lookup energy rates by feature combination of link object.
 
-        Aprintrgs:
-            rates: (obj) object describing energy consumption rate by
-                feature combination
+        Args:
+            rates: (explicitBin) trained model describing energy consumption
+                rate by feature combination
 
         Returns:
-            link object with an energy consumption variable
+            energy_pred: predicted energy consumption of the link, NaN when
+            a feature is missing, out of range or without a trained rate
 
         """
-        df_tmp = rates.df
-
-        # Downselect rates table to the link combination value
-        for ft in self.features:
-            df_tmp = df_tmp[df_tmp[ft] == self.attrb_dict[ft]]
-        e_rate = float(df_tmp.fuel_rate_gal100mi)/100.0 # gal/mi
-
-        self.energy_pred = e_rate * self.distance
+        self.energy_pred = rates.link_energy(self.attribute_dict)
 
-        return self.energy_pred
\ No newline at end of file
+        return self.energy_pred
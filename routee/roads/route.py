@@ -4,27 +4,55 @@ the sequence of a previous or proposed vehicle trip.
 
 These objects are the input to the energy rates model prediction methods.
 
+Routes keep their links as one array per attribute (route.columns), and only
+build the DataFrame view (route.df) when it is first used, so predicting a
+single route skips pandas. Many routes are predicted at once as a
+route_batch, the link arrays of all routes concatenated with the offset of
+each route.
+
 Examples:
-> from routee.roads.route import route
+> from routee.roads.route import route, route_batch
 > from routee.roads.link import link
-> 
+>
 > link1 = link(args)
 > link2 = link(args)
 > link3 = link(args)
 > route1 = route(link1, link2, link3)
+>
+> model_eb.predict(route1)                    # energy of each link
+> batch = route_batch.from_routes([route1, route2, ...])
+> link_energy, route_energy = model_eb.predict_routes(batch)
 """
 
+import numpy as np
 import pandas as pd
 
 
+def link_columns(attribute_dicts):
+    # one array per attribute over all links, NaN where a link lacks one
+    keys = list(dict.fromkeys(k for d in attribute_dicts for k in d))
+    return {k: np.array([d.get(k, np.nan) for d in attribute_dicts]) for k in keys}
+
+
 class route:
-    
+
+    __slots__ = ('attribute_dict', 'keys', 'columns', '_df')
+
     def __init__(self, attribute_dict):
         self.attribute_dict = attribute_dict
         self.keys = list(attribute_dict)
-        self.df = pd.DataFrame.from_dict(self.attribute_dict)
-        
-        
+        self.columns = {k: np.asarray(v) for k, v in attribute_dict.items()}
+        self._df = None
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = pd.DataFrame.from_dict(self.attribute_dict)
+        return self._df
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
     def __repr__(self):
         return '{}'.format(self.df)
 
@@ -33,13 +61,61 @@ class route_from_links:
     '''
     Route class takes input of Link objects
     '''
-    
+
+    __slots__ = ('links', 'columns', '_df')
+
     def __init__(self, links, *args):
         self.links = [links.attribute_dict]
         for link in args:
             self.links.append(link.attribute_dict)
-        self.df = pd.DataFrame(self.links)
-    
+        self.columns = link_columns(self.links)
+        self._df = None
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = pd.DataFrame(self.links)
+        return self._df
+
+    def __len__(self):
+        return len(self.links)
+
     def __repr__(self):
         return '{}'.format(self.links)
- 
\ No newline at end of file
+
+
+class route_batch:
+    '''
+    Many routes as one ragged array: the link attributes of all routes
+    concatenated into one array per attribute, the links of route i at
+    offsets[i]:offsets[i+1].
+    '''
+
+    __slots__ = ('columns', 'offsets')
+
+    def __init__(self, columns, offsets):
+        self.columns = {k: np.asarray(v) for k, v in columns.items()}
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_routes(cls, routes):
+        """Concatenate route or route_from_links objects, or dicts of
+        attribute lists, into one batch.
+        """
+        columns = [r.columns if hasattr(r, 'columns') else \
+                    {k: np.asarray(v) for k, v in r.items()} for r in routes]
+        lengths = [len(next(iter(c.values()))) if c else 0 for c in columns]
+        keys = list(dict.fromkeys(k for c in columns for k in c))
+        batch = {k: np.concatenate([c[k] if k in c else np.full(n, np.nan) \
+                                    for c, n in zip(columns, lengths)]) for k in keys}
+        return cls(batch, np.concatenate([[0], np.cumsum(lengths)]))
+
+    def route_index(self):
+        """Route number of every link."""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __repr__(self):
+        return 'route_batch({} routes, {} links)'.format(len(self), self.offsets[-1])
@@ -11,8 +11,24 @@ Args:
 
 Returns:
     model: Energy model class with error variables
+
+The metrics are computed by error_accumulator, which can also be fed the test
+passes chunk by chunk, e.g. for test sets that do not fit in memory, and
+merged across chunks accumulated in parallel:
+
+> acc = accumulate_errors(chunks, workers=4)   # chunks of (energy, energy_pred, distance, trip_ids)
+> acc.result()
+{'link_average_error_unweight': ..., 'trip_average_error_weight': ..., 'net_error': ...}
+> acc.bin_errors()    # per-bin breakdown, when the chunks carry bins
 """
 
+import collections
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
 
 def calc_predicted_energy(df, distance):
     """Convert energy rate + distance to energy consumption
@@ -47,20 +63,269 @@ def net_energy_error(df,energy):
     return net_error
 
 
+class error_accumulator:
+    """Streaming, mergeable state of the test error metrics.
+
+    Keeps the energy and predicted energy sums per trip, the net sums, the
+    absolute link rate errors for the median and, when bins are given, sums
+    per bin. The median is exact when exact=True (all link errors are kept)
+    and otherwise read from a log-bucket sketch within a relative error of
+    alpha, whose buckets are merged by adding counts.
+
+    Args:
+        exact: (bool) keep every link error for an exact median
+
+        alpha: (float) relative accuracy of the median sketch
+
+        bin_names: (list) names of the bin levels when bins are tuples
+    """
+
+    parts_limit = 32
+
+    def __init__(self, exact=False, alpha=0.001, bin_names=None):
+        self.exact = exact
+        self.alpha = alpha
+        self.log_gamma = math.log((1 + alpha)/(1 - alpha))
+        self.bin_names = bin_names
+        self.values = []
+        self.buckets = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self.zeros = 0
+        self.infs = 0
+        self.energy = 0.0
+        self.energy_pred = 0.0
+        self.trips = []
+        self.bins = []
+
+    def update(self, energy, energy_pred, distance, trip_ids, bins=None):
+        """Add a chunk of test passes.
+
+        Args:
+            energy, energy_pred, distance: (array-like) measured and
+            predicted energy and distance of every pass
+
+            trip_ids: (array-like) trip of every pass
+
+            bins: (array-like) optional bin key of every pass for bin_errors
+        """
+        energy = np.asarray(energy, dtype=float)
+        energy_pred = np.asarray(energy_pred, dtype=float)
+
+        # link errors; NaN is skipped like Series.median does
+        with np.errstate(divide='ignore', invalid='ignore'):
+            link_error = np.abs((energy - energy_pred)/energy)
+        link_error = link_error[~np.isnan(link_error)]
+        if self.exact:
+            self.values.append(link_error)
+        else:
+            self.add_to_sketch(link_error)
+
+        self.energy += np.nansum(energy)
+        self.energy_pred += np.nansum(energy_pred)
+
+        sums = [np.nan_to_num(energy), np.nan_to_num(energy_pred)]
+        self.trips.append(group_sums(trip_ids, sums))
+        if bins is not None:
+            distance = np.nan_to_num(np.asarray(distance, dtype=float))
+            self.bins.append(group_sums(bins, sums + [np.abs(sums[0] - sums[1]), distance,
+                                                      np.ones(len(energy))]))
+        self.compact()
+        return self
+
+    def add_to_sketch(self, link_error):
+        self.zeros += int((link_error == 0).sum())
+        self.infs += int(np.isinf(link_error).sum())
+        positive = link_error[(link_error > 0) & np.isfinite(link_error)]
+        keys, counts = np.unique(np.ceil(np.log(positive)/self.log_gamma).astype(np.int64),
+                                 return_counts=True)
+        self.buckets = merge_buckets(self.buckets, (keys, counts))
+
+    def compact(self):
+        # bound the number of pending per-chunk sums
+        if len(self.trips) > self.parts_limit:
+            self.trips = [merge_sums(self.trips, 2)]
+        if len(self.bins) > self.parts_limit:
+            self.bins = [merge_sums(self.bins, 5)]
+        if self.exact and len(self.values) > self.parts_limit:
+            self.values = [np.concatenate(self.values)]
+
+    def merge(self, other):
+        """Add the state of another accumulator, e.g. of other chunks.
+        """
+        if (self.exact, self.alpha) != (other.exact, other.alpha):
+            raise ValueError('accumulators with different median settings')
+        self.values += other.values
+        self.buckets = merge_buckets(self.buckets, other.buckets)
+        self.zeros += other.zeros
+        self.infs += other.infs
+        self.energy += other.energy
+        self.energy_pred += other.energy_pred
+        self.trips += other.trips
+        self.bins += other.bins
+        self.compact()
+        return self
+
+    def median(self):
+        """Median absolute link rate error, exact or from the sketch.
+        """
+        if self.exact:
+            values = np.concatenate(self.values) if self.values else np.empty(0)
+            return float(np.median(values)) if len(values) else float('nan')
+
+        keys, counts = self.buckets
+        n = self.zeros + int(counts.sum()) + self.infs
+        if n == 0:
+            return float('nan')
+        # the middle value, or the mean of the two middle values
+        ends = np.cumsum(counts) + self.zeros
+        gamma = math.exp(self.log_gamma)
+
+        def value_at(rank):
+            if rank < self.zeros:
+                return 0.0
+            if rank >= n - self.infs:
+                return float('inf')
+            # the bucket midpoint is within alpha of every value in it
+            k = keys[np.searchsorted(ends, rank, side='right')]
+            return 2*gamma**float(k)/(gamma + 1)
+
+        return (value_at((n - 1)//2) + value_at(n//2))/2
+
+    def result(self):
+        """The three error metrics of all_error.
+
+        Returns:
+            errors: (dict) link_average_error_unweight, trip_average_error_weight
+            and net_error
+        """
+        trip_ids, (trip_energy, trip_energy_pred) = merge_sums(self.trips, 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trip_error = (trip_energy/trip_energy.sum())*np.abs(trip_energy - trip_energy_pred)/trip_energy
+            net_error = (self.energy_pred - self.energy)/self.energy
+        return {'link_average_error_unweight': self.median(),
+                'trip_average_error_weight': float(np.nansum(trip_error)),
+                'net_error': float(net_error)}
+
+    def bin_errors(self):
+        """Error breakdown per bin.
+
+        Returns:
+            bin_errors: (DataFrame) passes, distance, energy and predicted
+            energy per bin, the net error and the absolute error as a share
+            of the bin energy
+        """
+        keys, (energy, energy_pred, abs_error, distance, passes) = merge_sums(self.bins, 5)
+        if self.bin_names is not None and len(self.bin_names) > 1:
+            index = pd.MultiIndex.from_tuples(list(keys), names=self.bin_names)
+        else:
+            index = pd.Index(keys, name=self.bin_names[0] if self.bin_names else None)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            table = pd.DataFrame({'passes': passes.astype(np.int64),
+                                  'distance': distance,
+                                  'energy': energy,
+                                  'energy_pred': energy_pred,
+                                  'net_error': (energy_pred - energy)/energy,
+                                  'abs_error': abs_error/energy}, index=index)
+        return table
+
+
+def group_sums(keys, columns):
+    """Sum every column by key, skipping missing keys as groupby does.
+
+    Returns:
+        (keys, sums): (ndarray) unique keys and a list of summed columns
+    """
+    if isinstance(keys, pd.MultiIndex):
+        keys = keys.to_flat_index()
+    elif not isinstance(keys, (pd.Index, pd.Series, np.ndarray)):
+        keys = np.asarray(keys)
+    codes, uniques = pd.factorize(keys)
+    valid = codes >= 0
+    return (np.asarray(uniques, dtype=object if uniques.dtype == object else None),
+            [np.bincount(codes[valid], weights=c[valid], minlength=len(uniques)) for c in columns])
+
+
+def merge_sums(parts, n_sums):
+    if not parts:
+        return np.empty(0), [np.empty(0)]*n_sums
+    if len(parts) == 1:
+        return parts[0]
+    keys = np.concatenate([keys for keys, sums in parts])
+    codes, uniques = pd.factorize(keys)
+    return (np.asarray(uniques, dtype=object if uniques.dtype == object else None),
+            [np.bincount(codes, weights=np.concatenate([sums[i] for keys, sums in parts]),
+                         minlength=len(uniques)) for i in range(len(parts[0][1]))])
+
+
+def merge_buckets(a, b):
+    keys, codes = np.unique(np.concatenate([a[0], b[0]]), return_inverse=True)
+    return keys, np.bincount(codes, weights=np.concatenate([a[1], b[1]]),
+                             minlength=len(keys)).astype(np.int64)
+
+
+def accumulate_errors(chunks, workers=4, exact=False, alpha=0.001, bin_names=None):
+    """Accumulate the errors of many chunks in a thread pool, one
+    accumulator per chunk merged in order. Chunks are taken from the iterable
+    as earlier ones are merged, at most 2*workers at a time, so a lazy
+    iterator (e.g. over pd.read_csv(chunksize=...)) streams.
+
+    Args:
+        chunks: (iterable) tuples of (energy, energy_pred, distance,
+        trip_ids) or (energy, energy_pred, distance, trip_ids, bins)
+
+        workers: (int) chunks accumulated at the same time
+
+    Returns:
+        accumulator: (error_accumulator) merged over all chunks
+    """
+    total = error_accumulator(exact, alpha, bin_names)
+
+    def accumulate(chunk):
+        return error_accumulator(exact, alpha, bin_names).update(*chunk)
+
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk in chunks:
+            if len(pending) >= 2*workers:
+                total.merge(pending.popleft().result())
+            pending.append(pool.submit(accumulate, chunk))
+        while pending:
+            total.merge(pending.popleft().result())
+    return total
+
+
 def all_error(model):
     # Predicted Energy Consumption
     model.test = calc_predicted_energy(model.test, model.distance)
-    
+
+    # bin breakdown for models trained on binned features, keyed by the
+    # combined bin codes
+    bin_cols = [f_i + '_bins' for f_i in getattr(model, 'features', [])]
+    bins = None
+    if bin_cols and all(c in model.test for c in bin_cols):
+        codes, levels = zip(*[pd.factorize(model.test[c]) for c in bin_cols])
+        shape = [max(len(l), 1) for l in levels]
+        valid = np.logical_and.reduce([c >= 0 for c in codes])
+        bins = np.where(valid, np.ravel_multi_index(codes, shape, mode='clip'), np.nan)
+
+    # one pass over the test set, exact median as before
+    acc = error_accumulator(exact=True)
+    acc.update(model.test[model.energy].values, model.test['energy_pred'].values,
+               model.test[model.distance].values, model.test[model.trip_ids].values, bins)
+    errors = acc.result()
+
     # Link average error - unweighted
-    model.link_average_error_unweight = link_average_error_unweight(model.test,
-                                                                    model.energy)
+    model.link_average_error_unweight = errors['link_average_error_unweight']
     
     # Link average error - weighted
-    model.trip_average_error_weight = trip_average_error_weight(model.test,
-                                                                model.energy,
-                                                                model.trip_ids)
+    model.trip_average_error_weight = errors['trip_average_error_weight']
     
     # Net energy error
-    model.net_error = net_energy_error(model.test, model.energy)
+    model.net_error = errors['net_error']
+
+    if bins is not None:
+        model.bin_errors = acc.bin_errors()
+        bin_idx = np.unravel_index(model.bin_errors.index.values.astype(np.int64), shape)
+        model.bin_errors.index = pd.MultiIndex.from_arrays(
+            [level[i] for level, i in zip(levels, bin_idx)], names=model.features)
 
-    return model
\ No newline at end of file
+    return model
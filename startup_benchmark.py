@@ -0,0 +1,64 @@
+"""
+Startup-time benchmark for the pipeline entry points.
+
+Every run imports the module in a fresh interpreter with `python -X importtime`
+and parses the per-module import times from stderr. Prints the median total
+import time and the slowest top-level imports, so heavy dependencies that
+creep back into module load show up here.
+
+Examples:
+> python startup_benchmark.py
+> python startup_benchmark.py VolEstScript batch_estimate --runs 10 --top 15
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+def import_times(module):
+    """Import module in a fresh interpreter.
+
+    Returns:
+        times: (list) of (module name, self us, cumulative us, depth) in the
+        order python -X importtime reports them
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return times
+
+def benchmark(module, runs=5, top=10):
+    totals = []
+    slowest = {}
+    for _ in range(runs):
+        times = import_times(module)
+        totals.append(sum(cumulative for name, self_us, cumulative, depth in times if depth == 0))
+        for name, self_us, cumulative, depth in times:
+            # direct imports of the module, excluding the module itself
+            if depth == 1:
+                slowest.setdefault(name, []).append(cumulative)
+
+    print("%s: %.3f s median import time over %d runs (min %.3f s)"
+          % (module, statistics.median(totals) / 1e6, runs, min(totals) / 1e6))
+    ranked = sorted(slowest.items(), key=lambda item: -statistics.median(item[1]))
+    for name, cumulative in ranked[:top]:
+        print("    %8.1f ms  %s" % (statistics.median(cumulative) / 1e3, name))
+    return statistics.median(totals) / 1e6
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('modules', nargs='*', default=['VolEstScript', 'batch_estimate'],
+                        help='modules to import')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per module')
+    parser.add_argument('--top', type=int, default=10, help='slowest direct imports to list')
+    args = parser.parse_args()
+
+    for module in args.modules:
+        benchmark(module, args.runs, args.top)
@@ -0,0 +1,89 @@
+"""
+Write benchmark of the Parquet energy store against the 48 GeoJSON files.
+
+Runs the energy kernel on a synthetic network, then writes the date once as
+the 48 <date>_<hour>_<drc>.geojson files of the old build_energy_estimate and
+once with energy_store.write_energy (the network geometry plus one Parquet
+file per direction/hour). Reports bytes on disk and write time of each, and
+the time to read one slice back. Everything is written to a temporary folder.
+
+Examples:
+> python store_benchmark.py
+> python store_benchmark.py --links 100000 --model diesel_conv_BMW_X3_xDrive28d_36000_explicitbin
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import LineString
+
+from energy_store import write_energy, read_slice, folder_bytes
+from energy_benchmark import synthetic_network
+from model_registry import default_registry
+from VolEstScript import DIRECTIONS, ENERGY_COLUMNS, energy_kernel, energy_tables, input_fingerprints
+
+def synthetic_geo_network(n_links, seed=0):
+    net = synthetic_network(n_links, seed)
+    rng = np.random.default_rng(seed)
+    lon, lat = rng.uniform(-105.2, -104.8, n_links), rng.uniform(39.6, 39.9, n_links)
+    geometry = [LineString([(x, y), (x + 0.001, y + 0.001), (x + 0.002, y + 0.0015)]) for x, y in zip(lon, lat)]
+    return gpd.GeoDataFrame(net.drop(columns='geometry'), geometry=geometry, crs='EPSG:4326')
+
+def write_geojson(results_spvol_drc, Date, folder):
+    # the output of build_energy_estimate before energy_store.py
+    for name, net_selected in results_spvol_drc.items():
+        drc, hour_of_day = name.split('_')
+        file_name = "%s_%s_%s.geojson" % (Date, hour_of_day, drc)
+        gpd.GeoDataFrame(net_selected, geometry='geometry', crs=net_selected.crs) \
+            .to_file(os.path.join(folder, file_name), driver='GeoJSON')
+
+def benchmark(model, n_links=20000, Date='2020-03-10'):
+    net = synthetic_geo_network(n_links)
+    fleet = {'vehicle': (model, 1.0)}
+    metrics = energy_kernel(net, fleet)
+    fingerprints = input_fingerprints(net, fleet, ENERGY_COLUMNS)
+    results_spvol_drc = energy_tables(net, metrics)
+
+    root = tempfile.mkdtemp(prefix='store_benchmark_')
+    try:
+        geojson_dir = os.path.join(root, 'geojson')
+        os.makedirs(geojson_dir)
+        start = time.perf_counter()
+        write_geojson(results_spvol_drc, Date, geojson_dir)
+        geojson_s = time.perf_counter() - start
+
+        parquet_dir = os.path.join(root, 'parquet')
+        start = time.perf_counter()
+        written = write_energy(net, metrics, ENERGY_COLUMNS, Date, DIRECTIONS, root=parquet_dir,
+                               fingerprints=fingerprints)
+        parquet_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        gpd.read_file(os.path.join(geojson_dir, "%s_8_AB.geojson" % Date))
+        read_geojson_s = time.perf_counter() - start
+        start = time.perf_counter()
+        read_slice(Date, 'AB', 8, root=parquet_dir)
+        read_parquet_s = time.perf_counter() - start
+
+        rows = sum(len(table) for table in results_spvol_drc.values())
+        print("%d links, %d rows in 48 slices" % (n_links, rows))
+        print("GeoJSON  %11d bytes  write %7.3f s  read AB_8 %6.3f s"
+              % (folder_bytes(geojson_dir), geojson_s, read_geojson_s))
+        print("Parquet  %11d bytes  write %7.3f s  read AB_8 %6.3f s  (%d bytes reported written)"
+              % (folder_bytes(parquet_dir), parquet_s, read_parquet_s, written))
+        print("Parquet/GeoJSON: %.2f of the bytes, %.2f of the write time"
+              % (folder_bytes(parquet_dir) / folder_bytes(geojson_dir), parquet_s / geojson_s))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--model', default='gasoline_conv_Volkswagen_Tiguan_36000_explicitbin',
+                        help='model name in Vehicle_Models/')
+    parser.add_argument('--links', type=int, default=20000, help='links of the synthetic network')
+    args = parser.parse_args()
+    benchmark(default_registry().get(args.model), args.links)
@@ -0,0 +1,86 @@
+"""
+Memory benchmark of estimate_volume.py, whole-day against streaming mode.
+
+Writes a synthetic daily_data table with the columns of input_data.py to a
+temporary date folder, then runs estimate_volume.py on it in a fresh
+interpreter once on the whole table and once per chunk size. Reports the
+peak resident set size and wall time of each run. The volume model is the
+xgb.dat of the repository unless --model points elsewhere.
+
+Examples:
+> python stream_benchmark.py
+> python stream_benchmark.py --rows 3000000 --chunks 500000 100000 --format csv
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from input_data import DAILY_COLUMNS
+from intermediate_store import write_table
+
+DATE = '2020-03-10'
+
+# runs a script as __main__ and prints its peak RSS in KB. VmHWM, as ru_maxrss
+# keeps the peak of the benchmark process across the fork and exec on Linux
+PEAK_RSS = ("import resource, runpy, sys; sys.argv = sys.argv[1:]; "
+            "runpy.run_path(sys.argv[0], run_name='__main__'); "
+            "status = open('/proc/self/status').read() if sys.platform.startswith('linux') else ''; "
+            "hwm = [line.split()[1] for line in status.splitlines() if line.startswith('VmHWM:')]; "
+            "print(hwm[0] if hwm else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+
+def synthetic_daily_data(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    n_links = max(n_rows // 24, 1)
+    data = {col: rng.random(n_links * 24) for col in DAILY_COLUMNS}
+    data['Id'] = np.repeat(rng.permutation(np.arange(10**8, 10**8 + n_links)), 24)
+    data['HOUR'] = np.tile(np.arange(24), n_links)
+    data['frc'] = rng.integers(0, 7, n_links * 24)
+    data['count'] = rng.integers(0, 40, n_links * 24)
+    for col in DAILY_COLUMNS:
+        if col.startswith('DAYOFWEEK_'):
+            data[col] = np.full(n_links * 24, 1.0 if col == 'DAYOFWEEK_Tuesday' else 0.0)
+    return pd.DataFrame(data)[DAILY_COLUMNS]
+
+def run_estimate(folder, chunk_size=None):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'estimate_volume.py')
+    args = [sys.executable, '-c', PEAK_RSS, script, DATE] + ([str(chunk_size)] if chunk_size else [])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(script), os.environ.get('PYTHONPATH', '')]))
+    start = time.perf_counter()
+    proc = subprocess.run(args, cwd=folder, env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return int(proc.stdout.split()[-1]) / 1024, time.perf_counter() - start
+
+def benchmark(model_path, n_rows=1000000, chunks=(500000, 100000), fmt='parquet'):
+    folder = tempfile.mkdtemp(prefix='stream_benchmark_')
+    try:
+        os.makedirs(os.path.join(folder, DATE))
+        shutil.copy(model_path, os.path.join(folder, 'xgb.dat'))
+        daily_data = synthetic_daily_data(n_rows)
+        in_file = write_table(daily_data, os.path.join(folder, DATE, 'daily_data'), fmt)
+        print("%d rows, %s %.0f MB" % (len(daily_data), fmt, os.path.getsize(in_file) / 2**20))
+        del daily_data
+        for chunk_size in (None,) + tuple(chunks):
+            for path in os.listdir(os.path.join(folder, DATE)):
+                if path.startswith('daily_data_pred'):
+                    os.remove(os.path.join(folder, DATE, path))
+            peak_mb, seconds = run_estimate(folder, chunk_size)
+            case = 'whole table' if chunk_size is None else '%d-row chunks' % chunk_size
+            print("%-18s peak RSS %7.0f MB  wall %6.1f s" % (case, peak_mb, seconds))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--model', default='xgb.dat', help='pickled volume model')
+    parser.add_argument('--rows', type=int, default=1000000, help='rows of daily_data')
+    parser.add_argument('--chunks', type=int, nargs='*', default=[500000, 100000], help='rows per chunk')
+    parser.add_argument('--format', default='parquet', choices=['parquet', 'feather', 'csv'],
+                        help='intermediate table format')
+    args = parser.parse_args()
+    benchmark(args.model, args.rows, args.chunks, args.format)
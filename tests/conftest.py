@@ -0,0 +1,40 @@
+import glob
+import os
+import sys
+
+import pytest
+
+# the pipeline scripts are top-level modules of the repository
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+from routee.models.explicitBin import explicitBin
+
+MODEL_FOLDER = os.path.join(REPO, 'Vehicle_Models')
+MODELS = sorted(glob.glob(os.path.join(MODEL_FOLDER, '*_explicitbin.pkl')))
+
+
+@pytest.fixture
+def load_model():
+    """Read an explicitBin pickle, by path or by name in Vehicle_Models/, as a
+    new model on every call.
+    """
+    def load(path):
+        if not path.endswith('.pkl'):
+            path = os.path.join(MODEL_FOLDER, path + '.pkl')
+        model = explicitBin(path)
+        model.read_model(path)
+        return model
+    return load
+
+
+@pytest.fixture(params=MODELS, ids=lambda path: os.path.basename(path)[:-len('.pkl')])
+def model_path(request):
+    """Every explicitBin pickle of Vehicle_Models/ in turn.
+    """
+    return request.param
+
+
+@pytest.fixture
+def model_paths():
+    return list(MODELS)
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from routee.models.randomForest import randomForest
+
+
+def binned(values, edges):
+    return pd.cut(values, edges, labels=False)
+
+
+@pytest.mark.parametrize('value', [3.7, -0.25, 4.0])
+def test_constant_feature_gets_one_bracketing_bin(value):
+    values = np.array([value]*20 + [np.nan])
+    edges = randomForest.auto_bins(values, 8)
+    assert len(edges) == 2 and edges[0] < value < edges[1]
+    assert (binned(values[:-1], edges) == 0).all()
+
+
+def test_feature_without_finite_values_raises():
+    with pytest.raises(ValueError, match='grade_percent_float'):
+        randomForest.auto_bins(np.array([np.nan, np.inf, np.nan]), 8, 'grade_percent_float')
+    with pytest.raises(ValueError):
+        randomForest.auto_bins(np.array([]), 8)
+
+
+def test_every_value_falls_in_a_bin():
+    rng = np.random.RandomState(0)
+    for values in (rng.uniform(-8, 8, 1000), rng.randint(1, 5, 1000).astype(float),
+                   np.append(np.zeros(900), rng.uniform(0, 1, 100))):
+        edges = randomForest.auto_bins(values, 10)
+        assert np.all(np.diff(edges) > 0)
+        assert not np.isnan(binned(values, edges)).any()
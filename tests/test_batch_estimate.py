@@ -0,0 +1,126 @@
+import json
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+from shapely.geometry import LineString
+
+import batch_estimate
+import energy_store
+import input_data
+import lookup_cache
+import pipeline
+import tomtom_fetch
+from features_benchmark import DATE, synthetic_day
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATES = ['2020-03-%02d' % day for day in range(10, 16)]
+
+
+def fake_run_date(Date, fleet_shares=None, incremental=False):
+    # 2020-03-12 kills its worker, 2020-03-14 fails with an exception
+    time.sleep(0.05)
+    if Date == '2020-03-12':
+        os._exit(1)
+    if Date == '2020-03-14':
+        raise ValueError('bad input for ' + Date)
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(batch_estimate, 'load_static_inputs', lambda fleet_path=None: None)
+    monkeypatch.setattr(pipeline, 'run_date', fake_run_date)
+    return str(tmp_path / 'manifest.json')
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_dead_worker_fails_only_its_date(batch, workers):
+    manifest = batch_estimate.run_batch(DATES, workers, batch)
+    status = {Date: manifest[Date]['status'] for Date in DATES}
+    assert status == {Date: 'failed' if Date in ('2020-03-12', '2020-03-14') else 'done' for Date in DATES}
+    assert 'worker process died running 2020-03-12' in manifest['2020-03-12']['error']
+    assert 'ValueError' in manifest['2020-03-14']['error']
+    with open(batch) as f:
+        assert json.load(f) == manifest
+
+    # a rerun only retries the failed dates
+    manifest = batch_estimate.run_batch(DATES, workers, batch)
+    assert sorted(Date for Date in DATES if manifest[Date]['status'] != 'done') == ['2020-03-12', '2020-03-14']
+
+
+class speed_volume:
+    # stands in for the trained xgboost model, volume from the speed
+    def predict(self, X):
+        return 10.0*X[:, input_data.DAILY_COLUMNS.index('AvgSp') - 1]
+
+
+def synthetic_inputs(folder, n_links=300, seed=0):
+    # TomTom files of DATE, network, lookup, volume model and the default vehicle in folder
+    weather = synthetic_day(folder, n_links, seed)
+    tom_ids = gpd.read_file(os.path.join(folder, DATE, 'network.shp'))['Id'].values
+
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, n_links + 1)
+    net = gpd.GeoDataFrame({'ID': ids, 'ROAD_FLAG': np.where(ids % 50 == 0, 1300, 0),
+                            'Length': rng.uniform(0.01, 2, n_links),
+                            'AB_grade_p': rng.uniform(-8, 8, n_links), 'BA_grade_p': rng.uniform(-8, 8, n_links),
+                            'AB_LANES': rng.integers(0, 4, n_links).astype(float),
+                            'BA_LANES': rng.integers(0, 4, n_links).astype(float)},
+                           geometry=[LineString([(i, 0), (i, 1)]) for i in ids], crs='EPSG:4326')
+    os.makedirs(os.path.join(folder, 'Network'))
+    net.to_file(os.path.join(folder, pipeline.NETWORK_PATH))
+
+    # every link in both directions, BA as a negative sumoId
+    pd.DataFrame({'sumoId': np.concatenate([ids, -ids]),
+                  'tomId': np.concatenate([tom_ids, tom_ids[::-1]]).astype(float),
+                  'distance': rng.uniform(0, 50, 2*n_links)}).to_csv(os.path.join(folder, pipeline.LOOKUP_PATH))
+    with open(os.path.join(folder, pipeline.VOLUME_MODEL_PATH), 'wb') as f:
+        pickle.dump(speed_volume(), f)
+    os.makedirs(os.path.join(folder, 'Vehicle_Models'))
+    shutil.copy(os.path.join(REPO, 'Vehicle_Models', pipeline.DEFAULT_VEHICLE + '.pkl'),
+                os.path.join(folder, 'Vehicle_Models'))
+    return weather
+
+
+def test_batch_runs_the_pipeline_of_a_date(tmp_path, monkeypatch):
+    weather = synthetic_inputs(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tomtom_fetch, 'fetch_dates', lambda dates: {Date: {'status': 'done'} for Date in dates})
+    monkeypatch.setattr(input_data, 'get_weather', lambda Date: weather)
+    monkeypatch.setattr(pipeline, 'loaded', {})
+
+    load_static_inputs = batch_estimate.load_static_inputs
+
+    def load_in_parent(fleet_path=None):
+        load_static_inputs(fleet_path)
+
+        def loaded_again(path, *args, **kwargs):
+            if path in (pipeline.NETWORK_PATH, pipeline.LOOKUP_PATH):
+                raise AssertionError('%s loaded again in a worker' % path)
+            return read_file(path, *args, **kwargs)
+        # the forked workers find the network and lookup loaded
+        read_file = gpd.read_file
+        monkeypatch.setattr(lookup_cache, 'load_lookup', loaded_again)
+        monkeypatch.setattr(gpd, 'read_file', loaded_again)
+    monkeypatch.setattr(batch_estimate, 'load_static_inputs', load_in_parent)
+
+    manifest = batch_estimate.run_batch([DATE], 1, 'manifest.json')
+    assert manifest[DATE]['status'] == 'done', manifest[DATE].get('error')
+
+    energy = energy_store.read_energy(filters=[('date', '=', DATE)])
+    assert sorted(energy['direction'].unique()) == ['AB', 'BA']
+    assert sorted(energy['hour'].unique()) == list(range(24))
+    assert np.isfinite(energy['energy']).any() and (energy['volume'].dropna() >= 0).all()
+    # the raw TomTom files are removed after the estimate
+    assert not [f for f in os.listdir(DATE) if f.startswith(DATE)]
+
+    # the pipeline state knows the date is up to date
+    actions = pipeline.run_date(DATE, dry_run=True)
+    assert actions['energy'] == 'skip'
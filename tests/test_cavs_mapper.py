@@ -0,0 +1,48 @@
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+
+def old_cavs_rates(model, auxLoad, speedCol='speed_mph_float_bins'):
+    # cavs_mapper before vectorizing: one appended row per bin (concat in place of
+    # the removed DataFrame.append), then grouped back by the bin columns
+    rows = []
+    kwh_to_gge = 1/33.4
+    for index, row in model.model.reset_index().iterrows():
+        avgSpd = row[speedCol].mid
+        kwh100mi_add = 100.0*(auxLoad/avgSpd)
+        rate_add = kwh100mi_add
+        if model.energy == 'gallons':
+            rate_add = kwh100mi_add*kwh_to_gge
+        row.rate = row.rate + rate_add
+        rows.append(row.to_frame().T)
+    table = pd.concat(rows, ignore_index=True)
+    feat_lst = [feat + '_bins' for feat in model.features]
+    return table.groupby(by=feat_lst).agg({'rate': 'first'})['rate'].astype(float)
+
+
+@pytest.mark.parametrize('auxLoad', [0.0, 0.4, 1.5])
+def test_cavs_mapper_matches_row_append(model_path, load_model, auxLoad):
+    model = load_model(model_path)
+    expected = old_cavs_rates(model, auxLoad)
+    mapped = model.cavs_mapper(auxLoad=auxLoad).model['rate']
+    assert len(mapped) == len(expected)
+    expected = expected.reindex(mapped.index)
+    assert expected.notna().all()
+    np.testing.assert_allclose(mapped.values, expected.values, rtol=1e-12, atol=1e-14)
+
+
+def test_cavs_mapper_scenarios_match_single_runs(model_paths, load_model):
+    model = load_model(model_paths[0])
+    loads = [0.0, 0.4, 1.5]
+    mapped = model.cavs_mapper(auxLoad=loads)
+    stacked = model.cavs_mapper(auxLoad=loads, stacked=True)
+    links = pd.DataFrame({'speed_mph_float': [3.0, 33.0, 63.0], 'grade_percent_float': [-2.0, 0.5, 3.0],
+                          'miles': [0.2, 0.5, 1.0]})
+    for a in loads:
+        single = model.cavs_mapper(auxLoad=a)
+        pd.testing.assert_series_equal(mapped[a].model['rate'], single.model['rate'])
+        np.testing.assert_array_equal(stacked.loc[a, 'rate'].values, single.model['rate'].values)
+        pd.testing.assert_series_equal(mapped[a].predict(links), single.predict(links))
@@ -0,0 +1,112 @@
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import VolEstScript
+
+
+def network(n=400, seed=0):
+    # grade and speed cover NaN and out-of-range values, lanes 0 and NaN
+    rng = np.random.RandomState(seed)
+    net = {'ID': np.arange(n), 'ROAD_FLAG': rng.choice([0, 0, 0, 900, 1300], n),
+           'Length': rng.uniform(0.01, 2, n), 'geometry': ['LINESTRING (%d 0, %d 1)' % (i, i) for i in range(n)]}
+    for drc in VolEstScript.DIRECTIONS:
+        grade = rng.uniform(-10, 10, n)
+        grade[::23] = np.nan
+        lanes = rng.randint(0, 4, n).astype(float)
+        lanes[::31] = np.nan
+        net[drc + '_grade_p'] = grade
+        net[drc + '_LANES'] = lanes
+        for h in VolEstScript.HOURS:
+            speed = rng.uniform(0, 100, n)
+            speed[::37] = np.nan
+            net['speed_%s_%d' % (drc, h)] = speed
+            net['volume_%s_%d' % (drc, h)] = rng.uniform(0, 500, n)
+    return pd.DataFrame(net)
+
+
+def old_predict(model, link_df):
+    # explicitBin.predict before the rates table: pd.cut and merge on the binned columns
+    link_df = link_df.copy()
+    for f_i in model.features:
+        link_df.loc[:, f_i + '_bins'] = pd.cut(link_df[f_i], model.attrb_dict[f_i])
+    bin_cols = [f_i + '_bins' for f_i in model.features]
+    rates = model.model[['rate']].reset_index()
+    rates[bin_cols] = rates[bin_cols].astype(object)
+    link_df[bin_cols] = link_df[bin_cols].astype(object)
+    link_df = link_df.reset_index().merge(rates, how='left', on=bin_cols).set_index('index')
+    link_df.index.name = None
+    link_df.dropna(how='any', inplace=True)
+    return (link_df['rate']/100.0)*link_df[model.distance]
+
+
+def old_energy_estimate(net_merged_speed_vol, model):
+    # the per-hour loop of build_energy_estimate before the energy kernel, without the GeoJSON files
+    net_merged_speed_vol = VolEstScript.extract_extra_links(net_merged_speed_vol).copy()
+    net_merged_speed_vol[['AB_LANES', 'BA_LANES']] = net_merged_speed_vol[['AB_LANES', 'BA_LANES']].fillna(0)
+    results_spvol_drc = {}
+    for drc in ['AB', 'BA']:
+        for hour_of_day in range(24):
+            net_selected = net_merged_speed_vol[net_merged_speed_vol[drc + '_LANES'] > 0].copy()
+            net_selected['volume'] = net_selected['volume_' + drc + '_' + str(hour_of_day)]
+            net_selected['speed_mph_float'] = net_selected['speed_' + drc + '_' + str(hour_of_day)].astype(float)
+            net_selected['grade_percent_float'] = net_selected[drc + '_grade_p'].astype(float)
+            net_selected['num_lanes_int'] = net_selected[drc + '_LANES'].astype(int)
+            net_selected['miles'] = net_selected['Length'].astype(float)
+            cols = ['speed_mph_float', 'grade_percent_float', 'num_lanes_int', 'miles']
+            net_selected['energy'] = old_predict(model, net_selected[cols])
+            net_selected['energy_per_mile'] = net_selected['energy']/(net_selected['miles'])
+            results_spvol_drc[drc + "_" + str(hour_of_day)] = net_selected[VolEstScript.ENERGY_COLUMNS].copy()
+    return results_spvol_drc
+
+
+def test_energy_estimate_matches_per_hour_loop(model_path, load_model, monkeypatch):
+    monkeypatch.setattr(VolEstScript, 'write_energy', lambda *args, **kwargs: None)
+    net = network()
+    model = load_model(model_path)
+    expected = old_energy_estimate(net, model)
+    results = VolEstScript.build_energy_estimate(net.copy(), '2020-01-01', {'vehicle': (load_model(model_path), 1.0)})
+
+    assert sorted(results) == sorted(expected)
+    assert len(results) == 48
+    for name in expected:
+        pd.testing.assert_frame_equal(results[name], expected[name], check_dtype=False, rtol=1e-12)
+
+
+def test_kernel_rows_match_per_hour_loop_slices(model_paths, load_model):
+    net = VolEstScript.extract_extra_links(network(seed=1)).copy()
+    net[['AB_LANES', 'BA_LANES']] = net[['AB_LANES', 'BA_LANES']].fillna(0)
+    model = load_model(model_paths[0])
+    metrics = VolEstScript.energy_kernel(net, {'vehicle': (model, 1.0)})
+    for d, drc in enumerate(VolEstScript.DIRECTIONS):
+        for h in (0, 11, 23):
+            sub = pd.DataFrame({'speed_mph_float': net['speed_%s_%d' % (drc, h)],
+                                'grade_percent_float': net[drc + '_grade_p'],
+                                'miles': net['Length']})
+            energy = pd.Series(np.nan, index=sub.index)
+            predicted = old_predict(model, sub)
+            energy[predicted.index] = predicted
+            np.testing.assert_allclose(metrics['energy'][:, d, h], energy.values, rtol=1e-12)
+
+
+def test_mixed_fuels_sum_in_gasoline_gallon_equivalents(load_model):
+    net = VolEstScript.extract_extra_links(network(seed=2)).copy()
+    net[['AB_LANES', 'BA_LANES']] = net[['AB_LANES', 'BA_LANES']].fillna(0)
+    names = ['diesel_conv_BMW_X3_xDrive28d_36000_explicitbin', 'gasoline_conv_Volkswagen_Tiguan_36000_explicitbin',
+             'elect_ev_Mercedes-Benz_B-Class_Electric_Drive_36000_explicitbin']
+    fleet = {name: (load_model(name), share) for name, share in zip(names, [1.0, 2.0, 1.0])}
+    metrics = VolEstScript.energy_kernel(net, fleet)
+    expected = (1.136*metrics['energy_' + names[0]] + 2.0*metrics['energy_' + names[1]]
+                + metrics['energy_' + names[2]]/33.4)/4.0
+    np.testing.assert_allclose(metrics['energy'], expected, rtol=1e-12)
+
+    # diesel and gasoline gallons alone are mixed fuels too, a fuel set on the model wins over the name
+    fleet = {name: fleet[name] for name in names[:2]}
+    metrics = VolEstScript.energy_kernel(net, fleet)
+    expected = (1.136*metrics['energy_' + names[0]] + 2.0*metrics['energy_' + names[1]])/3.0
+    np.testing.assert_allclose(metrics['energy'], expected, rtol=1e-12)
+    fleet[names[0]][0].fuel = 'gasoline'
+    metrics = VolEstScript.energy_kernel(net, fleet)
+    expected = (metrics['energy_' + names[0]] + 2.0*metrics['energy_' + names[1]])/3.0
+    np.testing.assert_allclose(metrics['energy'], expected, rtol=1e-12)
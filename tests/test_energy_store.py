@@ -0,0 +1,32 @@
+import os
+
+import pytest
+import pyarrow.parquet as pq
+
+import energy_store
+
+gpd = pytest.importorskip('geopandas')
+from shapely.geometry import LineString
+
+
+def network(ids):
+    return gpd.GeoDataFrame({'ID': ids}, geometry=[LineString([(i, 0), (i, 1)]) for i in ids], crs='EPSG:4326')
+
+
+def test_failed_network_write_keeps_previous_file(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    assert energy_store.write_network(network([1, 2, 3]), root) > 0
+    assert energy_store.write_network(network([1, 2, 3]), root) == 0
+
+    def interrupted(table, path):
+        with open(path, 'wb') as f:
+            f.write(b'PAR1')
+        raise OSError('disk full')
+    monkeypatch.setattr(energy_store.pq, 'write_table', interrupted)
+    with pytest.raises(OSError):
+        energy_store.write_network(network([4, 5]), root)
+
+    assert pq.read_table(os.path.join(root, 'network.parquet'))['ID'].to_pylist() == [1, 2, 3]
+    monkeypatch.undo()
+    energy_store.write_network(network([4, 5]), root)
+    assert pq.read_table(os.path.join(root, 'network.parquet'))['ID'].to_pylist() == [4, 5]
@@ -0,0 +1,80 @@
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from routee.validation import errors
+
+
+def passes(n=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    miles = rng.uniform(0.01, 1, n)
+    rate = rng.uniform(1, 8, n)
+    test = pd.DataFrame({'trip': rng.integers(0, 300, n), 'miles': miles, 'rate': rate,
+                         'rate_pred': rate*rng.normal(1, 0.1, n), 'gallons': rate*miles/100})
+    # passes without measured energy, skipped by the median
+    test.loc[rng.random(n) < 0.01, 'gallons'] = np.nan
+    return test
+
+
+def all_error(test):
+    model = types.SimpleNamespace(test=test.copy(), energy='gallons', distance='miles', trip_ids='trip')
+    return errors.all_error(model)
+
+
+def chunks(test, size):
+    test = errors.calc_predicted_energy(test.copy(), 'miles')
+    for start in range(0, len(test), size):
+        part = test.iloc[start:start + size]
+        yield part['gallons'].values, part['energy_pred'].values, part['miles'].values, part['trip'].values
+
+
+def test_chunked_merged_and_exact_match_all_error():
+    test = passes()
+    model = all_error(test)
+    # the metrics before error_accumulator
+    df = errors.calc_predicted_energy(test.copy(), 'miles')
+    assert model.link_average_error_unweight == pytest.approx(errors.link_average_error_unweight(df, 'gallons'))
+    assert model.trip_average_error_weight == pytest.approx(
+        errors.trip_average_error_weight(df, 'gallons', 'trip'), rel=1e-9)
+    assert model.net_error == pytest.approx(errors.net_energy_error(df, 'gallons'), rel=1e-9)
+
+    expected = {'link_average_error_unweight': model.link_average_error_unweight,
+                'trip_average_error_weight': model.trip_average_error_weight,
+                'net_error': model.net_error}
+    exact = errors.accumulate_errors(chunks(test, 1500), workers=3, exact=True).result()
+    assert exact == pytest.approx(expected, rel=1e-9)
+
+    parts = list(chunks(test, 7000))
+    merged = errors.error_accumulator(exact=True).update(*parts[0])
+    merged.merge(errors.error_accumulator(exact=True).update(*parts[1])).merge(
+        errors.accumulate_errors(parts[2:], workers=2, exact=True))
+    assert merged.result() == pytest.approx(expected, rel=1e-9)
+
+    sketch = errors.accumulate_errors(chunks(test, 1500), workers=3, alpha=0.001).result()
+    assert sketch['link_average_error_unweight'] == pytest.approx(expected['link_average_error_unweight'], rel=0.001)
+    assert sketch['trip_average_error_weight'] == pytest.approx(expected['trip_average_error_weight'], rel=1e-9)
+    assert sketch['net_error'] == pytest.approx(expected['net_error'], rel=1e-9)
+
+
+def test_accumulate_errors_reads_chunks_as_it_merges(monkeypatch):
+    merged = []
+    merge = errors.error_accumulator.merge
+
+    def counted(self, other):
+        merged.append(1)
+        return merge(self, other)
+    monkeypatch.setattr(errors.error_accumulator, 'merge', counted)
+
+    ahead = []
+
+    def lazy(test, size):
+        for i, chunk in enumerate(chunks(test, size)):
+            ahead.append(i - len(merged))
+            yield chunk
+
+    workers = 2
+    errors.accumulate_errors(lazy(passes(), 500), workers=workers, exact=True)
+    assert len(ahead) == 40 and len(merged) == 40
+    assert max(ahead) <= 2*workers
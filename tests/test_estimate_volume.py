@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from estimate_volume import predict_volume
+
+
+class speed_model:
+    # volume = speed - 10, negative below 10 mph
+    def predict(self, X):
+        return X[:, 1] - 10.0
+
+
+def test_predict_volume_returns_a_new_frame():
+    daily_data = pd.DataFrame({'Id': np.array([7, 7, 9], dtype=np.int64),
+                               'HOUR': np.array([0, 1, 0], dtype=np.int32),
+                               'AvgSp': [35.0, 5.0, 12.5]})
+    before = daily_data.copy()
+    daily_data_pred = predict_volume(daily_data, speed_model())
+
+    pd.testing.assert_frame_equal(daily_data, before)
+    assert daily_data_pred is not daily_data
+    assert list(daily_data_pred.columns) == ['Id', 'HOUR', 'AvgSp', 'pred_volume']
+    assert daily_data_pred['pred_volume'].tolist() == [25.0, 0.0, 2.5]
+    pd.testing.assert_frame_equal(daily_data_pred[before.columns], before)
@@ -0,0 +1,112 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import VolEstScript
+from model_registry import registry
+
+
+def links(n=500, seed=0):
+    # one row per link and direction, the grade of BA the negative of AB
+    rng = np.random.RandomState(seed)
+    ids = np.arange(n)
+    grade = rng.uniform(-9, 9, n)
+    grade[::17] = np.nan
+    df = pd.DataFrame({'ID': np.concatenate([ids, ids]),
+                       'direction': ['AB']*n + ['BA']*n,
+                       'speed_mph_float': rng.uniform(0, 90, 2*n),
+                       'grade_percent_float': np.concatenate([grade, -grade]),
+                       'miles': rng.uniform(0.01, 2, 2*n)})
+    df['link_key'] = np.where(df['direction'] == 'AB', df['ID'], -df['ID'] - 1)
+    return df
+
+
+def test_cached_predict_matches_uncached_both_directions(model_path, load_model):
+    df = links()
+    cols = ['speed_mph_float', 'grade_percent_float', 'miles']
+    expected = {drc: load_model(model_path).predict(df[df['direction'] == drc][cols]) for drc in ('AB', 'BA')}
+
+    cached = load_model(model_path)
+    cached.link_id = 'link_key'
+    for _ in range(2):
+        for drc in ('AB', 'BA'):
+            sub = df[df['direction'] == drc]
+            pd.testing.assert_series_equal(cached.predict(sub[cols + ['link_key']]), expected[drc])
+    assert cached.bin_cache_stats()['hits'] > 0
+
+
+def test_shared_id_and_changed_value_are_misses(model_paths, load_model):
+    model = load_model(model_paths[0])
+    df = links(200)
+    cols = ['speed_mph_float', 'grade_percent_float', 'miles']
+    # the plain link ID is shared by both directions, values decide the bin
+    model.link_id = 'ID'
+    for drc in ('AB', 'BA', 'AB'):
+        sub = df[df['direction'] == drc]
+        pd.testing.assert_series_equal(model.predict(sub[cols + ['ID']]), load_model(model_paths[0]).predict(sub[cols]))
+
+    values = np.array([-7.5, 0.5, 7.5])
+    ids = np.array([1, 2, 3])
+    first = model.cached_bin_index('grade_percent_float', ids, values)
+    changed = model.cached_bin_index('grade_percent_float', ids, values[::-1])
+    np.testing.assert_array_equal(changed, first[::-1])
+    np.testing.assert_array_equal(changed, model.bin_index('grade_percent_float', values[::-1]))
+
+
+def test_energy_kernel_cache_matches_uncached(model_paths, load_model):
+    rng = np.random.RandomState(1)
+    n = 300
+    net = pd.DataFrame({'ID': np.arange(n), 'Length': rng.uniform(0.01, 2, n),
+                        'AB_grade_p': rng.uniform(-9, 9, n), 'BA_grade_p': rng.uniform(-9, 9, n),
+                        'AB_LANES': rng.randint(0, 4, n), 'BA_LANES': rng.randint(0, 4, n)})
+    for drc in VolEstScript.DIRECTIONS:
+        for h in VolEstScript.HOURS:
+            net['speed_%s_%d' % (drc, h)] = rng.uniform(0, 90, n)
+            net['volume_%s_%d' % (drc, h)] = rng.uniform(0, 500, n)
+    fleet = {path: (load_model(path), 1.0) for path in model_paths}
+    speed, volume, grade, lanes, miles = VolEstScript.kernel_inputs(net)
+    features = {'speed_mph_float': speed, 'grade_percent_float': grade, 'num_lanes_int': lanes}
+
+    expected = VolEstScript.fleet_rates(fleet, features)
+    for _ in range(2):
+        cached = VolEstScript.fleet_rates(fleet, features, VolEstScript.link_keys(net))
+        for name in fleet:
+            np.testing.assert_array_equal(cached[name], expected[name])
+    # grades of the second date differ in the BA direction only
+    features['grade_percent_float'] = grade * np.array([1, -1])[None, :, None]
+    expected = VolEstScript.fleet_rates(fleet, features)
+    cached = VolEstScript.fleet_rates(fleet, features, VolEstScript.link_keys(net))
+    for name in fleet:
+        np.testing.assert_array_equal(cached[name], expected[name])
+
+
+def test_rate_lookups_do_not_copy_the_table(model_paths, tmp_path, monkeypatch):
+    shutil.copy(model_paths[0], str(tmp_path))
+    name = os.path.basename(model_paths[0])[:-len('.pkl')]
+    model = registry(str(tmp_path)).get(name)
+    assert isinstance(model.rate_table, np.memmap)
+
+    df = links()
+    bin_idx = [model.bin_index(f_i, df[f_i]) for f_i in model.features]
+    expected = model.lookup_rates(bin_idx)
+    padded = model.padded_rates
+    np.testing.assert_array_equal(padded[:-1], np.asarray(model.rate_table).ravel())
+
+    def copied(*args, **kwargs):
+        raise AssertionError('rates table copied')
+    monkeypatch.setattr(np, 'append', copied)
+    np.testing.assert_array_equal(model.lookup_rates(bin_idx), expected)
+    features = {f_i: df[f_i].values for f_i in model.features}
+    np.testing.assert_array_equal(VolEstScript.fleet_rates({name: (model, 1.0)}, features)[name], expected)
+    assert model.padded_rates is padded
+    monkeypatch.undo()
+
+    # a new table gets its own padded rates
+    cavs_model = model.cavs_mapper(1.0)
+    assert cavs_model.padded_rates is None
+    cavs_rates = cavs_model.lookup_rates(bin_idx)
+    np.testing.assert_array_equal(cavs_model.padded_rates[:-1], cavs_model.rate_table.ravel())
+    assert not np.array_equal(cavs_rates, expected, equal_nan=True)
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+import energy_store
+import VolEstScript
+
+gpd = pytest.importorskip('geopandas')
+from shapely.geometry import LineString
+
+DATE = '2020-03-10'
+
+
+def network(n=300, seed=0):
+    rng = np.random.RandomState(seed)
+    ids = np.arange(1, n + 1)
+    net = {'ID': ids, 'ROAD_FLAG': np.where(ids % 40 == 0, 1300, 0), 'Length': rng.uniform(0.01, 2, n)}
+    for drc in VolEstScript.DIRECTIONS:
+        net[drc + '_grade_p'] = rng.uniform(-8, 8, n)
+        net[drc + '_LANES'] = rng.randint(0, 4, n).astype(float)
+        for h in VolEstScript.HOURS:
+            net['speed_%s_%d' % (drc, h)] = rng.uniform(0, 80, n)
+            net['volume_%s_%d' % (drc, h)] = rng.uniform(0, 500, n)
+    return gpd.GeoDataFrame(net, geometry=[LineString([(i, 0), (i, 1)]) for i in ids], crs='EPSG:4326')
+
+
+def stored(Date):
+    energy = energy_store.read_energy(filters=[('date', '=', Date)]).drop(columns='date')
+    energy['direction'] = energy['direction'].astype(str)
+    return energy.sort_values(['direction', 'hour', 'ID']).reset_index(drop=True)
+
+
+def slice_paths(Date):
+    return {(drc, h): os.path.join('EnergyData', 'energy', 'date=' + Date, 'direction=' + drc,
+                                   'hour=%d' % h, 'part-0.parquet')
+            for drc in VolEstScript.DIRECTIONS for h in VolEstScript.HOURS}
+
+
+def backdate_slices(Date):
+    # backdate every slice, a rewritten one gets a new mtime
+    for path in slice_paths(Date).values():
+        os.utime(path, (0, 0))
+
+
+def rewritten(Date):
+    return sorted(key for key, path in slice_paths(Date).items() if os.stat(path).st_mtime > 0)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch, model_paths, load_model):
+    monkeypatch.chdir(tmp_path)
+    fleet = {'vehicle': (load_model(model_paths[0]), 1.0)}
+
+    def build(net, Date=DATE, incremental=False):
+        VolEstScript.build_energy_estimate(net.copy(), Date, fleet, incremental)
+        return stored(Date)
+    return build
+
+
+def test_incremental_rerun_matches_full_run(store):
+    net = network()
+    store(net)
+    backdate_slices(DATE)
+
+    # unchanged inputs: nothing is rewritten
+    store(net, incremental=True)
+    assert rewritten(DATE) == []
+
+    # one link changes speed in one hour, and another its BA grade (all hours)
+    changed = net.copy()
+    speed_link = np.flatnonzero(changed['AB_LANES'].values > 0)[3]
+    changed.loc[speed_link, 'speed_AB_5'] += 20.0
+    grade_link = np.flatnonzero(changed['BA_LANES'].values > 0)[7]
+    changed.loc[grade_link, 'BA_grade_p'] = -changed.loc[grade_link, 'BA_grade_p']
+    result = store(changed, incremental=True)
+
+    assert rewritten(DATE) == sorted([('AB', 5)] + [('BA', h) for h in VolEstScript.HOURS])
+    expected = store(changed, Date='2020-03-11')
+    assert len(result) == len(expected)
+    assert (result['fingerprint'] != 0).all()
+    assert result.equals(expected)
+
+
+def test_removed_link_rewrites_its_slices(store):
+    net = network()
+    store(net)
+    backdate_slices(DATE)
+
+    link = np.flatnonzero((net['AB_LANES'].values > 0) & (net['BA_LANES'].values == 0))[0]
+    changed = net.drop(index=link).reset_index(drop=True)
+    result = store(changed, incremental=True)
+
+    assert rewritten(DATE) == [('AB', h) for h in VolEstScript.HOURS]
+    assert net.loc[link, 'ID'] not in result['ID'].values
+    assert result.equals(store(changed, Date='2020-03-11'))
+
+
+def test_store_without_fingerprints_falls_back_to_a_full_run(store):
+    net = network()
+    store(net)
+    # a store written before fingerprints were kept
+    for path in slice_paths(DATE).values():
+        pq.write_table(pq.read_table(path).drop(['fingerprint']), path)
+    assert 'fingerprint' not in stored(DATE)
+    backdate_slices(DATE)
+
+    changed = net.copy()
+    changed.loc[np.flatnonzero(changed['AB_LANES'].values > 0)[0], 'speed_AB_0'] += 20.0
+    result = store(changed, incremental=True)
+    assert len(rewritten(DATE)) == 2*len(VolEstScript.HOURS)
+    assert result.equals(store(changed, Date='2020-03-11'))
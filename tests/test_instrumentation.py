@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+
+import pytest
+
+import instrumentation
+
+
+@pytest.fixture
+def profiled(monkeypatch, tmp_path):
+    monkeypatch.setattr(instrumentation, 'ENABLED', True)
+    monkeypatch.chdir(tmp_path)
+    instrumentation.reset()
+    yield monkeypatch
+    instrumentation.reset()
+
+
+def burn(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_cpu_time_is_per_thread(profiled):
+    busy = threading.Thread(target=burn, args=(0.5,))
+    busy.start()
+    with instrumentation.span('wait'):
+        time.sleep(0.3)
+    busy.join()
+    record, = instrumentation.records
+    assert record['wall_s'] >= 0.3
+    assert record['cpu_s'] < 0.1
+
+
+def test_auto_profile_dumps_slowest_span(profiled, tmp_path):
+    profiled.setattr(instrumentation, 'PROFILE_SPAN', 'auto')
+    with instrumentation.span('outer'):
+        burn(0.05)
+        with instrumentation.span('inner'):
+            burn(0.3)
+    with instrumentation.span('other'):
+        burn(0.1)
+    instrumentation.write_report(str(tmp_path / 'run_report.json'))
+    report = instrumentation.report()
+    assert report['hottest'] == 'inner'
+    assert report['profile'] == 'inner.prof'
+    assert (tmp_path / 'inner.prof').exists()
+    assert not (tmp_path / 'outer.prof').exists()
+
+
+def test_named_profile_includes_child_spans(profiled, tmp_path):
+    import pstats
+    profiled.setattr(instrumentation, 'PROFILE_SPAN', 'outer')
+    with instrumentation.span('outer'):
+        with instrumentation.span('inner'):
+            burn(0.05)
+    functions = {f[2] for f in pstats.Stats(str(tmp_path / 'outer.prof')).stats}
+    assert 'burn' in functions
+    assert instrumentation.report()['profile'] is None
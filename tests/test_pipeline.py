@@ -0,0 +1,162 @@
+import os
+
+import pytest
+
+import pipeline
+from pipeline import PipelineError, stage
+
+
+def test_topological_order():
+    stages = [stage('c', None, ['a', 'b']), stage('b', None, ['a']), stage('a', None), stage('d', None, after=['c'])]
+    assert pipeline.topological_order(stages) == ['a', 'b', 'c', 'd']
+    with pytest.raises(PipelineError, match='cycle'):
+        pipeline.topological_order([stage('a', None, ['b']), stage('b', None, ['a'])])
+    with pytest.raises(PipelineError, match='unknown stage x'):
+        pipeline.topological_order([stage('a', None, ['x'])])
+
+
+def test_stage_keys_follow_inputs(tmp_path):
+    source = tmp_path / 'source.csv'
+    source.write_text('1')
+    stages = [stage('a', None, sources=[str(source)]), stage('b', None, ['a'], params={'n': 1}), stage('c', None)]
+    by_name = {s.name: s for s in stages}
+    keys = pipeline.stage_keys(['a', 'b', 'c'], by_name)
+
+    by_name['b'].params = {'n': 2}
+    changed = pipeline.stage_keys(['a', 'b', 'c'], by_name)
+    assert (changed['a'], changed['c']) == (keys['a'], keys['c']) and changed['b'] != keys['b']
+
+    source.write_text('12')
+    changed = pipeline.stage_keys(['a', 'b', 'c'], by_name)
+    assert changed['a'] != keys['a'] and changed['b'] != keys['b'] and changed['c'] == keys['c']
+
+
+class toy:
+    """source.txt -> parsed (checkpointed) -> total (stored, final), calls
+    counted by stage.
+    """
+
+    def __init__(self, folder, scale=1):
+        self.folder = folder
+        self.scale = scale
+        self.calls = []
+        self.source = os.path.join(folder, 'source.txt')
+        self.checkpoint = os.path.join(folder, 'parsed.txt')
+        self.output = os.path.join(folder, 'total.txt')
+        self.state_path = os.path.join(folder, 'state.json')
+
+    def parse(self):
+        self.calls.append('parsed')
+        with open(self.source) as f:
+            return [int(v) for v in f.read().split()]
+
+    def save(self, values):
+        with open(self.checkpoint, 'w') as f:
+            f.write(' '.join(map(str, values)))
+
+    def load(self):
+        self.calls.append('load parsed')
+        with open(self.checkpoint) as f:
+            return [int(v) for v in f.read().split()]
+
+    def total(self, values):
+        self.calls.append('total')
+        with open(self.output, 'w') as f:
+            f.write(str(self.scale*sum(values)))
+
+    def stages(self):
+        return [stage('parsed', self.parse, sources=[self.source],
+                      stored=lambda: os.path.exists(self.checkpoint), save=self.save, load=self.load),
+                stage('total', self.total, ['parsed'], params={'scale': self.scale},
+                      stored=lambda: os.path.exists(self.output), final=True)]
+
+    def run(self, **kwargs):
+        self.calls = []
+        return pipeline.run(self.stages(), self.state_path, **kwargs)
+
+    def result(self):
+        with open(self.output) as f:
+            return int(f.read())
+
+
+@pytest.fixture
+def dag(tmp_path):
+    d = toy(str(tmp_path))
+    with open(d.source, 'w') as f:
+        f.write('1 2 3')
+    return d
+
+
+def test_unchanged_rerun_skips(dag):
+    assert dag.run() == {'parsed': 'run', 'total': 'run'}
+    assert dag.calls == ['parsed', 'total'] and dag.result() == 6
+
+    assert dag.run() == {'parsed': None, 'total': 'skip'}
+    assert dag.calls == []
+    assert dag.run(force=['total']) == {'parsed': 'load', 'total': 'run'}
+
+
+def test_changed_source_reruns(dag):
+    dag.run()
+    st = os.stat(dag.source)
+    os.utime(dag.source, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert dag.run(dry_run=True) == {'parsed': 'run', 'total': 'run'}
+    assert dag.calls == []
+
+    with open(dag.source, 'w') as f:
+        f.write('1 2 3 4')
+    assert dag.run() == {'parsed': 'run', 'total': 'run'}
+    assert dag.result() == 10
+
+
+def test_changed_stage_loads_its_input_from_the_checkpoint(dag):
+    dag.run()
+    dag.scale = 10
+    assert dag.run() == {'parsed': 'load', 'total': 'run'}
+    assert dag.calls == ['load parsed', 'total'] and dag.result() == 60
+
+    # without the checkpoint the input runs again
+    os.remove(dag.checkpoint)
+    dag.scale = 100
+    assert dag.run() == {'parsed': 'run', 'total': 'run'}
+    assert dag.result() == 600
+
+
+def test_missing_stored_output_reruns(dag):
+    dag.run()
+    os.remove(dag.output)
+    assert dag.run() == {'parsed': 'load', 'total': 'run'}
+
+
+def test_failed_stage_keeps_the_state_of_finished_ones(dag):
+    dag.run()
+    with open(dag.source, 'w') as f:
+        f.write('5 5')
+
+    def fail(values):
+        raise ValueError('disk full')
+    dag.total = fail
+    with pytest.raises(ValueError):
+        dag.run()
+    del dag.total
+    assert dag.run() == {'parsed': 'load', 'total': 'run'} and dag.result() == 10
+
+
+def test_rerun_without_raw_files_or_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    Date = '2020-03-10'
+    os.makedirs(Date)
+    stages = pipeline.date_stages(Date)
+    by_name = {s.name: s for s in stages}
+    order = pipeline.topological_order(stages)
+    keys = pipeline.stage_keys(order, by_name)
+    # an earlier run fetched the date and stored its energy, then removed the TomTom files
+    state_path = os.path.join(pipeline.STATE_FOLDER, Date + '.json')
+    pipeline.write_state({'fetch': keys['fetch'], 'energy': keys['energy']}, state_path)
+    os.makedirs(os.path.join('EnergyData', 'energy', 'date=' + Date))
+
+    assert pipeline.run(stages, state_path, dry_run=True)['energy'] == 'skip'
+    actions = pipeline.run(stages, state_path, force=['energy'], dry_run=True)
+    assert (actions['fetch'], actions['daily_data']) == ('load', 'run')
+    with pytest.raises(PipelineError, match='--checkpoint'):
+        pipeline.features(Date)
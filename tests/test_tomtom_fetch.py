@@ -0,0 +1,224 @@
+import asyncio
+import io
+import json
+import os
+import tarfile
+
+import numpy as np
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import tomtom_fetch
+
+DATE = '2020-03-10'
+
+
+def archive():
+    # incompressible members, so the archive spans several download chunks
+    rng = np.random.RandomState(0)
+    members = {DATE + '_%d.json' % i: rng.bytes(150000) for i in range(3)}
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue(), members
+
+
+class stub:
+    """TomTom status and download endpoints. status_replies and
+    download_replies are consumed one per request, the last one repeats.
+    """
+
+    def __init__(self, data, status_replies, download_replies):
+        self.data = data
+        self.status_replies = list(status_replies)
+        self.download_replies = list(download_replies)
+        self.status_requests = 0
+        self.ranges = []
+
+    def next_reply(self, replies):
+        return replies.pop(0) if len(replies) > 1 else replies[0]
+
+    async def status(self, request):
+        self.status_requests += 1
+        reply = self.next_reply(self.status_replies)
+        if isinstance(reply, int):
+            return web.Response(status=reply)
+        urls = ['a', 'b', str(request.url.with_path('/archive'))] if reply == 'DONE' else []
+        return web.json_response({'jobState': reply, 'urls': urls})
+
+    async def download(self, request):
+        header = request.headers.get('Range')
+        self.ranges.append(header)
+        reply = self.next_reply(self.download_replies)
+        if isinstance(reply, int):
+            return web.Response(status=reply)
+        offset = int(header[len('bytes='):-1]) if header and reply != 'ignore_range' else 0
+        body = self.data[offset:]
+        response = web.StreamResponse(status=206 if offset else 200,
+                                      headers={'Content-Length': str(len(body))})
+        await response.prepare(request)
+        if reply == 'drop':
+            # connection lost after a third of the remaining bytes
+            await response.write(body[:len(body)//3])
+            await asyncio.sleep(0.05)
+            request.transport.close()
+            return response
+        if reply == 'stall':
+            await response.write(body[:len(body)//3])
+            await asyncio.sleep(1.0)
+            return response
+        await response.write(body)
+        await response.write_eof()
+        return response
+
+
+def run(server_stub, dates=(DATE,), **kwargs):
+    async def main():
+        app = web.Application()
+        app.router.add_get('/status/{job_id}', server_stub.status)
+        app.router.add_get('/archive', server_stub.download)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            return await tomtom_fetch.fetch_all(list(dates), status_url=str(server.make_url('/status/')),
+                                                poll_base=0.01, poll_cap=0.05, **kwargs)
+        finally:
+            await server.close()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('job')
+    with open(os.path.join('job', DATE + '_job.json'), 'w') as f:
+        json.dump({'Id': '1234'}, f)
+    return tmp_path
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    # record the backoff attempts and keep the real bounds, without the wait
+    calls = []
+    backoff = tomtom_fetch.backoff
+
+    def recorded(attempt, base, cap):
+        calls.append((attempt, base, cap, backoff(attempt, base, cap)))
+        return 0.001
+    monkeypatch.setattr(tomtom_fetch, 'backoff', recorded)
+    return calls
+
+
+def extracted(members):
+    for name, data in members.items():
+        with open(os.path.join(DATE, name), 'rb') as f:
+            assert f.read() == data
+    assert not os.path.exists(DATE + '.tar.gz.part')
+
+
+def test_backoff_is_capped_with_jitter():
+    for attempt in range(12):
+        delay = min(300, 15 * 2 ** attempt)
+        values = [tomtom_fetch.backoff(attempt, 15, 300) for _ in range(50)]
+        assert all(delay/2 <= v <= delay for v in values)
+
+
+def test_rate_limited_and_failing_status_polls_back_off(workdir, delays):
+    data, members = archive()
+    server_stub = stub(data, [429, 429, 503, 'IN_PROGRESS', 'DONE'], ['ok'])
+    results = run(server_stub)
+    assert results[DATE]['status'] == 'done', results
+    assert server_stub.status_requests == 5
+    assert [attempt for attempt, base, cap, delay in delays] == [0, 1, 2, 3]
+    assert all(base == 0.01 and cap == 0.05 for attempt, base, cap, delay in delays)
+    extracted(members)
+
+
+def test_dropped_download_resumes_with_range(workdir, delays):
+    data, members = archive()
+    server_stub = stub(data, ['DONE'], ['drop', 429, 'drop', 'ok'])
+    results = run(server_stub)
+    assert results[DATE]['status'] == 'done', results
+    assert results[DATE]['bytes'] == len(data)
+    assert server_stub.ranges[0] is None
+    # every retry asks for the bytes after those already on disk
+    offsets = [int(r[len('bytes='):-1]) for r in server_stub.ranges[1:]]
+    assert offsets[0] == len(data)//3 and offsets == sorted(offsets) and offsets[-1] < len(data)
+    # the rate limited retry backs off further, the attempts reset once bytes arrive
+    assert [attempt for attempt, base, cap, delay in delays] == [0, 1, 0]
+    extracted(members)
+
+
+def test_stalled_download_resumes(workdir, delays):
+    data, members = archive()
+    server_stub = stub(data, ['DONE'], ['stall', 'ok'])
+    results = run(server_stub, stall_timeout=0.3)
+    assert results[DATE]['status'] == 'done', results
+    assert server_stub.ranges[1] == 'bytes=%d-' % (len(data)//3)
+    extracted(members)
+
+
+def test_restart_resumes_from_partial_file(workdir, delays):
+    data, members = archive()
+    with open(DATE + '.tar.gz.part', 'wb') as f:
+        f.write(data[:100000])
+    server_stub = stub(data, ['DONE'], ['ok'])
+    results = run(server_stub)
+    assert results[DATE]['status'] == 'done', results
+    assert server_stub.ranges == ['bytes=100000-']
+    extracted(members)
+
+
+def test_server_ignoring_range_is_skipped_to_offset(workdir, delays):
+    data, members = archive()
+    with open(DATE + '.tar.gz.part', 'wb') as f:
+        f.write(data[:100000])
+    server_stub = stub(data, ['DONE'], ['ignore_range'])
+    results = run(server_stub)
+    assert results[DATE]['status'] == 'done', results
+    extracted(members)
+
+
+def test_client_errors_fail_the_date_only(workdir, delays):
+    data, members = archive()
+    with open(os.path.join('job', '2020-03-11_job.json'), 'w') as f:
+        json.dump({'Id': 'NA'}, f)
+    server_stub = stub(data, ['DONE'], [404])
+    results = run(server_stub, dates=(DATE, '2020-03-11'))
+    assert results[DATE]['status'] == 'failed' and 'HTTP 404' in results[DATE]['error']
+    assert results['2020-03-11']['status'] == 'failed'
+    assert not os.path.exists(DATE)
+
+
+def test_failed_job_state_fails(workdir, delays):
+    data, members = archive()
+    results = run(stub(data, ['IN_PROGRESS', 'ERROR'], ['ok']))
+    assert results[DATE]['status'] == 'failed' and 'ERROR' in results[DATE]['error']
+
+
+def test_concurrent_downloads_are_limited(workdir, delays, monkeypatch):
+    active = [0, 0]
+    download_archive = tomtom_fetch.download_archive
+
+    async def counted(*args, **kwargs):
+        active[0] += 1
+        active[1] = max(active)
+        try:
+            await asyncio.sleep(0.05)
+            return await download_archive(*args, **kwargs)
+        finally:
+            active[0] -= 1
+    monkeypatch.setattr(tomtom_fetch, 'download_archive', counted)
+    data, members = archive()
+    dates = ['2020-03-%02d' % day for day in (10, 11, 12, 13)]
+    for Date in dates[1:]:
+        with open(os.path.join('job', Date + '_job.json'), 'w') as f:
+            json.dump({'Id': Date}, f)
+    server_stub = stub(data, ['DONE'], ['ok'])
+    results = run(server_stub, dates=dates, downloads=2)
+    assert all(result['status'] == 'done' for result in results.values()), results
+    assert active[1] == 2
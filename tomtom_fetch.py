@@ -0,0 +1,266 @@
+"""
+Fetch TomTom Traffic Stats results for one or many dates concurrently.
+
+Replaces get_api.R. post_api.R creates one job per date and stores its id in
+./job/<date>_job.json. For every date this polls the job status with
+exponential backoff and jitter until the result urls are ready, then streams
+the archive to ./<date>.tar.gz.part while extracting it on the fly into
+./<date>. All dates share one pooled HTTP session. A stalled or dropped
+download resumes from the bytes already on disk with an HTTP Range request,
+also after a restart of the process. ./<date> only appears once the archive
+is completely extracted.
+
+Examples:
+> python tomtom_fetch.py 2020-03-10
+> python tomtom_fetch.py 2020-03-01 2020-03-02 2020-03-03 --downloads 4
+
+Or from python:
+> from tomtom_fetch import fetch_dates
+>
+> fetch_dates(['2020-03-10', '2020-03-11'])
+{'2020-03-10': {'status': 'done', ...}, '2020-03-11': {'status': 'done', ...}}
+
+The status url can be pointed at a local server with --status-url to
+simulate job states.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import queue
+import random
+import shutil
+import tarfile
+import time
+
+import aiohttp
+
+STATUS_URL = "https://api.tomtom.com/traffic/trafficstats/status/1/"
+API_KEY = os.environ.get('TOMTOM_API_KEY', 'j8DuYC17MaGl0UcKLcI9gGSd1e3rpvaJ')
+URL_INDEX = 2  # the archive among the result urls, urls[[3]] in get_api.R
+DONE_STATES = {'DONE'}
+FAILED_STATES = {'ERROR', 'REJECTED', 'CANCELLED', 'EXPIRED'}
+CHUNK_SIZE = 1 << 16
+
+class FetchError(Exception):
+    pass
+
+def backoff(attempt, base, cap):
+    # exponential with equal jitter, so concurrent pollers do not synchronize
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def read_job(Date, job_dir='job'):
+    with open(os.path.join(job_dir, Date + '_job.json')) as f:
+        job = json.load(f)
+    if job.get('Id') in (None, 'NA'):
+        raise FetchError('TomTom data query for %s is failed' % Date)
+    return str(job['Id'])
+
+async def wait_for_job(session, job_id, status_url=STATUS_URL, poll_base=15, poll_cap=300, timeout=6 * 3600):
+    """Poll the job status until it is done.
+
+    Returns:
+        url: (str) the archive url of the finished job
+    """
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        try:
+            async with session.get(status_url + job_id, params={'key': API_KEY}) as r:
+                if r.status == 429 or r.status >= 500:
+                    raise aiohttp.ClientResponseError(r.request_info, r.history, status=r.status)
+                if r.status >= 400:
+                    raise FetchError('job %s: HTTP %d %s' % (job_id, r.status, await r.text()))
+                status = await r.json(content_type=None)
+            state = status.get('jobState')
+            urls = status.get('urls') or []
+            if state in FAILED_STATES:
+                raise FetchError('job %s: %s' % (job_id, state))
+            if (state in DONE_STATES or state is None) and len(urls) > URL_INDEX:
+                return urls[URL_INDEX]
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        if time.monotonic() > deadline:
+            raise FetchError('job %s: not done after %d s' % (job_id, timeout))
+        await asyncio.sleep(backoff(attempt, poll_base, poll_cap))
+        attempt += 1
+
+class _pipe:
+    """Blocking file object for the extracting thread, fed chunk by chunk
+    from the event loop.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=64)
+        self.buffer = bytearray()
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.queue.get()
+            if chunk is None:
+                self.eof = True
+            else:
+                self.buffer += chunk
+        size = len(self.buffer) if size < 0 else size
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    async def write(self, chunk, extracting):
+        while True:
+            if extracting.done():
+                # the archive is broken, surface the extraction error
+                extracting.result()
+                raise FetchError('archive ended before the download')
+            try:
+                self.queue.put_nowait(chunk)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.005)
+
+    async def close(self, extracting):
+        while not extracting.done():
+            try:
+                self.queue.put_nowait(None)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.005)
+
+def extract_stream(fileobj, dest):
+    # r|gz reads the archive strictly in order, members go to disk as they arrive
+    os.makedirs(dest)
+    root = os.path.realpath(dest)
+    with tarfile.open(fileobj=fileobj, mode='r|gz') as tar:
+        for member in tar:
+            path = os.path.realpath(os.path.join(dest, member.name))
+            if not (member.isfile() or member.isdir()) or not path.startswith(root + os.sep):
+                continue
+            if hasattr(tarfile, 'data_filter'):
+                tar.extract(member, dest, filter='data')
+            else:
+                tar.extract(member, dest)
+    # drain whatever follows the end-of-archive marker
+    while fileobj.read(CHUNK_SIZE):
+        pass
+
+async def download_archive(session, url, Date, executor, stall_timeout=60, retries=8):
+    """Stream the archive of one date to disk and extract it into ./<Date>,
+    resuming from ./<Date>.tar.gz.part after stalls, dropped connections and
+    restarts.
+
+    Returns:
+        size: (int) archive size in bytes
+    """
+    part_path = Date + '.tar.gz.part'
+    tmp_dir = '.' + Date + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    pipe = _pipe()
+    loop = asyncio.get_event_loop()
+    extracting = loop.run_in_executor(executor, extract_stream, pipe, tmp_dir)
+
+    try:
+        with open(part_path, 'ab+') as part:
+            # bytes from an earlier run are extracted again before downloading the rest
+            part.seek(0)
+            for chunk in iter(lambda: part.read(CHUNK_SIZE), b''):
+                await pipe.write(chunk, extracting)
+            offset = part.tell()
+
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=stall_timeout)
+            attempt = 0
+            while True:
+                headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+                try:
+                    async with session.get(url, headers=headers, timeout=timeout) as r:
+                        if r.status == 416:
+                            break
+                        r.raise_for_status()
+                        # a server ignoring Range resends from the start
+                        skip = offset if r.status == 200 else 0
+                        async for chunk in r.content.iter_chunked(CHUNK_SIZE):
+                            if skip:
+                                chunk, skip = chunk[skip:], max(0, skip - len(chunk))
+                                if not chunk:
+                                    continue
+                            part.write(chunk)
+                            offset += len(chunk)
+                            await pipe.write(chunk, extracting)
+                            attempt = 0
+                    break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if isinstance(e, aiohttp.ClientResponseError) and 400 <= e.status < 500 and e.status != 429:
+                        raise FetchError('%s: HTTP %d downloading archive' % (Date, e.status))
+                    if attempt >= retries:
+                        raise FetchError('%s: download failed after %d retries: %r' % (Date, retries, e))
+                    await asyncio.sleep(backoff(attempt, 1, 60))
+                    attempt += 1
+    finally:
+        await pipe.close(extracting)
+        await asyncio.wait([extracting])
+
+    extracting.result()
+    shutil.rmtree(Date, ignore_errors=True)
+    os.rename(tmp_dir, Date)
+    os.remove(part_path)
+    return offset
+
+async def fetch_date(session, Date, semaphore, executor, status_url=STATUS_URL, job_dir='job',
+                     poll_base=15, poll_cap=300, timeout=6 * 3600, stall_timeout=60):
+    start = time.time()
+    if os.path.isdir(Date):
+        return {'status': 'done', 'seconds': 0.0, 'cached': True}
+    try:
+        job_id = read_job(Date, job_dir)
+        url = await wait_for_job(session, job_id, status_url, poll_base, poll_cap, timeout)
+        ready = time.time()
+        async with semaphore:
+            size = await download_archive(session, url, Date, executor, stall_timeout)
+    except (FetchError, OSError, tarfile.TarError, EOFError) as e:
+        return {'status': 'failed', 'seconds': time.time() - start, 'error': str(e)}
+    return {'status': 'done', 'seconds': time.time() - start,
+            'wait_seconds': ready - start, 'bytes': size}
+
+async def fetch_all(dates, downloads=4, insecure=False, **kwargs):
+    limit = max(downloads * 2, 10)
+    connector = aiohttp.TCPConnector(limit=limit, ssl=False) if insecure else aiohttp.TCPConnector(limit=limit)
+    semaphore = asyncio.Semaphore(downloads)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=downloads) as executor:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            results = await asyncio.gather(*[fetch_date(session, Date, semaphore, executor, **kwargs)
+                                             for Date in dates])
+    return dict(zip(dates, results))
+
+def fetch_dates(dates, downloads=4, insecure=False, **kwargs):
+    """Fetch and extract the TomTom archives of all dates, see fetch_date
+    for the keyword arguments.
+
+    Returns:
+        results: (dict) date -> status dict
+    """
+    return asyncio.run(fetch_all(list(dates), downloads, insecure, **kwargs))
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('dates', nargs='+', help='dates as YYYY-MM-dd')
+    parser.add_argument('--downloads', type=int, default=4, help='concurrent archive downloads')
+    parser.add_argument('--status-url', default=STATUS_URL, help='job status endpoint, job id is appended')
+    parser.add_argument('--job-dir', default='job', help='folder of <date>_job.json files from post_api.R')
+    parser.add_argument('--poll-base', type=float, default=15, help='first status poll delay in seconds')
+    parser.add_argument('--poll-cap', type=float, default=300, help='longest status poll delay in seconds')
+    parser.add_argument('--timeout', type=float, default=6 * 3600, help='give up on a job after seconds')
+    parser.add_argument('--stall-timeout', type=float, default=60, help='resume a download idle for seconds')
+    parser.add_argument('--insecure', action='store_true',
+                        help='skip TLS certificate checks, like ssl_verifypeer = 0 in the R scripts')
+    args = parser.parse_args()
+
+    results = fetch_dates(args.dates, args.downloads, args.insecure, status_url=args.status_url,
+                          job_dir=args.job_dir, poll_base=args.poll_base, poll_cap=args.poll_cap,
+                          timeout=args.timeout, stall_timeout=args.stall_timeout)
+    for Date, result in results.items():
+        print(Date, result['status'], result.get('error', ''))
+    failed = [Date for Date, result in results.items() if result['status'] != 'done']
+    print("Done!!! %d failed: %s" % (len(failed), ' '.join(failed)))